@@ -2,8 +2,6 @@
 import os, json, time, subprocess, tempfile
 import numpy as np
 import cv2, tifffile
-from tkinter import Toplevel, Label, Button, Radiobutton, StringVar, messagebox
-from PIL import Image, ImageTk
 
 # ===== Réglages “light” =====
 PREVIEW_MAX_PIX = 2_000_000   # ~2 MP
@@ -13,6 +11,14 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 VIPS_EXE = os.path.join(BASE_DIR, "tools", "libvips", "bin", "vips.exe")
 
 # ===== Imports optionnels =====
+# Tk / ImageTk : seulement pour la preview et le pipeline GUI (detect_slide_mask tourne sans affichage)
+try:
+    from tkinter import Toplevel, Label, Button, Radiobutton, StringVar, messagebox
+    from PIL import Image, ImageTk
+except Exception:
+    Toplevel = Label = Button = Radiobutton = StringVar = messagebox = None
+    Image = ImageTk = None
+
 try:
     import openslide
 except Exception:
@@ -244,24 +250,16 @@ def detect_slide_mask(image_path: str, output_json_path: str,
 
 # ---------- Fenêtre de preview persistante ----------
 def _show_preview_window(root, title, img_rgb, mask_bin, overlay_rgb, save_path_png=None):
+    from viewer import TileViewer, ArraySource
     win = Toplevel(root); win.title(f"Prévisualisation — {title}")
     win.geometry("980x800"); win.configure(bg="#151829")
     mode = StringVar(value="overlay")
-    lbl = Label(win, bg="#151829"); lbl.pack(fill="both", expand=True, padx=10, pady=10)
-
-    def to_photo(arr):
-        im = Image.fromarray(arr)
-        maxw = max(400, win.winfo_width() - 40)
-        maxh = max(300, win.winfo_height() - 140)
-        im.thumbnail((maxw, maxh), Image.LANCZOS)
-        return ImageTk.PhotoImage(im)
 
-    mask_rgb = cv2.cvtColor(mask_bin, cv2.COLOR_GRAY2RGB)
-    current = {"p": None}
+    # une pyramide par vue, réduite à la demande ; seules les tuiles visibles sont mises à l’échelle
+    sources = {"overlay": ArraySource(overlay_rgb), "masque": ArraySource(mask_bin), "image": ArraySource(img_rgb)}
+    view = TileViewer(win, sources["overlay"]); view.pack(fill="both", expand=True, padx=10, pady=10)
     def refresh():
-        m = mode.get()
-        arr = overlay_rgb if m == "overlay" else (mask_rgb if m == "masque" else img_rgb)
-        p = to_photo(arr); current["p"] = p; lbl.config(image=p)
+        view.set_source(sources[mode.get()])
 
     def save_png():
         if not save_path_png: return
@@ -277,8 +275,6 @@ def _show_preview_window(root, title, img_rgb, mask_bin, overlay_rgb, save_path_
     Radiobutton(ctr, text="Overlay", variable=mode, value="overlay", command=refresh, bg="#151829", fg="white", selectcolor="#43b047").pack(side="left", padx=8, pady=8)
     Button(ctr, text="💾 Enregistrer overlay", command=save_png).pack(side="left", padx=10)
 
-    win.bind("<Configure>", lambda e: refresh())
-    refresh()
     root.wait_window(win)
     try: ctr.destroy()
     except Exception: pass
@@ -286,10 +282,18 @@ def _show_preview_window(root, title, img_rgb, mask_bin, overlay_rgb, save_path_
 
 # ---------- pipeline GUI ----------
 def lancer_annotation_gui(root, progress_bar, progress_pct=None, status_label=None,
-                          min_area: int = 20_000, area_ratio_thresh: float = 0.4):
+                          min_area: int = 20_000, area_ratio_thresh: float = 0.4, executer=None):
+    """
+    executer(fn, *args, **kw) : exécute le calcul d’une lame hors du thread Tk en laissant tourner la
+    boucle d’événements (cf. mainGUI._executer_en_tache). Sans executer : calcul dans le thread Tk,
+    interface rafraîchie entre deux étapes (ancien comportement).
+    """
+    run = executer or (lambda fn, *a, **kw: fn(*a, **kw))
 
     last_ui = [0.0]
     def _tick_ui(force=False):
+        if executer is not None:
+            return      # la boucle Tk tourne pendant le calcul : rien à pomper ici
         now = time.perf_counter()
         if force or (now - last_ui[0] >= 0.05):
             try: root.update_idletasks(); root.update()
@@ -346,8 +350,8 @@ def lancer_annotation_gui(root, progress_bar, progress_pct=None, status_label=No
     set_progress(0, total); set_status("🔍 Traitement de la première lame…", "orange")
 
     try:
-        nb, img_rgb, mask_bin, overlay_rgb = detect_slide_mask(first_img, first_json,
-                                                               min_area=min_area, area_ratio_thresh=area_ratio_thresh)
+        nb, img_rgb, mask_bin, overlay_rgb = run(detect_slide_mask, first_img, first_json,
+                                                 min_area=min_area, area_ratio_thresh=area_ratio_thresh)
         set_progress(1, total)
         set_status(f"📁 JSON enregistré  •  1/{total}  •  {os.path.basename(first_json)}  •  contours = {nb}", "lime")
         _show_preview_window(root, base0, img_rgb, mask_bin, overlay_rgb, save_path_png=first_png)
@@ -375,8 +379,8 @@ def lancer_annotation_gui(root, progress_bar, progress_pct=None, status_label=No
         out_js = os.path.join(ANNOTATED_DIR, base + "_annotation.json")
         set_status(f"🧩 {idx}/{total}  •  {os.path.basename(img_path)}", "orange"); _tick_ui()
         try:
-            nb, _, _, _ = detect_slide_mask(img_path, out_js,
-                                            min_area=min_area, area_ratio_thresh=area_ratio_thresh)
+            nb, _, _, _ = run(detect_slide_mask, img_path, out_js,
+                              min_area=min_area, area_ratio_thresh=area_ratio_thresh)
             set_status(f"📁 JSON enregistré  •  {idx}/{total}  •  {os.path.basename(out_js)}  •  contours = {nb}", "lime")
         except Exception as e:
             messagebox.showwarning("Avertissement", f"Impossible de traiter {os.path.basename(img_path)}\n{e}", parent=root)
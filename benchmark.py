@@ -0,0 +1,262 @@
+# benchmark.py — lames synthétiques + chronométrage de chaque étape du pipeline
+#
+#   python benchmark.py                       → génère, mesure, compare à benchmark_baseline.json
+#   python benchmark.py --update-baseline     → (ré)écrit la référence avec la mesure courante
+# La référence dépend de la machine (non versionnée) : sans elle, le benchmark échoue (code 2) au lieu
+# de passer en silence ; la créer une fois avec --update-baseline.
+#
+# Aucune lame patient : les lames sont des TIFF pyramidaux tuilés générés (tissu, noyaux DAB/hématoxyline,
+# amas), emballés dans des ZIP <PatientID>_<Antigene>.zip comme en routine.
+import os, sys, json, time, shutil, zipfile, argparse, tempfile
+import numpy as np
+import cv2
+
+import cell_detection as cd
+from preprocessing import extract_files_from_zip
+from annotation_global import detect_slide_mask
+from result import analyser_resultats_cd7
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BASE_DIR, "benchmark_baseline.json")
+
+# Couleurs RGB (après déconvolution : DAB brun, hématoxyline bleu-violet, éosine rose)
+RGB_BACKGROUND = (242, 242, 240)
+RGB_TISSUE     = (226, 196, 214)
+RGB_DAB        = (128, 78, 40)
+RGB_HEMA       = (86, 72, 150)
+
+TOLERANCE   = 0.25   # régression si > +25 % …
+NOISE_FLOOR = 0.05   # … et > 50 ms (les étapes très courtes sont bruitées)
+
+
+# ---------- Génération ----------
+def make_synthetic_slide(width=8192, height=6144, tissue_fraction=0.5, density=1500, clumping=0.3,
+                         dab_fraction=0.5, sheet=2400, seed=0):
+    """
+    Image RGB niveau 0 (uint8) : ellipse de tissu couvrant ~tissue_fraction, `density` noyaux par mégapixel
+    de tissu (dont dab_fraction DAB+), une part `clumping` regroupée en amas, et un placard dense
+    de `sheet` px de côté (0 = aucun) pour exercer le watershed tuilé (HUGE_ROI_PIXELS).
+    """
+    rng = np.random.default_rng(seed)
+    img = np.empty((height, width, 3), np.uint8); img[:] = RGB_BACKGROUND
+    tissue = np.zeros((height, width), np.uint8)
+    # ellipse d’aire tissue_fraction × image
+    k = np.sqrt(max(1e-3, min(1.0, tissue_fraction)) / (np.pi / 4))
+    axes = (int(width * k / 2), int(height * k / 2))
+    cv2.ellipse(tissue, (width // 2, height // 2), axes, 0, 0, 360, 255, -1)
+    img[tissue > 0] = RGB_TISSUE
+
+    ys, xs = np.nonzero(tissue[::8, ::8])
+    n = int(density * np.count_nonzero(tissue) / 1e6)
+    n_clump = int(n * clumping)
+    pts = np.stack([xs, ys], axis=1) * 8
+    loose = pts[rng.integers(0, len(pts), n - n_clump)]
+    centers = pts[rng.integers(0, len(pts), max(1, n_clump // 40))]
+    clump = centers[rng.integers(0, len(centers), n_clump)] + rng.normal(0, 25, (n_clump, 2))
+    nuclei = np.concatenate([loose, clump]).astype(np.int32)
+    radii = rng.integers(3, 7, len(nuclei))
+    dab = rng.random(len(nuclei)) < dab_fraction
+    for (x, y), r, d in zip(nuclei, radii, dab):
+        cv2.circle(img, (int(x), int(y)), int(r), RGB_DAB if d else RGB_HEMA, -1)
+
+    if sheet > 0:
+        x0, y0 = width // 2 - sheet // 2, height // 2 - sheet // 2
+        for y in range(y0, y0 + sheet, 9):
+            for x in range(x0 + (y // 9 % 2) * 4, x0 + sheet, 9):
+                cv2.circle(img, (x, y), 5, RGB_DAB, -1)
+    return img
+
+
+def write_pyramidal_tiff(path, img, tile=256, min_size=512):
+    """TIFF pyramidal tuilé générique (une IFD par niveau, ÷2) lisible par OpenSlide."""
+    import tifffile       # différé : seule la génération des lames en a besoin
+    levels = [img]
+    while min(levels[-1].shape[:2]) // 2 >= min_size:
+        h, w = levels[-1].shape[:2]
+        levels.append(cv2.resize(levels[-1], (w // 2, h // 2), interpolation=cv2.INTER_AREA))
+    with tifffile.TiffWriter(path, bigtiff=True) as tw:
+        for lvl in levels:
+            tw.write(lvl, tile=(tile, tile), photometric="rgb", compression="zlib")
+    return path
+
+
+def make_dataset(workdir, patients=2, markers=("CD3", "CD7"), base_seed=0, **slide_kw):
+    """Un ZIP <PatientID>_<Antigene>.zip par (patient, marqueur), chacun avec une lame TIFF."""
+    zips = []
+    raw = os.path.join(workdir, "raw"); os.makedirs(raw, exist_ok=True)
+    for p in range(patients):
+        pid = f"S{900000 + p:06d}"
+        for j, mk in enumerate(markers):
+            seed = base_seed + 1000 * p + j
+            tif = os.path.join(raw, f"{pid}-{mk}.tif")
+            # CD7 (perte) : moins de noyaux DAB que CD3
+            frac = 0.5 if mk != "CD7" else 0.5 * (0.05 + 0.2 * p)
+            write_pyramidal_tiff(tif, make_synthetic_slide(dab_fraction=frac, seed=seed, **slide_kw))
+            zp = os.path.join(workdir, f"{pid}_{mk}.zip")
+            with zipfile.ZipFile(zp, "w", zipfile.ZIP_STORED) as z:
+                z.write(tif, f"{pid}/{mk}/{os.path.basename(tif)}")   # \b{mk}\b reconnu par preprocessing
+            zips.append((zp, mk))
+    return zips
+
+
+# ---------- Mesure ----------
+class _Stage:
+    """Chronomètre + pic RSS d’une étape ; accumule pixels / cellules pour les débits."""
+    def __init__(self, results, name):
+        self.results, self.name = results, name
+
+    def __enter__(self):
+        self.rss = cd._PeakRss().start()
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        dt = time.perf_counter() - self.t
+        peak = self.rss.stop()
+        r = self.results.setdefault(self.name, {"s": 0.0, "mpx": 0.0, "cells": 0, "rss_peak_mb": 0.0})
+        r["s"] += dt
+        r["rss_peak_mb"] = max(r["rss_peak_mb"], round(peak / 2**20, 1))
+        return False
+
+
+def run_benchmark(workdir, patients=2, seed=0, **slide_kw):
+    results = {}
+    print("🧪 Génération des lames synthétiques…")
+    zips = make_dataset(workdir, patients=patients, base_seed=seed, **slide_kw)
+
+    extracted = os.path.join(workdir, "extracted_lames")
+    annotated = os.path.join(workdir, "annotated")
+    detected  = os.path.join(workdir, "detected")
+    res_dir   = os.path.join(workdir, "results")
+    for d in (extracted, annotated, detected, res_dir):
+        os.makedirs(d, exist_ok=True)
+
+    # 1) extraction
+    for zp, mk in zips:
+        with _Stage(results, "extract_files_from_zip"):
+            extract_files_from_zip(zp, [mk], extracted)
+    slides = sorted(f for f in os.listdir(extracted) if f.lower().endswith(cd.ALLOWED_EXT))
+
+    rows = []
+    for f in slides:
+        path = os.path.join(extracted, f)
+        js = os.path.join(annotated, os.path.splitext(f)[0] + "_annotation.json")
+
+        # 2) annotation (masque tissu)
+        with _Stage(results, "detect_slide_mask"):
+            detect_slide_mask(path, js)
+
+        # 3) lecture + DAB
+        with _Stage(results, "read_slide"):
+            img = cd._read_slide_lowres(path, level=cd.LEVEL)
+        H, W = img.shape[:2]
+        mask = cd._rasterize_zone(cd._load_zone_polygons(js, W, H), H, W)
+        with _Stage(results, "_binary_dab_tiled"):
+            binary = cd._binary_dab_tiled(img, mask_zone=mask, seuil=cd.SEUIL_DAB, tile=1536)
+        results["_binary_dab_tiled"]["mpx"] += H * W / 1e6
+
+        # 4) watershed par branche (temps isolés par l’instrumentation du module)
+        contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        stats = cd._trace_begin()
+        try:
+            res = cd._count_contours_anytime(contours, binary, None, deadline=time.time() + 3600)
+        finally:
+            cd._trace_end()
+        for key, name, counter in (("ws_full", "watershed_full", "roi_normal"),
+                                   ("ws_drawlimit", "watershed_drawlimit", "roi_draw_limit"),
+                                   ("ws_huge_tiled", "watershed_tiled", "roi_huge_tiled")):
+            r = results.setdefault(name, {"s": 0.0, "mpx": 0.0, "cells": 0, "rss_peak_mb": 0.0})
+            r["s"] += stats["t"].get(key, 0.0)
+            r["cells"] += stats["n"].get("cells_" + key, 0)          # noyaux issus de cette branche seulement
+            r["rois"] = r.get("rois", 0) + stats["n"].get(counter, 0)
+        rows.append(cd._csv_row(f, cd.SEUIL_DAB, int(np.count_nonzero(mask)), res))
+        img = binary = mask = None
+
+    # 5) analyse
+    import pandas as pd
+    pd.DataFrame(rows).to_csv(os.path.join(detected, "resume_detection.csv"), sep=";", index=False)
+    with _Stage(results, "analyser_resultats_cd7"):
+        analyser_resultats_cd7(seuil_ratio_cd7=10.0, detected_dir=detected, results_dir=res_dir)
+
+    for r in results.values():
+        r["s"] = round(r["s"], 4)
+        if r["mpx"] and r["s"] > 0:
+            r["mpx_per_s"] = round(r["mpx"] / r["s"], 2)
+        if r["cells"] and r["s"] > 0:
+            r["cells_per_s"] = round(r["cells"] / r["s"], 1)
+    return results
+
+
+# ---------- Référence ----------
+def compare(results, baseline, tolerance=TOLERANCE, noise_floor=NOISE_FLOOR):
+    """Liste des régressions : étape plus lente que la référence au-delà de la tolérance et du bruit."""
+    bad = []
+    for name, ref in baseline.get("stages", {}).items():
+        cur = results.get(name)
+        if cur is None:
+            continue
+        if cur["s"] > ref["s"] * (1 + tolerance) and cur["s"] - ref["s"] > noise_floor:
+            bad.append((name, ref["s"], cur["s"]))
+    return bad
+
+
+def print_report(results):
+    print(f"\n{'Étape':<26}{'temps (s)':>11}{'Mpx/s':>10}{'cell/s':>11}{'pic RSS (Mo)':>14}")
+    for name, r in results.items():
+        print(f"{name:<26}{r['s']:>11.3f}{r.get('mpx_per_s', ''):>10}{r.get('cells_per_s', ''):>11}"
+              f"{r['rss_peak_mb']:>14}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark du pipeline sur lames synthétiques.")
+    ap.add_argument("--width", type=int, default=8192)
+    ap.add_argument("--height", type=int, default=6144)
+    ap.add_argument("--tissue", type=float, default=0.5, help="fraction de tissu")
+    ap.add_argument("--density", type=float, default=1500, help="noyaux par mégapixel de tissu")
+    ap.add_argument("--clumping", type=float, default=0.3, help="fraction de noyaux en amas")
+    ap.add_argument("--sheet", type=int, default=2400, help="placard dense (px, 0 = aucun)")
+    ap.add_argument("--patients", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=TOLERANCE)
+    ap.add_argument("--workdir", default=None, help="dossier de travail (défaut : temporaire, supprimé)")
+    args = ap.parse_args(argv)
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"❌ Référence absente : {args.baseline}\n"
+              "   Aucune comparaison possible. La créer sur cette machine : python benchmark.py --update-baseline")
+        return 2
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_toolbox_")
+    try:
+        results = run_benchmark(workdir, patients=args.patients, seed=args.seed, width=args.width, height=args.height,
+                                tissue_fraction=args.tissue, density=args.density,
+                                clumping=args.clumping, sheet=args.sheet)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_report(results)
+
+    config = {k: getattr(args, k) for k in ("width", "height", "tissue", "density", "clumping", "sheet", "patients", "seed")}
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "stages": results}, f, indent=2, ensure_ascii=False)
+        print(f"\n📌 Référence écrite : {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("\n⚠ Configuration différente de la référence : comparaison indicative seulement.")
+    bad = compare(results, baseline, tolerance=args.tolerance)
+    if bad:
+        print("\n❌ Régressions :")
+        for name, ref, cur in bad:
+            print(f"   {name}: {ref:.3f}s → {cur:.3f}s (+{100 * (cur / ref - 1):.0f} %)")
+        return 1
+    print("\n✅ Aucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,40 @@
-import os, time, gc, json
+import os, time, gc, json, shutil, math, queue, threading, multiprocessing, hashlib
+from contextlib import contextmanager
+from datetime import datetime
 import numpy as np
 import cv2
-import openslide
-from skimage.color import rgb2hed
-import pandas as pd
+from results_store import DB_NAME, ajouter_run
+
+# Imports lourds différés (démarrage de mainGUI et des process d’isolation) : openslide à la première
+# lecture de lame, skimage à la première déconvolution, pandas à l’écriture des CSV.
+def _openslide():
+    import openslide
+    return openslide
+
+def rgb2hed(rgb):
+    from skimage.color import rgb2hed as _rgb2hed
+    return _rgb2hed(rgb)
+
+try:
+    import psutil   # optionnel : mesure RSS portable
+except Exception:
+    psutil = None
 
 # ===================== Dossiers =====================
 SLIDES_DIR = r"D:\QuPathProjects\PathologyToolbox\output\extracted_lames"
 JSON_DIR   = r"D:\QuPathProjects\PathologyToolbox\output\annotated"
 OUTPUT_DIR = r"D:\QuPathProjects\PathologyToolbox\output\detected"
 CSV_OUTPUT = os.path.join(OUTPUT_DIR, "resume_detection.csv")
+STORE_DB   = os.path.join(OUTPUT_DIR, DB_NAME)   # historique des comptes (ajout, jamais écrasé)
 
 # ===================== Paramètres ====================
 ALLOWED_EXT   = (".ndpi", ".svs", ".tif", ".tiff")
 LEVEL         = 1
 SEUIL_DAB     = 0.02
+SEUIL_HEMA    = 0.05    # canal hématoxyline (noyaux négatifs, mode DUAL_CHANNEL)
+DUAL_CHANNEL  = False   # compte aussi les noyaux négatifs (hématoxyline sans DAB) → % de positifs
+HEMA_DAB_MARGIN = 3     # px : hématoxyline à moins de cette distance du masque DAB (liseré / halo des DAB+) ≠ négatif
+NEG_TIMEOUT_FRAC = 0.25 # part de TIMEOUT_S réservée aux négatifs (DUAL_CHANNEL)
 
 MIN_AREA      = 10
 SMALL_AREA    = 80
@@ -31,15 +51,93 @@ DRAW_LIMIT_ROI   = 6000
 
 # — Tuilage (plein résolution, pas de downscale)
 TILE_SIZE        = 1024
-TILE_OVERLAP     = 96          # chevauchement
+TILE_OVERLAP     = 96          # chevauchement (mode "overlap" uniquement)
+TILED_WATERSHED  = "stitch"    # "stitch" : graines vues avec contexte, chaque cellule à une seule tuile | "overlap" : ancien mode
+TILE_SEED_MARGIN = 32          # px de contexte autour d’une tuile "stitch" (≥ rayon des noyaux : distances et graines exactes)
 EDGE_THICKNESS   = 1           # épaisseur du liseré de bord (violet)
 SEED_MIN_DIST    = 2
 SEED_THR_RATIO   = 0.28
 SEED_MAX_TILE    = 12000
 SEED_MAX_FULL    = 30000
 
+# — Petits contours : tracé et tableau par cellule en lot, une image de labels par fenêtre (px)
+SMALL_BATCH_WIN  = 2048
+
+# — Ordre “anytime” (timeout → estimation non biaisée)
+ANYTIME_STRATUM  = 2048        # côté des cases de stratification (px, niveau LEVEL)
+ANYTIME_SEED     = 0           # graine fixe → résultats reproductibles
+
+# — Triage rapide (échantillon de tuiles tissu)
+TRIAGE_K          = 24         # tuiles échantillonnées par lame
+TRIAGE_TILE       = 1024       # côté d’une tuile (px, niveau LEVEL)
+TRIAGE_MIN_TISSUE = 0.5        # fraction minimale de zone JSON dans une tuile éligible
+TRIAGE_GRID_DS    = 16         # facteur de réduction de la grille de couverture
+TRIAGE_CSV        = os.path.join(OUTPUT_DIR, "triage_detection.csv")
+
+# — Balayage de seuils DAB (une seule déconvolution)
+SWEEP_SEUILS      = (0.01, 0.015, 0.02, 0.025, 0.03)
+SWEEP_CSV         = os.path.join(OUTPUT_DIR, "balayage_seuils.csv")
+
+# — Pipeline lecture / calcul / écriture
+PREFETCH_SLIDES  = 1                 # lames lues en avance (en plus de celle en calcul)
+MEM_BUDGET_BYTES = 6 * 1024 ** 3     # budget mémoire partagé lecture + calcul + écriture
+
+# — Profil mémoire automatique (poste 16 Go) : au-delà → comptage seul, puis niveau pyramidal suivant
+MEM_PROFILE_BUDGET = 10 * 1024 ** 3  # None = jamais de repli
+LOWMEM_DAB_TILE    = 768
+RSS_SAMPLE_S       = 0.05            # période d’échantillonnage du pic RSS
+
+# — Catalogue des lames (en-têtes seuls, en cache) → ordre « plus grosse d’abord » + durée estimée
+CATALOG_JSON     = os.path.join(OUTPUT_DIR, "catalogue_lames.json")
+LARGEST_FIRST    = True
+ETA_S_PER_MPX    = 0.5               # débit supposé (s / Mpx au niveau LEVEL) tant qu’aucun run n’a été mesuré
+
+# — Cache disque du masque DAB (bits compactés, npz compressé) : ne dépend que de la lame, du niveau, des seuils
+#   et du masque tissu → relancer avec d’autres MIN_AREA / SMALL_AREA / SEED_THR_RATIO… saute la déconvolution
+DAB_CACHE        = True
+DAB_CACHE_DIR    = os.path.join(OUTPUT_DIR, "cache_dab")
+
+# — Aperçu du seuil DAB (mainGUI) : histogramme de DO DAB sur le tissu + vignettes DO / RGB, par lame.
+#   Écrit à chaque déconvolution (détection) ou par la pré-passe preparer_apercus_dab (niveau plus grossier).
+OD_PREVIEW       = True
+OD_PREVIEW_DIR   = os.path.join(OUTPUT_DIR, "apercu_dab")
+OD_HIST_MAX      = 0.1         # DO DAB au-delà → dernier bac
+OD_HIST_BINS     = 500         # pas de 0.0002
+OD_THUMB_MAX     = 480         # côté max des vignettes (px)
+OD_PREPASS_LEVEL = 2           # niveau pyramidal de la pré-passe (borné au dernier niveau de la lame)
+
+# — Isolation par lame : process fils surveillé (délai et mémoire durs), tué au-delà puis relancé
+#   une fois en profil dégradé. Activé par pipeline_cli ; pas depuis mainGUI (pas de garde __main__ pour spawn).
+ISOLATE_SLIDES     = False
+WATCHDOG_S         = TIMEOUT_S + 120          # lecture + positifs + négatifs (même budget) + écriture
+WATCHDOG_RSS_BYTES = 12 * 1024 ** 3           # None = pas de limite mémoire
+WATCHDOG_POLL_S    = 0.5
+# Réglages hors comptage recopiés dans le process fils (en plus de COUNT_PARAMS) : profil, sorties, cache
+WORKER_SETTINGS    = ("EXPORT_CELLS", "OVERLAY_FORMAT", "DZ_TILE", "DZ_EXT", "DZ_JPEG_QUALITY", "PNG_COMPRESSION",
+                      "EDGE_THICKNESS", "DAB_CACHE", "OD_PREVIEW", "TRACE", "LOWMEM_DAB_TILE", "MEM_BUDGET_BYTES",
+                      "SMALL_BATCH_WIN", "WATCHDOG_S", "WATCHDOG_RSS_BYTES")
+
+# — Réglages dont dépend un compte → empreinte enregistrée avec chaque run dans STORE_DB
+COUNT_PARAMS = ("LEVEL", "SEUIL_DAB", "SEUIL_HEMA", "DUAL_CHANNEL", "HEMA_DAB_MARGIN", "NEG_TIMEOUT_FRAC",
+                "MIN_AREA", "SMALL_AREA", "MAX_AREA", "TIMEOUT_S", "MAX_CONTOURS", "HUGE_ROI_PIXELS", "DRAW_LIMIT_ROI", "TILE_SIZE", "TILE_OVERLAP",
+                "TILED_WATERSHED", "TILE_SEED_MARGIN", "SEED_MIN_DIST", "SEED_THR_RATIO", "SEED_MAX_TILE", "SEED_MAX_FULL", "ANYTIME_STRATUM",
+                "ANYTIME_SEED", "MEM_PROFILE_BUDGET")
+
+# — Comptage seul (criblage de cohorte) : pas d’overlay, mêmes comptes
+COUNT_ONLY       = False
+
+# — Export par cellule (centroïde, aire, bbox, DO DAB moyenne) → <lame>_cells.npz
+EXPORT_CELLS     = False       # opt-in : tampon DO float16 pleine lame + calcul des caractéristiques
+
+# — Instrumentation : trace JSON-lines par run (OUTPUT_DIR/trace_<date>.jsonl)
+TRACE            = True
+
 # I/O
 PNG_COMPRESSION  = 1  # 0–3 = rapide
+OVERLAY_FORMAT   = "dzi"       # "dzi" : pyramide DeepZoom tuilée (ouvrable à tout zoom) | "png" : ancien PNG unique
+DZ_TILE          = 256         # côté des tuiles DeepZoom
+DZ_EXT           = "jpg"       # "jpg" (léger) ou "png" (sans perte)
+DZ_JPEG_QUALITY  = 90
 
 # Couleurs BGR
 COL_GREEN   = (0, 255, 0)      # contours (petits ROIs)
@@ -53,33 +151,309 @@ cv2.setNumThreads(0)
 # --- Affichage "traitement long" basé sur le temps écoulé ---
 LONG_NOTE_FRAC = 0.45    # affiche la note dès que t >= 45% du TIMEOUT
 LONG_NOTE_MIN_S = 35     # et au moins 35s passées (pour éviter les faux positifs)
+LONG_NOTE_TEXT = "Lame très chargée en cellules marquées — observation plus longue..."
+
+# ===================== Instrumentation =======================
+# Temps par étape + compteurs par branche, pour la lame en cours du thread courant.
+# Hors détection (triage, balayage, benchmarks…) aucune trace n’est active → appels sans effet.
+_TRACE = threading.local()
+_TRACE_LOCK = threading.Lock()
+
+def _trace_begin():
+    _TRACE.stats = {"t": {}, "n": {}}
+    return _TRACE.stats
+
+def _trace_end():
+    _TRACE.stats = None
+
+@contextmanager
+def _timed(key):
+    st = getattr(_TRACE, "stats", None)
+    if st is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        st["t"][key] = st["t"].get(key, 0.0) + time.perf_counter() - t
+
+def _tadd(key, dt):
+    """Durée mesurée à part (branche connue seulement après le calcul) → même cumul que _timed."""
+    st = getattr(_TRACE, "stats", None)
+    if st is not None:
+        st["t"][key] = st["t"].get(key, 0.0) + dt
+
+def _tcount(key, n=1):
+    st = getattr(_TRACE, "stats", None)
+    if st is not None:
+        st["n"][key] = st["n"].get(key, 0) + n
+
+def _trace_write(path, record):
+    """Ajoute un enregistrement JSON (une ligne) à la trace du run ; appelable depuis plusieurs threads."""
+    if not path:
+        return
+    with _TRACE_LOCK:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
 
 # ===================== Helpers =======================
 def _read_slide_lowres(path, level=1):
-    slide = openslide.OpenSlide(path)
+    slide = _openslide().OpenSlide(path)
     lev = min(level, slide.level_count - 1)
     dims = slide.level_dimensions[lev]
     img = np.array(slide.read_region((0, 0), lev, dims).convert("RGB"), dtype=np.uint8)
     slide.close()
     return img
 
-def _binary_dab_tiled(img_rgb, mask_zone=None, seuil=SEUIL_DAB, tile=1536):
+def _binary_dab_tiled(img_rgb, mask_zone=None, seuil=SEUIL_DAB, tile=1536, od_out=None,
+                      hema_out=None, seuil_hema=SEUIL_HEMA, preview=None):
+    """
+    DAB binaire (0/255) par tuiles ; od_out (H×W float16) reçoit la densité optique DAB si fourni.
+    hema_out (H×W uint8) reçoit, dans la MÊME déconvolution, les noyaux hématoxyline NON DAB (négatifs),
+    hors d’une marge HEMA_DAB_MARGIN autour du masque DAB (liseré hématoxyline des noyaux positifs).
+    preview (dict de _od_preview_new) accumule l’histogramme DO du tissu et la vignette DO.
+    """
     H, W = img_rgb.shape[:2]
     out = np.zeros((H, W), np.uint8)
     for y in range(0, H, tile):
         for x in range(0, W, tile):
             y2, x2 = min(y + tile, H), min(x + tile, W)
+            _tcount("dab_tiles")
             if mask_zone is not None and mask_zone[y:y2, x:x2].max() == 0:
+                _tcount("dab_tiles_skipped")
                 continue
             bf  = (img_rgb[y:y2, x:x2].astype(np.float32) / 255.0)
-            dab = rgb2hed(bf)[:, :, 2].astype(np.float32)
+            hed = rgb2hed(bf)
+            dab = hed[:, :, 2].astype(np.float32)
+            if od_out is not None:
+                od_out[y:y2, x:x2] = dab
+            if preview is not None:
+                _od_preview_add(preview, dab, None if mask_zone is None else mask_zone[y:y2, x:x2], y, x, H, W)
             tmp = (dab > seuil).astype(np.uint8) * 255
             if mask_zone is not None:
                 tmp[mask_zone[y:y2, x:x2] == 0] = 0
             out[y:y2, x:x2] = tmp
+            if hema_out is not None:
+                neg = ((hed[:, :, 0] > seuil_hema) & (tmp == 0)).astype(np.uint8) * 255
+                if mask_zone is not None:
+                    neg[mask_zone[y:y2, x:x2] == 0] = 0
+                hema_out[y:y2, x:x2] = neg
+    if hema_out is not None and HEMA_DAB_MARGIN > 0:
+        # 2e passe, une fois le masque DAB complet : la dilatation déborde sur les tuiles voisines
+        r = int(HEMA_DAB_MARGIN)
+        k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * r + 1, 2 * r + 1))
+        for y in range(0, H, tile):
+            for x in range(0, W, tile):
+                y2, x2 = min(y + tile, H), min(x + tile, W)
+                hema = hema_out[y:y2, x:x2]
+                if not hema.any():
+                    continue
+                ya, xa = max(0, y - r), max(0, x - r)
+                near = cv2.dilate(out[ya:min(y2 + r, H), xa:min(x2 + r, W)], k)
+                hema[near[y - ya:y2 - ya, x - xa:x2 - xa] > 0] = 0
     return out
 
-def _maxima_seeds(dist, min_distance=SEED_MIN_DIST, thr_ratio=SEED_THR_RATIO, max_seeds=None, p=35):
+def _od_preview_new(H, W):
+    """Accumulateurs de l’aperçu pour une image H×W : histogramme DO (tissu) + vignette DO (≤ OD_THUMB_MAX)."""
+    sc = min(1.0, OD_THUMB_MAX / max(H, W))
+    th, tw = max(1, int(round(H * sc))), max(1, int(round(W * sc)))
+    return {"hist": np.zeros(OD_HIST_BINS, np.int64), "thumb": np.zeros((th, tw), np.float32)}
+
+def _od_preview_add(preview, dab, mask_tile, y, x, H, W):
+    v = dab if mask_tile is None else dab[mask_tile > 0]
+    q = np.clip((v * (OD_HIST_BINS / OD_HIST_MAX)).astype(np.int32), 0, OD_HIST_BINS - 1)
+    preview["hist"] += np.bincount(q.ravel(), minlength=OD_HIST_BINS)
+    thumb = preview["thumb"]
+    th, tw = thumb.shape
+    ty, ty2 = int(round(y * th / H)), int(round((y + dab.shape[0]) * th / H))
+    tx, tx2 = int(round(x * tw / W)), int(round((x + dab.shape[1]) * tw / W))
+    if ty2 > ty and tx2 > tx:
+        thumb[ty:ty2, tx:tx2] = cv2.resize(dab, (tx2 - tx, ty2 - ty), interpolation=cv2.INTER_AREA)
+
+def _od_preview_save(filename, preview, img_rgb, mask_zone, level):
+    """<lame>_od.npz : histogramme, vignettes DO / tissu / RGB (remplace l’aperçu précédent)."""
+    try:
+        os.makedirs(OD_PREVIEW_DIR, exist_ok=True)
+        th, tw = preview["thumb"].shape
+        path = os.path.join(OD_PREVIEW_DIR, os.path.splitext(filename)[0] + "_od.npz")
+        tmp = path[:-4] + ".tmp.npz"
+        np.savez_compressed(tmp, hist=preview["hist"], od_max=OD_HIST_MAX, level=level,
+                            od=preview["thumb"].astype(np.float16),
+                            tissue=cv2.resize(mask_zone, (tw, th), interpolation=cv2.INTER_NEAREST),
+                            rgb=cv2.resize(img_rgb, (tw, th), interpolation=cv2.INTER_AREA))
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"⚠ Aperçu DAB non écrit : {e}")
+
+def charger_apercus_dab(slides=None):
+    """
+    Aperçus DO disponibles → {lame: {"hist", "od_max", "od", "tissue", "rgb", "level"}}.
+    slides : noms de fichiers à charger (défaut : tous ceux de OD_PREVIEW_DIR).
+    """
+    out = {}
+    if not os.path.isdir(OD_PREVIEW_DIR):
+        return out
+    stems = None if slides is None else {os.path.splitext(f)[0]: f for f in slides}
+    for f in sorted(os.listdir(OD_PREVIEW_DIR)):
+        if not f.endswith("_od.npz"):
+            continue
+        stem = f[:-len("_od.npz")]
+        if stems is not None and stem not in stems:
+            continue
+        try:
+            with np.load(os.path.join(OD_PREVIEW_DIR, f)) as z:
+                out[stems[stem] if stems else stem] = {k: z[k] for k in z.files}
+        except Exception as e:
+            print(f"⚠ Aperçu illisible ({f}) : {e}")
+    return out
+
+def preparer_apercus_dab(progress_bar=None, progress_label=None, slides=None, level=OD_PREPASS_LEVEL):
+    """
+    Pré-passe rapide : aperçu DO des lames qui n’en ont pas encore (niveau pyramidal grossier, sans comptage),
+    pour régler SEUIL_DAB avant la première détection. Retourne le nombre d’aperçus écrits.
+    Lames sans niveau plus grossier que celui de la détection : pas de pré-passe (ce serait la lecture
+    complète) — leur aperçu sera écrit par la prochaine détection.
+    """
+    if slides is None:
+        slides = sorted(f for f in os.listdir(SLIDES_DIR) if f.lower().endswith(ALLOWED_EXT))
+    have = charger_apercus_dab(slides)
+    todo = [f for f in slides if f not in have]
+    done = 0
+    for i, filename in enumerate(todo, 1):
+        json_path = os.path.join(JSON_DIR, os.path.splitext(filename)[0] + "_annotation.json")
+        if not os.path.exists(json_path):
+            continue
+        try:
+            image_path = os.path.join(SLIDES_DIR, filename)
+            with _openslide().OpenSlide(image_path) as slide:
+                lev0 = min(LEVEL, slide.level_count - 1)
+                lev = min(level, slide.level_count - 1)
+                W0, H0 = slide.level_dimensions[lev0]
+            if lev <= lev0:
+                print(f"   {filename} : pas de niveau plus grossier que la détection → aperçu à la détection")
+                continue
+            img = _read_slide_lowres(image_path, level=lev)
+            H, W = img.shape[:2]
+            polys = _load_zone_polygons(json_path, W0, H0)
+            mask_zone = _rasterize_zone(polys, H, W, scale=W / W0)
+            preview = _od_preview_new(H, W)
+            _binary_dab_tiled(img, mask_zone=mask_zone, preview=preview)
+            _od_preview_save(filename, preview, img, mask_zone, lev)
+            done += 1
+        except Exception as e:
+            print(f"⚠ Aperçu DAB {filename} : {e}")
+        finally:
+            if progress_bar:
+                progress_bar["value"] = 100 * i / len(todo)
+            if progress_label:
+                progress_label.config(text=f"Aperçu DAB : {i}/{len(todo)} lames")
+    return done
+
+def _dab_levels_tiled(img_rgb, mask_zone=None, seuils=(SEUIL_DAB,), tile=1536):
+    """
+    Une seule déconvolution pour plusieurs seuils : chaque pixel reçoit le NOMBRE de seuils
+    (triés croissants) que sa DAB dépasse (uint8, 1 octet/pixel quel que soit le nombre de seuils).
+    Masque binaire du j-ème seuil : (levels > j).
+    """
+    seuils = np.sort(np.asarray(seuils, dtype=np.float32))
+    H, W = img_rgb.shape[:2]
+    out = np.zeros((H, W), np.uint8)
+    for y in range(0, H, tile):
+        for x in range(0, W, tile):
+            y2, x2 = min(y + tile, H), min(x + tile, W)
+            if mask_zone is not None and mask_zone[y:y2, x:x2].max() == 0:
+                continue
+            bf  = (img_rgb[y:y2, x:x2].astype(np.float32) / 255.0)
+            dab = rgb2hed(bf)[:, :, 2].astype(np.float32)
+            tmp = np.searchsorted(seuils, dab, side="left").astype(np.uint8)   # nb de seuils < dab
+            if mask_zone is not None:
+                tmp[mask_zone[y:y2, x:x2] == 0] = 0
+            out[y:y2, x:x2] = tmp
+    return out
+
+def _dab_cache_key(image_path, json_path, level):
+    """Empreinte des entrées du masque DAB : lame (chemin, taille, date), niveau, seuils, JSON de la zone tissu."""
+    st = os.stat(image_path)
+    h = hashlib.sha1(json.dumps([os.path.abspath(image_path), st.st_size, st.st_mtime, int(level),
+                                 float(SEUIL_DAB), float(SEUIL_HEMA), int(HEMA_DAB_MARGIN)]).encode("utf-8"))
+    with open(json_path, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()[:20]
+
+def _dab_cache_path(filename, key):
+    return os.path.join(DAB_CACHE_DIR, f"{os.path.splitext(filename)[0]}_{key}.npz")
+
+def _dab_cache_load(filename, key, need_hema=False, need_od=False):
+    """Masques en cache → dict dab / hema / od (None si absent) ; None si manquant ou incomplet."""
+    path = _dab_cache_path(filename, key)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as z:
+            if (need_hema and "hema" not in z) or (need_od and "od" not in z):
+                return None
+            H, W = (int(v) for v in z["shape"])
+            unpack = lambda k: np.unpackbits(z[k], count=H * W).reshape(H, W) * np.uint8(255)
+            dab = unpack("dab")
+            od = None
+            if need_od:
+                od = np.zeros((H, W), np.float16)
+                od[dab > 0] = z["od"]
+            return {"dab": dab, "hema": unpack("hema") if need_hema else None, "od": od}
+    except Exception as e:
+        print(f"⚠ Cache DAB illisible ({os.path.basename(path)}) : {e}")
+        return None
+
+def _dab_cache_save(filename, key, binary_dab, binary_hema=None, od=None):
+    """
+    Écrit le cache de la lame (remplace les entrées d’autres paramètres de la même lame).
+    Masques en bits compactés ; od (export par cellule) réduite aux pixels DAB, les seuls que lit _label_sums.
+    """
+    try:
+        os.makedirs(DAB_CACHE_DIR, exist_ok=True)
+        data = {"shape": np.array(binary_dab.shape), "dab": np.packbits(binary_dab > 0)}
+        if binary_hema is not None:
+            data["hema"] = np.packbits(binary_hema > 0)
+        if od is not None:
+            data["od"] = od[binary_dab > 0]
+        path = _dab_cache_path(filename, key)
+        tmp = path[:-4] + ".tmp.npz"
+        np.savez_compressed(tmp, **data)
+        os.replace(tmp, path)
+        prefix = os.path.splitext(filename)[0] + "_"
+        for f in os.listdir(DAB_CACHE_DIR):
+            if f.startswith(prefix) and f.endswith(".npz") and os.path.join(DAB_CACHE_DIR, f) != path \
+                    and len(f) == len(os.path.basename(path)):
+                os.remove(os.path.join(DAB_CACHE_DIR, f))
+    except Exception as e:
+        print(f"⚠ Cache DAB non écrit : {e}")
+
+def _load_zone_polygons(json_path, W, H):
+    """Polygones de la zone JSON (annotation_global), bornés à l’image W×H du niveau LEVEL."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        annotations = json.load(f)
+    polys = []
+    for ann in annotations:
+        coords = np.array(ann["geometry"]["coordinates"][0], dtype=np.float32)
+        coords[:, 0] = np.clip(coords[:, 0], 0, W - 1)
+        coords[:, 1] = np.clip(coords[:, 1], 0, H - 1)
+        polys.append(coords)
+    return polys
+
+def _rasterize_zone(polys, H, W, scale=1.0, offset=(0, 0)):
+    """Masque 0/1 (H×W) des polygones, éventuellement réduits (scale) et décalés (offset = x, y)."""
+    mask = np.zeros((H, W), dtype=np.uint8)
+    ox, oy = offset
+    for coords in polys:
+        pts = (coords - np.array([ox, oy], dtype=np.float32)) * scale
+        cv2.fillPoly(mask, [pts.astype(np.int32)], 1)
+    return mask
+
+def _maxima_seeds(dist, min_distance=None, thr_ratio=None, max_seeds=None, p=35):
+    # défauts lus à l’appel (réglages modifiés après import, ou transmis au process fils)
+    min_distance = SEED_MIN_DIST if min_distance is None else min_distance
+    thr_ratio = SEED_THR_RATIO if thr_ratio is None else thr_ratio
     if dist.dtype != np.float32:
         dist = dist.astype(np.float32)
     v = dist[dist > 0]
@@ -103,6 +477,16 @@ def _maxima_seeds(dist, min_distance=SEED_MIN_DIST, thr_ratio=SEED_THR_RATIO, ma
             return sel
     return (peaks.astype(np.uint8) * 255)
 
+def _roi_isolated(binary, cnt, x, y, w, h):
+    """
+    ROI limité à la composante du contour : on remplit le contour externe dans un masque local
+    et on ne garde que ces pixels → les voisins qui débordent dans la bbox ne sont pas re-watershedés.
+    (Les contours externes ne se recouvrent pas : chaque pixel passe dans au plus un watershed.)
+    """
+    mask = np.zeros((h, w), np.uint8)
+    cv2.drawContours(mask, [cnt], -1, 255, thickness=cv2.FILLED, offset=(-x, -y))
+    return cv2.bitwise_and(binary[y:y+h, x:x+w], mask)
+
 def _watershed_full(roi_bin):
     """Watershed plein format → contours verts ET edges (mask -1)."""
     dist = cv2.distanceTransform(roi_bin, cv2.DIST_L2, 5)
@@ -136,7 +520,9 @@ def _watershed_edges_tiled_and_count(roi_bin, tile=TILE_SIZE, overlap=TILE_OVERL
         for tx in range(0, w, step):
             y2, x2 = min(ty + tile, h), min(tx + tile, w)
             sub = roi_bin[ty:y2, tx:x2]
+            _tcount("ws_tiles")
             if sub.max() == 0:
+                _tcount("ws_tiles_skipped")
                 continue
 
             mk = _watershed_full(sub)
@@ -166,10 +552,1055 @@ def _watershed_edges_tiled_and_count(roi_bin, tile=TILE_SIZE, overlap=TILE_OVERL
 
     return edges, n_cells
 
+def _watershed_tile_labels(sub):
+    """
+    Watershed d’une fenêtre SANS perdre ses bords : cv2.watershed force le cadre de l’image à -1,
+    on ajoute donc 1 px de marge (marqueurs à 0) puis on la retire → les pixels du bord gardent leur label.
+    Retourne les marqueurs et, par label, le 1er pixel (ordre raster) de sa graine : (y, x) dans la fenêtre.
+    """
+    dist = cv2.distanceTransform(sub, cv2.DIST_L2, 5)
+    seeds = _maxima_seeds(dist, max_seeds=SEED_MAX_TILE)
+    n, markers = cv2.connectedComponents(seeds)
+    ys, xs = np.nonzero(seeds)
+    ids, idx = np.unique(markers[ys, xs], return_index=True)
+    first = np.zeros((n, 2), np.int64)
+    first[ids] = np.stack([ys[idx], xs[idx]], axis=1)
+    markers = cv2.copyMakeBorder(markers, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    img = cv2.copyMakeBorder(sub, 1, 1, 1, 1, cv2.BORDER_REPLICATE)
+    markers = cv2.watershed(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), markers)
+    return markers[1:-1, 1:-1], first
+
+def _watershed_edges_stitched_and_count(roi_bin, tile=TILE_SIZE, od=None, origin=None, margin=None):
+    """
+    Watershed par tuiles JOINTIVES, chacune calculée avec margin px de contexte (TILE_SEED_MARGIN) :
+    distances, graines et bassins d’une tuile sont ceux du watershed non tuilé, y compris aux coutures.
+    - Chaque graine a une identité globale (1er pixel, ordre raster, dans le ROI) ; elle est comptée par
+      la seule tuile qui contient ce pixel. Une cellule coupée par une couture garde la même identité
+      des deux côtés → pas de recollage, pas de double compte.
+    - Comme _watershed_full (labels > 1), la 1re graine du ROI (ordre raster) n’est pas comptée
+      → même compte que le watershed non tuilé.
+    - Retourne edge_mask global (uint8, 0/255) et n_cells.
+    - origin=(y, x) → retourne aussi le tableau par cellule (morceaux réunis par identité), od = densité optique du ROI.
+    """
+    margin = TILE_SEED_MARGIN if margin is None else margin
+    h, w = roi_bin.shape
+    edges = np.zeros((h, w), np.uint8)
+    parts = []
+    n_cells = 0
+    skip = None       # identité non comptée (convention labels > 1 de _watershed_full)
+
+    for ty in range(0, h, tile):
+        for tx in range(0, w, tile):
+            y2, x2 = min(ty + tile, h), min(tx + tile, w)
+            _tcount("ws_tiles")
+            if roi_bin[ty:y2, tx:x2].max() == 0:
+                _tcount("ws_tiles_skipped")
+                continue
+            ya, xa = max(0, ty - margin), max(0, tx - margin)
+            mk, first = _watershed_tile_labels(roi_bin[ya:min(y2 + margin, h), xa:min(x2 + margin, w)])
+            mk = mk[ty - ya:y2 - ya, tx - xa:x2 - xa]
+            edges[ty:y2, tx:x2][mk == -1] = 255
+
+            # identité globale de chaque label (0 = fond de connectedComponents / bord -1)
+            gy, gx = first[:, 0] + ya, first[:, 1] + xa
+            key = gy * w + gx + 1
+            key[0] = 0
+            own = (gy >= ty) & (gy < y2) & (gx >= tx) & (gx < x2)
+            own[0] = False
+            n_cells += int(own.sum())
+            if own.any():
+                k0 = int(key[own].min())
+                skip = k0 if skip is None else min(skip, k0)
+
+            if origin is not None:
+                glob = key[np.maximum(mk, 0)]
+                parts.append(_label_sums(glob, roi_bin[ty:y2, tx:x2] > 0, None if od is None else od[ty:y2, tx:x2],
+                                         origin[0] + ty, origin[1] + tx))
+
+    if skip is not None:
+        n_cells -= 1
+    if origin is not None:
+        parts = [None if p is None or not (keep := p["id"] != skip).any() else {k: v[keep] for k, v in p.items()}
+                 for p in parts]
+        return edges, n_cells, _merge_sums(parts)
+    return edges, n_cells
+
+def _label_sums(labels, fg, od, oy, ox):
+    """
+    Sommes par label (> 0) sur les pixels DAB (fg) d’un ROI — tout en bincount, sans boucle par cellule.
+    oy, ox : origine du ROI dans la lame. od : densité optique DAB du ROI (ou None).
+    """
+    ys, xs = np.nonzero((labels > 0) & fg)
+    if ys.size == 0:
+        return None
+    ids, inv = np.unique(labels[ys, xs], return_inverse=True)
+    inv = inv.ravel()
+    k = ids.size
+    n = np.bincount(inv, minlength=k).astype(np.float64)
+    y0 = np.full(k, np.iinfo(np.int64).max, np.int64); np.minimum.at(y0, inv, ys)
+    x0 = np.full(k, np.iinfo(np.int64).max, np.int64); np.minimum.at(x0, inv, xs)
+    y1 = np.zeros(k, np.int64); np.maximum.at(y1, inv, ys)
+    x1 = np.zeros(k, np.int64); np.maximum.at(x1, inv, xs)
+    sod = (np.bincount(inv, od[ys, xs].astype(np.float64), k) if od is not None else np.zeros(k))
+    return {"id": ids.astype(np.int64), "n": n,
+            "sy": np.bincount(inv, ys.astype(np.float64), k) + oy * n,
+            "sx": np.bincount(inv, xs.astype(np.float64), k) + ox * n,
+            "sod": sod, "y0": y0 + oy, "x0": x0 + ox, "y1": y1 + oy, "x1": x1 + ox}
+
+def _merge_sums(parts):
+    """
+    Fusionne des sommes partielles (mêmes ids = même cellule, ex. morceaux d’une cellule coupée par les tuiles)
+    → colonnes par cellule : cy, cx, area (px), y0, x0, y1, x1, dab_od.
+    """
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    cat = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    _, inv = np.unique(cat["id"], return_inverse=True)
+    inv = inv.ravel()
+    k = int(inv.max()) + 1
+    n = np.bincount(inv, cat["n"], k)
+    y0 = np.full(k, np.iinfo(np.int64).max, np.int64); np.minimum.at(y0, inv, cat["y0"])
+    x0 = np.full(k, np.iinfo(np.int64).max, np.int64); np.minimum.at(x0, inv, cat["x0"])
+    y1 = np.zeros(k, np.int64); np.maximum.at(y1, inv, cat["y1"])
+    x1 = np.zeros(k, np.int64); np.maximum.at(x1, inv, cat["x1"])
+    return {"cy": (np.bincount(inv, cat["sy"], k) / n).astype(np.float32),
+            "cx": (np.bincount(inv, cat["sx"], k) / n).astype(np.float32),
+            "area": n.astype(np.int32),
+            "y0": y0.astype(np.int32), "x0": x0.astype(np.int32),
+            "y1": y1.astype(np.int32), "x1": x1.astype(np.int32),
+            "dab_od": (np.bincount(inv, cat["sod"], k) / n).astype(np.float32)}
+
+def _write_cells(path, cells, **meta):
+    """Tableau par cellule (colonnes numpy) → .npz compressé ; meta = scalaires (niveau, seuil…)."""
+    cells = [c for c in cells if c is not None]
+    cols = ("cy", "cx", "area", "y0", "x0", "y1", "x1", "dab_od")
+    if cells:
+        data = {k: np.concatenate([c[k] for c in cells]) for k in cols}
+    else:
+        data = {k: np.zeros(0, np.float32) for k in cols}
+    np.savez_compressed(path, **data, **{k: np.asarray(v) for k, v in meta.items()})
+    return path
+
+def _label_subcontours(markers):
+    """
+    Contours externes de chaque label > 1 du watershed, extraits sur la bbox du label (+1 px)
+    au lieu du ROI entier (markers == lid sur tout le ROI coûtait O(labels × ROI)).
+    Même résultat que findContours(markers == lid) : coordonnées ROI via offset.
+    """
+    ys, xs = np.nonzero(markers > 1)
+    if ys.size == 0:
+        return
+    lab = markers[ys, xs]
+    order = np.argsort(lab, kind="stable")
+    lab, ys, xs = lab[order], ys[order], xs[order]
+    lids, starts = np.unique(lab, return_index=True)
+    y0, y1 = np.minimum.reduceat(ys, starts), np.maximum.reduceat(ys, starts)
+    x0, x1 = np.minimum.reduceat(xs, starts), np.maximum.reduceat(xs, starts)
+    h, w = markers.shape
+    for lid, a0, a1, b0, b1 in zip(lids, y0, y1, x0, x1):
+        ya, yb = max(0, int(a0) - 1), min(h, int(a1) + 2)
+        xa, xb = max(0, int(b0) - 1), min(w, int(b1) + 2)
+        m = (markers[ya:yb, xa:xb] == lid).astype(np.uint8)
+        cs, _ = cv2.findContours(m, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(xa, ya))
+        yield lid, cs
+
+def _small_batch(contours, binary, output=None, od=None, cells=None):
+    """
+    Petits contours (1 noyau chacun) traités en lot : un seul tracé vert ; pour le tableau par cellule,
+    une image de labels par fenêtre SMALL_BATCH_WIN (chaque contour rempli à son propre label, les contours
+    externes sont disjoints) puis _label_sums / _merge_sums une seule fois — plus de masque par noyau.
+    """
+    if not contours:
+        return
+    if output is not None:
+        with _timed("draw"):
+            cv2.drawContours(output, contours, -1, COL_GREEN, 1)
+    if cells is None:
+        return
+    with _timed("cells"):
+        rects = np.array([cv2.boundingRect(c) for c in contours], np.int64).reshape(-1, 4)
+        keys = (rects[:, 1] // SMALL_BATCH_WIN) * (1 << 32) + rects[:, 0] // SMALL_BATCH_WIN
+        order = np.argsort(keys, kind="stable")
+        parts = []
+        for grp in np.split(order, np.flatnonzero(np.diff(keys[order])) + 1):
+            r = rects[grp]
+            y, x = int(r[:, 1].min()), int(r[:, 0].min())
+            y2, x2 = int((r[:, 1] + r[:, 3]).max()), int((r[:, 0] + r[:, 2]).max())
+            lab = np.zeros((y2 - y, x2 - x), np.int32)
+            for i in grp:                                  # label = rang global + 1 → ids uniques entre fenêtres
+                cv2.drawContours(lab, [contours[i]], -1, int(i) + 1, thickness=cv2.FILLED, offset=(-x, -y))
+            parts.append(_label_sums(lab, binary[y:y2, x:x2] > 0, None if od is None else od[y:y2, x:x2], y, x))
+        cells.append(_merge_sums(parts))
+
+def _count_contour(cnt, area, binary_dab, output=None, od=None, cells=None, small=None):
+    """
+    Traite UN contour brut (unité de travail) et retourne le nombre de noyaux.
+    - petit → 1 noyau (contour vert) ; small (liste) → contour mis de côté pour _small_batch
+    - énorme → watershed tuilé + bords violets
+    - normal → watershed plein ; contours verts ou bords violets si > DRAW_LIMIT_ROI
+    output=None → comptage seul : aucun tracé (mêmes comptes qu’avec overlay).
+    cells (liste) → y ajoute le tableau par cellule du contour (od = densité optique DAB pleine lame),
+    une ligne par label compté ; None si le ROI n’a pas de tableau (mode "overlap") → export partiel.
+    """
+    if not (MIN_AREA < area < MAX_AREA):
+        return 0
+
+    if area <= SMALL_AREA:
+        _tcount("roi_small")
+        if small is not None:
+            small.append(cnt)
+        else:
+            _small_batch([cnt], binary_dab, output, od, cells)
+        return 1
+
+    x, y, w, h = cv2.boundingRect(cnt)
+    roi = _roi_isolated(binary_dab, cnt, x, y, w, h)
+    od_roi = None if od is None else od[y:y+h, x:x+w]
+
+    if w * h >= HUGE_ROI_PIXELS:
+        _tcount("roi_huge_tiled")
+        with _timed("ws_huge_tiled"):
+            if TILED_WATERSHED == "stitch" and cells is not None:
+                edge_mask, n_cells, feats = _watershed_edges_stitched_and_count(roi, tile=TILE_SIZE,
+                                                                                od=od_roi, origin=(y, x))
+                cells.append(feats)
+            elif TILED_WATERSHED == "stitch":
+                edge_mask, n_cells = _watershed_edges_stitched_and_count(roi, tile=TILE_SIZE)
+            else:
+                # mode "overlap" : pas de labels globaux → pas de tableau par cellule pour ce ROI
+                edge_mask, n_cells = _watershed_edges_tiled_and_count(roi, tile=TILE_SIZE, overlap=TILE_OVERLAP)
+                if cells is not None:
+                    cells.append(None)
+        if output is not None:
+            with _timed("draw"):
+                _draw_edges_into(output, x, y, edge_mask, color=COL_VIOLET, thick=EDGE_THICKNESS)
+                cv2.rectangle(output, (x, y), (x + w, y + h), COL_YELLOW, 1)
+        _tcount("cells_ws_huge_tiled", n_cells)
+        return n_cells
+
+    # même watershed pour les deux branches : temps imputé après coup (ws_full / ws_drawlimit)
+    t_ws = time.perf_counter()
+    markers = _watershed_full(roi)
+    labels = np.unique(markers[roi > 0])               # labels portant des pixels DAB (lignes exportables)
+    labels = labels[labels > 1]
+    num_labels = int(labels.size)
+    t_ws = time.perf_counter() - t_ws
+
+    if num_labels > DRAW_LIMIT_ROI:
+        _tcount("roi_draw_limit")
+        _tadd("ws_drawlimit", t_ws)
+        if output is not None:
+            with _timed("draw"):
+                edge_mask = (markers == -1).astype(np.uint8) * 255
+                _draw_edges_into(output, x, y, edge_mask, color=COL_VIOLET, thick=EDGE_THICKNESS)
+                cv2.rectangle(output, (x, y), (x + w, y + h), COL_YELLOW, 1)
+        if cells is not None:
+            cells.append(_merge_sums([_label_sums(np.where(markers > 1, markers, 0), roi > 0, od_roi, y, x)]))
+        _tcount("cells_ws_drawlimit", num_labels)
+        return num_labels
+
+    _tcount("roi_normal")
+    _tadd("ws_full", t_ws)
+    kept = []
+    with _timed("labels_contours"):   # extraction par label (+ tracés verts si overlay)
+        for lid, cs in _label_subcontours(markers):
+            for sc in cs:
+                sa = cv2.contourArea(sc)
+                if MIN_AREA < sa < MAX_AREA:
+                    if output is not None:
+                        cv2.drawContours(output, [sc], -1, COL_GREEN, 1, offset=(x, y))
+                    kept.append(lid)
+    # un noyau par label retenu (même si le label a plusieurs morceaux) = une ligne du tableau par cellule
+    kept = np.intersect1d(np.array(kept, dtype=markers.dtype), labels)
+    n = int(kept.size)
+    if cells is not None and n:
+        with _timed("cells"):
+            lab = np.where(np.isin(markers, kept), markers, 0)
+            cells.append(_merge_sums([_label_sums(lab, roi > 0, od_roi, y, x)]))
+    _tcount("cells_ws_full", n)
+    return n
+
+def _marker_from_name(filename):
+    u = filename.upper()
+    return "CD3" if "CD3" in u else "CD7" if "CD7" in u else "?"
+
+def _stratified_order(contours, stratum=None, seed=None):
+    """
+    Ordre de traitement “anytime” des contours :
+    grille de strates (stratum px), ordre aléatoire dans chaque case, cases servies à tour de rôle.
+    À tout instant, les contours déjà traités forment un échantillon stratifié de tout le tissu.
+    Graine fixe → ordre reproductible.
+    """
+    stratum = ANYTIME_STRATUM if stratum is None else stratum
+    seed = ANYTIME_SEED if seed is None else seed
+    n = len(contours)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    pts = np.array([c[0, 0] for c in contours], dtype=np.int64)      # 1er point (x, y) du contour
+    keys = (pts[:, 1] // stratum) * (1 << 32) + (pts[:, 0] // stratum)
+
+    perm = rng.permutation(n)
+    _, inv = np.unique(keys[perm], return_inverse=True)
+    inv = inv.ravel()
+    strat_rank = rng.permutation(int(inv.max()) + 1)[inv]            # cases dans un ordre aléatoire
+
+    # rang de chaque contour dans sa case (après permutation)
+    by_case = np.argsort(inv, kind="stable")
+    counts = np.bincount(inv)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    rank = np.empty(n, dtype=np.int64)
+    rank[by_case] = np.arange(n) - starts
+
+    return perm[np.lexsort((strat_rank, rank))]                       # tour 0 de chaque case, puis tour 1…
+
+def _ratio_estimate(counts, areas, total_area, n_units, z=1.96):
+    """
+    Estimateur par ratio (noyaux / surface DAB) sur les unités traitées, extrapolé à toute la surface DAB.
+    Retourne (estimation, ic_bas, ic_haut) ou None si rien d’exploitable.
+    IC : variance du ratio avec correction de population finie.
+    """
+    n = int(counts.size)
+    a_sum = float(areas.sum())
+    c_sum = float(counts.sum())
+    if n == 0 or a_sum <= 0:
+        return None
+    r = c_sum / a_sum
+    est = r * total_area
+    if n > 1:
+        s2 = float(((counts - r * areas) ** 2).sum()) / (n - 1)
+        fpc = max(0.0, 1.0 - n / max(1, n_units))
+        half = z * total_area * np.sqrt(fpc * s2 / n) / (a_sum / n)
+    else:
+        half = est
+    return est, max(c_sum, est - half), est + half
+
+def _count_contours_anytime(contours, binary, output, deadline, od=None, cells=None):
+    """
+    Compte tous les contours dans l’ordre stratifié ; s’arrête à deadline (time.time()).
+    Si interrompu : estimation par ratio + IC95 sur la partie traitée.
+    Retourne un dict : n (compté ou estimé), n_counted, est (None si complet), n_done, n_units, partial.
+    """
+    areas = np.array([cv2.contourArea(c) for c in contours], dtype=np.float64)
+    order = _stratified_order(contours)
+    unit_counts = np.zeros(len(contours), dtype=np.float64)
+    n_counted = 0
+    n_done = 0
+    partial = False
+    small = [] if (output is not None or cells is not None) else None
+
+    for i in order:
+        if time.time() > deadline:
+            partial = True
+            break
+        n = _count_contour(contours[i], areas[i], binary, output, od=od, cells=cells, small=small)
+        unit_counts[i] = n
+        n_counted += n
+        n_done += 1
+    _small_batch(small, binary, output, od, cells)
+
+    est = None
+    n_final = n_counted
+    if partial:
+        done = order[:n_done]
+        est = _ratio_estimate(unit_counts[done], areas[done], float(areas.sum()), len(contours))
+        if est is not None:
+            n_final = int(round(est[0]))
+    return {"n": n_final, "n_counted": n_counted, "est": est,
+            "n_done": n_done, "n_units": len(contours), "partial": partial}
+
+def _stats_columns(stats):
+    """Résumé d’instrumentation d’une lame → colonnes du CSV (détail complet dans la trace JSONL)."""
+    t, n = stats["t"], stats["n"]
+    return {
+        "Temps_total_s": round(t.get("total", 0.0), 2),
+        "Temps_lecture_s": round(t.get("read", 0.0), 2),
+        "Temps_DAB_s": round(t.get("dab", 0.0), 2),
+        "Temps_watershed_s": round(t.get("ws_full", 0.0) + t.get("ws_drawlimit", 0.0) + t.get("ws_huge_tiled", 0.0), 2),
+        "Temps_tracé_s": round(t.get("draw", 0.0), 2),
+        "ROI_petits": n.get("roi_small", 0),
+        "ROI_normaux": n.get("roi_normal", 0),
+        "ROI_repli_bords": n.get("roi_draw_limit", 0),
+        "ROI_tuilés": n.get("roi_huge_tiled", 0),
+        "Tuiles_ignorées": n.get("dab_tiles_skipped", 0) + n.get("ws_tiles_skipped", 0),
+    }
+
+def _csv_row(filename, seuil, area_mask, res, res_neg=None, level=LEVEL):
+    """Ligne de resume_detection.csv (une lame, un seuil) ; res_neg → colonnes négatifs / % positifs."""
+    n, est = res["n"], res["est"]
+    row = {
+        "Fichier": filename,
+        "Marqueur": _marker_from_name(filename),
+        "Niveau": level,
+        "Seuil_DAB": seuil,
+        "Min_Area": MIN_AREA,
+        "Max_Area": MAX_AREA,
+        "Noyaux_detectés": n,
+        "Surface_masquée (px)": area_mask,
+        "Densité_noyaux (%)": round((n / area_mask) * 100, 3) if area_mask > 0 else 0.0,
+        "Statut": "partiel_estimé" if res["partial"] else "complet",
+        "Noyaux_comptés": res["n_counted"],
+        "IC95_bas": int(np.floor(est[1])) if est else res["n_counted"],
+        "IC95_haut": int(np.ceil(est[2])) if est else res["n_counted"],
+        "Fraction_traitée": round(res["n_done"] / res["n_units"], 4) if res["n_units"] else 1.0,
+    }
+    if res_neg is not None:
+        n_neg = res_neg["n"]
+        row["Noyaux_négatifs"] = n_neg
+        row["Statut_négatifs"] = "partiel_estimé" if res_neg["partial"] else "complet"
+        row["Pourcentage_positifs (%)"] = round(100.0 * n / (n + n_neg), 3) if (n + n_neg) > 0 else 0.0
+    return row
+
+# ===================== Overlay DeepZoom =======================
+def _dz_imwrite(path, rgb):
+    params = [cv2.IMWRITE_JPEG_QUALITY, DZ_JPEG_QUALITY] if DZ_EXT == "jpg" else [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    cv2.imwrite(path, cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), params)
+
+def _dz_levels(W, H):
+    """Dimensions (w, h) de chaque niveau DeepZoom, du niveau 0 (1×1) au niveau plein format."""
+    n = int(math.ceil(math.log2(max(W, H, 1)))) + 1
+    return [(max(1, -(-W // (1 << (n - 1 - l)))), max(1, -(-H // (1 << (n - 1 - l))))) for l in range(n)]
+
+def _write_deepzoom(image_rgb, base_path, tile=DZ_TILE):
+    """
+    Écrit image_rgb en pyramide DeepZoom (base_path.dzi + base_path_files/<niveau>/<col>_<row>.<ext>).
+    - Niveau plein format : encodé bande par bande (une rangée de tuiles à la fois, pas de copie globale).
+    - Niveaux inférieurs : chacun réduit en mémoire depuis le niveau au-dessus (jamais depuis les tuiles
+      JPEG relues : pas de pertes cumulées) ; le JPEG ne sert qu’à l’écriture.
+    Le plein format n’est plus référencé ici une fois le niveau -1 calculé (¼ de sa taille) : si l’appelant
+    n’en garde pas de référence (_background_writer), il est libéré avant l’écriture du reste de la pyramide.
+    """
+    H, W = image_rgb.shape[:2]
+    files_dir = base_path + "_files"
+    if os.path.isdir(files_dir):
+        shutil.rmtree(files_dir, ignore_errors=True)
+    levels = _dz_levels(W, H)
+    top = len(levels) - 1
+
+    img = image_rgb
+    image_rgb = None
+    for l in range(top, -1, -1):
+        lw, lh = levels[l]
+        if l < top:
+            img = cv2.resize(img, (lw, lh), interpolation=cv2.INTER_AREA)
+        d = os.path.join(files_dir, str(l)); os.makedirs(d, exist_ok=True)
+        for r, y in enumerate(range(0, lh, tile)):
+            band = img[y:min(y + tile, lh)]
+            for c, x in enumerate(range(0, lw, tile)):
+                _dz_imwrite(os.path.join(d, f"{c}_{r}.{DZ_EXT}"), band[:, x:min(x + tile, lw)])
+        band = None
+    img = None
+
+    with open(base_path + ".dzi", "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{DZ_EXT}" '
+                f'Overlap="0" TileSize="{tile}">\n'
+                f'  <Size Width="{W}" Height="{H}"/>\n'
+                '</Image>\n')
+    return base_path + ".dzi"
+
+# ===================== Historique =======================
+def _params_comptage(**extra):
+    return {**{k: globals()[k] for k in COUNT_PARAMS}, **extra}
+
+def _enregistrer_run(rows, mode, params):
+    """Ajoute les lignes du run à STORE_DB ; une base indisponible n’empêche jamais le CSV."""
+    try:
+        run_id = ajouter_run(STORE_DB, rows, params, mode=mode)
+        if run_id is not None:
+            print(f"🗄 Run {run_id} ajouté à {STORE_DB}")
+    except Exception as e:
+        print(f"⚠ Historique non mis à jour ({STORE_DB}) : {e}")
+
 # ===================== Pipeline =======================
-def detecter_noyaux_dab(root=None, progress_bar=None, progress_label=None):
+def configurer_dossiers(slides_dir=None, json_dir=None, output_dir=None):
+    """
+    Redirige les dossiers d’E/S du module (mode batch / CLI) et recalcule les CSV qui en dépendent.
+    Un argument None laisse le dossier actuel.
+    """
+    global SLIDES_DIR, JSON_DIR, OUTPUT_DIR, CSV_OUTPUT, STORE_DB, TRIAGE_CSV, SWEEP_CSV, CATALOG_JSON, DAB_CACHE_DIR, \
+        OD_PREVIEW_DIR
+    if slides_dir:
+        SLIDES_DIR = slides_dir
+    if json_dir:
+        JSON_DIR = json_dir
+    if output_dir:
+        OUTPUT_DIR = output_dir
+        CSV_OUTPUT = os.path.join(OUTPUT_DIR, "resume_detection.csv")
+        STORE_DB   = os.path.join(OUTPUT_DIR, DB_NAME)
+        TRIAGE_CSV = os.path.join(OUTPUT_DIR, "triage_detection.csv")
+        SWEEP_CSV  = os.path.join(OUTPUT_DIR, "balayage_seuils.csv")
+        CATALOG_JSON = os.path.join(OUTPUT_DIR, "catalogue_lames.json")
+        DAB_CACHE_DIR = os.path.join(OUTPUT_DIR, "cache_dab")
+        OD_PREVIEW_DIR = os.path.join(OUTPUT_DIR, "apercu_dab")
+
+class _MemoryBudget:
+    """
+    Budget mémoire partagé entre lecture anticipée, calcul et écriture.
+    acquire(n) bloque tant que n octets ne tiennent pas dans le budget
+    (sauf si rien n’est réservé : une lame plus grosse que le budget passe seule).
+    """
+    def __init__(self, budget):
+        self.budget = int(budget)
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n):
+        with self.cond:
+            while self.used > 0 and self.used + n > self.budget:
+                self.cond.wait()
+            self.used += n
+
+    def release(self, n):
+        with self.cond:
+            self.used = max(0, self.used - n)
+            self.cond.notify_all()
+
+def _predict_footprint(w, h, count_only=False, cells=EXPORT_CELLS, dual=DUAL_CHANNEL, dab_tile=1536):
+    """
+    Octets prévus pour une lame w×h : RGB + masque + DAB binaire (+ copie overlay en PNG, DO float16,
+    masque hématoxyline) + temporaires d’une tuile rgb2hed (float64, ~64 o/px).
+    """
+    per_px = (3 + 1 + 1 + (3 if OVERLAY_FORMAT == "png" and not count_only else 0)
+              + (2 if cells else 0) + (1 if dual else 0))
+    return w * h * per_px + dab_tile * dab_tile * 64
+
+def _choose_profile(path, count_only=False, degrade=False):
+    """
+    Profil d’exécution d’une lame d’après les seules dimensions (en-tête) et MEM_PROFILE_BUDGET :
+      "normal"       → paramètres du module
+      "léger"        → comptage seul, sans export cellules ni négatifs, tuiles DAB réduites
+      "niveau+1"     → idem au niveau pyramidal suivant (4× moins de pixels)
+    degrade=True (relance après watchdog) : directement le candidat le plus grossier.
+    Retourne un dict (name, level, count_only, cells, dual, dab_tile, nbytes, W0, H0, zone_scale).
+    """
+    slide = _openslide().OpenSlide(path)
+    try:
+        lev0 = min(LEVEL, slide.level_count - 1)
+        W0, H0 = slide.level_dimensions[lev0]
+        ds0 = float(slide.level_downsamples[lev0])
+        candidates = [("normal", lev0, count_only, EXPORT_CELLS, DUAL_CHANNEL, 1536),
+                      ("léger", lev0, True, False, False, LOWMEM_DAB_TILE)]
+        if lev0 + 1 < slide.level_count:
+            candidates.append(("niveau+1", lev0 + 1, True, False, False, LOWMEM_DAB_TILE))
+        if degrade:
+            candidates = candidates[-1:]
+        for name, lev, co, cells, dual, tile in candidates:
+            w, h = slide.level_dimensions[lev]
+            nbytes = _predict_footprint(w, h, co, cells, dual, tile)
+            prof = {"name": name, "level": lev, "count_only": co, "cells": cells, "dual": dual,
+                    "dab_tile": tile, "nbytes": nbytes, "W0": W0, "H0": H0,
+                    "zone_scale": ds0 / float(slide.level_downsamples[lev])}
+            if MEM_PROFILE_BUDGET is None or nbytes <= MEM_PROFILE_BUDGET:
+                break
+        return prof   # le dernier candidat si aucun ne tient : on tente quand même
+    finally:
+        slide.close()
+
+def _rss_bytes(pid=None):
+    """
+    Mémoire résidente du process pid (défaut : celui-ci), en octets : psutil, sinon /proc (Linux)
+    ou psapi (Windows) ; None si inconnu.
+    """
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except Exception:
+            pass
+    try:
+        with open(f"/proc/{pid or 'self'}/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    if os.name == "nt":
+        try:
+            import ctypes
+            from ctypes import wintypes
+            class _PMC(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+            c = _PMC(); c.cb = ctypes.sizeof(_PMC)
+            k32 = ctypes.windll.kernel32
+            # PROCESS_QUERY_LIMITED_INFORMATION | PROCESS_VM_READ
+            h = k32.GetCurrentProcess() if pid is None else k32.OpenProcess(0x1000 | 0x0010, False, pid)
+            try:
+                if h and ctypes.windll.psapi.GetProcessMemoryInfo(h, ctypes.byref(c), c.cb):
+                    return int(c.WorkingSetSize)
+            finally:
+                if pid is not None and h:
+                    k32.CloseHandle(h)
+        except Exception:
+            pass
+    return None
+
+class _PeakRss:
+    """
+    Échantillonne la RSS du process toutes les RSS_SAMPLE_S secondes entre start() et stop() → pic.
+    base = RSS au start() ; peak - base ≈ surcoût de la lame (lecteur / écrivain concurrents compris).
+    """
+    def __init__(self):
+        self.peak = self.base = 0
+        self._stop = threading.Event()
+        self._th = None
+
+    def start(self):
+        self.peak = self.base = _rss_bytes() or 0
+        self._stop.clear()
+        self._th = threading.Thread(target=self._run, daemon=True)
+        self._th.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_S):
+            v = _rss_bytes()
+            if v and v > self.peak:
+                self.peak = v
+
+    def stop(self):
+        self._stop.set()
+        if self._th is not None:
+            self._th.join()
+        v = _rss_bytes()
+        if v and v > self.peak:
+            self.peak = v
+        return self.peak
+
+def _talloc(name, arr):
+    """Note la taille d’un gros tableau de la lame en cours (top des allocations dans la trace)."""
+    st = getattr(_TRACE, "stats", None)
+    if st is not None and arr is not None:
+        st.setdefault("alloc", {})[name] = int(arr.nbytes)
+    return arr
+
+def _prefetch_slides(items, budget, out_q, count_only=False):
+    """
+    Thread lecteur : lit la lame N+1 pendant le calcul de la lame N.
+    items : itérable de (idx, filename, image_path, json_path), dans l’ordre → out_q reçoit les lames dans le même ordre.
+    Le profil mémoire (niveau, comptage seul…) est choisi ici, d’après l’en-tête, avant la lecture.
+    """
+    for idx, filename, image_path, json_path in items:
+        out_q.put(_read_item(idx, filename, image_path, json_path, budget, count_only))
+    out_q.put(None)
+
+def _read_item(idx, filename, image_path, json_path, budget, count_only=False, degrade=False):
+    """Profil (en-tête) puis lecture d’une lame → dict consommé par _process_slide (err renseigné si échec)."""
+    item = {"idx": idx, "filename": filename, "json_path": json_path, "img": None, "err": None, "nbytes": 0}
+    if os.path.exists(json_path):
+        try:
+            prof = _choose_profile(image_path, count_only=count_only, degrade=degrade)
+            item["profile"] = prof
+            item["nbytes"] = prof["nbytes"]
+            budget.acquire(item["nbytes"])
+            t = time.time()
+            if DAB_CACHE:
+                item["cache_key"] = _dab_cache_key(image_path, json_path, prof["level"])
+                # comptage seul + cache complet (masques, DO si export par cellule) : pas de lecture OpenSlide
+                if count_only or prof["count_only"]:
+                    item["dab_cache"] = _dab_cache_load(filename, item["cache_key"], prof["dual"], prof["cells"])
+            if item.get("dab_cache") is None:
+                item["img"] = _read_slide_lowres(image_path, level=prof["level"])
+            item["read_s"] = time.time() - t
+        except Exception as e:
+            budget.release(item["nbytes"]); item["nbytes"] = 0
+            item["err"] = e
+    return item
+
+def _slide_header(path):
+    """En-tête seul (aucun pixel lu) : dimensions par niveau, sous-échantillonnages, MPP, fabricant."""
+    slide = _openslide().OpenSlide(path)
+    try:
+        props = slide.properties
+        def num(key):
+            try:
+                return float(props.get(key))
+            except (TypeError, ValueError):
+                return None
+        return {"dimensions": list(slide.dimensions), "level_count": slide.level_count,
+                "level_dimensions": [list(d) for d in slide.level_dimensions],
+                "level_downsamples": [float(d) for d in slide.level_downsamples],
+                "mpp_x": num(_openslide().PROPERTY_NAME_MPP_X), "mpp_y": num(_openslide().PROPERTY_NAME_MPP_Y),
+                "vendor": props.get(_openslide().PROPERTY_NAME_VENDOR)}
+    finally:
+        slide.close()
+
+def _load_catalog(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cat = json.load(f)
+        return cat if isinstance(cat, dict) else {}
+    except Exception:
+        return {}
+
+def _save_catalog(path, cat):
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(cat, f, indent=1, ensure_ascii=False)
+    except Exception as e:
+        print(f"⚠ Catalogue non écrit : {e}")
+
+def catalogue_lames(slides=None, folder=None, cache_path=None):
+    """
+    Catalogue des lames de folder (défaut SLIDES_DIR) d’après leurs en-têtes, mis en cache dans
+    CATALOG_JSON : une entrée n’est relue que si la taille ou la date du fichier ont changé.
+    Retourne {"lames": {fichier: en-tête + size + mtime}, "s_par_mpx": débit mesuré au dernier run ou None}.
+    """
+    folder = folder or SLIDES_DIR
+    cache_path = cache_path or CATALOG_JSON
+    if slides is None:
+        slides = sorted([f for f in os.listdir(folder) if f.lower().endswith(ALLOWED_EXT)])
+    cache = _load_catalog(cache_path)
+    known = cache.get("lames", {})
+    lames, changed = {}, False
+    for f in slides:
+        p = os.path.join(folder, f)
+        try:
+            st = os.stat(p)
+            e = known.get(f)
+            if not e or e.get("size") != st.st_size or e.get("mtime") != st.st_mtime:
+                e = {**_slide_header(p), "size": st.st_size, "mtime": st.st_mtime}
+                changed = True
+            lames[f] = e
+        except Exception as ex:
+            print(f"⚠ En-tête illisible : {f} ({ex})")
+    if changed:
+        cache["lames"] = {**known, **lames}
+        _save_catalog(cache_path, cache)
+    return {"lames": lames, "s_par_mpx": cache.get("s_par_mpx")}
+
+def _slide_mpx(meta, level=LEVEL):
+    """Mégapixels lus au niveau level (borné au dernier niveau disponible)."""
+    w, h = meta["level_dimensions"][min(level, meta["level_count"] - 1)]
+    return w * h / 1e6
+
+def _largest_first(slides, lames):
+    """Plus grosses lames d’abord ; en-têtes illisibles en dernier (elles échouent vite)."""
+    return sorted(slides, key=lambda f: -_slide_mpx(lames[f]) if f in lames else 0.0)
+
+def _fmt_duree(s):
+    s = int(round(s))
+    if s >= 3600:
+        return f"{s // 3600} h {s % 3600 // 60:02d} min"
+    return f"{s // 60} min {s % 60:02d} s" if s >= 60 else f"{s} s"
+
+def _background_writer(in_q, budget, trace_path=None):
+    """Thread écrivain : encode/écrit l’overlay de la lame N-1 pendant le calcul de la lame N."""
+    while True:
+        job = in_q.get()
+        if job is None:
+            break
+        output, output_path, nbytes = None, job[1], job[2]
+        try:
+            rec = {"event": "write", "file": os.path.basename(output_path), "format": OVERLAY_FORMAT}
+            t = time.perf_counter()
+            if OVERLAY_FORMAT == "dzi":
+                # overlay sorti du job : _write_deepzoom en tient la seule référence et le libère en cours de route
+                _write_deepzoom(job.pop(0), os.path.splitext(output_path)[0])
+                rec["encode_write_s"] = round(time.perf_counter() - t, 4)   # tuiles : encodage et écriture mêlés
+            else:
+                output = job.pop(0)
+                ok, buf = cv2.imencode(".png", cv2.cvtColor(output, cv2.COLOR_RGB2BGR),
+                                       [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+                rec["encode_s"] = round(time.perf_counter() - t, 4)
+                t = time.perf_counter()
+                if ok:
+                    with open(output_path, "wb") as f:
+                        f.write(buf.tobytes())
+                rec["write_s"] = round(time.perf_counter() - t, 4)
+            _trace_write(trace_path, rec)
+        except Exception as e:
+            print(f"⚠ Erreur écriture {os.path.basename(output_path)} : {e}")
+        finally:
+            output = job = None
+            budget.release(nbytes)
+
+def _process_slide(item, count_only, budget, write_q, trace_path, tick=None):
+    """
+    Calcul d’une lame lue par _read_item : masque, DAB, comptage anytime, négatifs, overlay (remis à write_q),
+    export cellules. Retourne la ligne CSV, ou None si la lame est sautée / en erreur.
+    tick(note) : rafraîchissement du statut (appelé aussi depuis la minuterie de la note longue).
+    """
+    tick = tick or (lambda note=None: None)
+    filename, json_path = item["filename"], item["json_path"]
+    row = None
+    nbytes = item["nbytes"]
+    t0 = time.time() - item.get("read_s", 0.0)   # le temps de lecture compte dans le budget TIMEOUT_S
+
+    output_path = os.path.join(OUTPUT_DIR, os.path.splitext(filename)[0] + "_detected_masked.png")
+    handed_to_writer = False
+    stats = _trace_begin()
+    stats["t"]["read"] = item.get("read_s", 0.0)
+    outcome = "skip"
+    rss = _PeakRss().start()
+
+    # NOTE "traitement long" : une minuterie par lame (plus de lecture d’horloge par contour)
+    note = [None]
+    def long_note():
+        note[0] = LONG_NOTE_TEXT
+        tick(note[0])
+    long_delay = max(LONG_NOTE_MIN_S, TIMEOUT_S * LONG_NOTE_FRAC) - (time.time() - t0)
+    long_timer = threading.Timer(max(0.0, long_delay), long_note)
+    long_timer.daemon = True
+    long_timer.start()
+
+    def ui_tick():
+        tick(note[0])
+
+    try:
+        if not os.path.exists(json_path):
+            print("⚠ Masque JSON introuvable — skip")
+            ui_tick();  return None
+
+        # 1) Lecture lame (faite en avance par le thread lecteur)
+        if item["err"] is not None:
+            print(f"⚠ OpenSlide KO : {item['err']}")
+            ui_tick();  return None
+        img_rgb = _talloc("img_rgb", item.pop("img"))
+        prof = item["profile"]
+        slide_count_only = count_only or prof["count_only"]
+        if prof["name"] != "normal":
+            print(f"   💾 Profil mémoire « {prof['name']} » (prévu {prof['nbytes'] / 2**20:.0f} Mo "
+                  f"> budget {MEM_PROFILE_BUDGET / 2**20:.0f} Mo)")
+
+        cached = item.pop("dab_cache", None)
+        H, W = img_rgb.shape[:2] if img_rgb is not None else cached["dab"].shape
+
+        ui_tick()
+
+        if time.time() - t0 > TIMEOUT_S:
+            print("⏱️ Timeout après lecture → skip")
+            ui_tick();  return None
+
+        # 2) Masque zone JSON
+        with _timed("mask"):
+            # polygones bornés au niveau LEVEL puis ramenés au niveau réellement lu (profil "niveau+1")
+            polys = _load_zone_polygons(json_path, prof["W0"], prof["H0"])
+            mask_zone = _talloc("mask_zone", _rasterize_zone(polys, H, W, scale=prof["zone_scale"]))
+
+        # 3) DAB binaire (tuiles) (+ densité optique conservée si export par cellule) — ou cache disque
+        key = item.get("cache_key")
+        preview = None
+        if cached is None and key:
+            with _timed("dab_cache_load"):
+                cached = _dab_cache_load(filename, key, prof["dual"], prof["cells"])
+        if cached is not None:
+            _tcount("dab_cache_hit")
+            binary_dab = _talloc("binary_dab", cached["dab"])
+            binary_hema = _talloc("binary_hema", cached["hema"])
+            od = _talloc("od", cached["od"])
+            cached = None
+        else:
+            with _timed("dab"):
+                od = _talloc("od", np.zeros((H, W), np.float16) if prof["cells"] else None)
+                binary_hema = _talloc("binary_hema", np.zeros((H, W), np.uint8) if prof["dual"] else None)
+                preview = _od_preview_new(H, W) if OD_PREVIEW else None
+                binary_dab = _talloc("binary_dab", _binary_dab_tiled(img_rgb, mask_zone=mask_zone, seuil=SEUIL_DAB,
+                                                                     tile=prof["dab_tile"], od_out=od,
+                                                                     hema_out=binary_hema, seuil_hema=SEUIL_HEMA,
+                                                                     preview=preview))
+            if preview is not None:
+                with _timed("od_preview"):
+                    _od_preview_save(filename, preview, img_rgb, mask_zone, prof["level"])
+                preview = None
+            if key:
+                with _timed("dab_cache_save"):
+                    _dab_cache_save(filename, key, binary_dab, binary_hema, od)
+        cells = [] if prof["cells"] else None
+
+        # 4) Contours bruts
+        with _timed("find_contours"):
+            contours, _ = cv2.findContours(binary_dab, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        _tcount("contours", len(contours))
+        if len(contours) > MAX_CONTOURS:
+            print(f"⚠ {len(contours)} contours (très bruyant) → skip rapide")
+            ui_tick();  return None
+
+        # overlay DeepZoom : on dessine directement dans img_rgb (plus utilisé après la DAB) → pas de copie pleine lame
+        # comptage seul : pas d’overlay du tout
+        if slide_count_only:
+            output = None
+        else:
+            output = img_rgb if OVERLAY_FORMAT == "dzi" else _talloc("output", img_rgb.copy())
+
+        # 5) Boucle contours — ordre stratifié “anytime” : si le timeout tombe,
+        #    l’échantillon traité couvre tout le tissu et on extrapole (au lieu d’un comptage biaisé)
+        #    En DUAL_CHANNEL, NEG_TIMEOUT_FRAC du budget reste réservé aux négatifs.
+        t_pos = TIMEOUT_S * (1.0 - NEG_TIMEOUT_FRAC) if binary_hema is not None else TIMEOUT_S
+        res = _count_contours_anytime(contours, binary_dab, output, deadline=t0 + t_pos,
+                                      od=od, cells=cells)
+        if res["partial"]:
+            print("⏱️ Timeout en traitement → estimation sur la partie traitée et on passe")
+        n_dab_detected = res["n"]
+
+        # 5b) Noyaux négatifs (hématoxyline sans DAB) : même déconvolution, mêmes règles de comptage,
+        #     pas de tracé ; fin du budget de la lame (t0 + TIMEOUT_S), même logique anytime
+        res_neg = None
+        if binary_hema is not None:
+            _TRACE.stats = {"t": {}, "n": {}}          # compteurs séparés pour les négatifs
+            contours_neg, _ = cv2.findContours(binary_hema, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            if len(contours_neg) > MAX_CONTOURS:
+                print(f"⚠ {len(contours_neg)} contours hématoxyline (très bruyant) → négatifs non comptés")
+            else:
+                res_neg = _count_contours_anytime(contours_neg, binary_hema, None, deadline=t0 + TIMEOUT_S)
+            stats["negatives"] = _TRACE.stats
+            _TRACE.stats = stats
+            contours_neg = binary_hema = None
+
+        # 6) Contour ROUGE de la zone → écriture en arrière-plan (libère le budget une fois écrit)
+        if output is not None:
+            with _timed("draw"):
+                contours_json, _ = cv2.findContours(mask_zone, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                cv2.drawContours(output, contours_json, -1, COL_RED, 3)
+            write_q.put([output, output_path, nbytes])
+            handed_to_writer = True
+            output = img_rgb = None     # l’overlay (img_rgb en dzi) n’est plus tenu que par le thread écrivain
+
+        # 7) CSV (+ tableau par cellule)
+        if cells is not None:
+            with _timed("cells"):
+                _write_cells(os.path.join(OUTPUT_DIR, os.path.splitext(filename)[0] + "_cells.npz"), cells,
+                             level=prof["level"], seuil_dab=SEUIL_DAB,
+                             partial=res["partial"] or any(c is None for c in cells))
+        area_mask = int(np.count_nonzero(mask_zone))
+        stats["t"]["total"] = time.time() - t0
+        row = _csv_row(filename, SEUIL_DAB, area_mask, res, res_neg=res_neg, level=prof["level"])
+        row["Profil_mémoire"] = prof["name"]
+        row["Empreinte_prévue_Mo"] = round(prof["nbytes"] / 2**20, 1)
+        peak = rss.stop()
+        row["RSS_pic_process_Mo"] = round(peak / 2**20, 1)
+        row["RSS_delta_lame_Mo"] = round((peak - rss.base) / 2**20, 1)
+        row.update(_stats_columns(stats))
+        outcome = "partiel_estimé" if res["partial"] else "complet"
+
+        if res["est"]:
+            print(f"   ≈ Partiel ({res['n_done']}/{len(contours)} contours) en {time.time() - t0:.1f}s — "
+                  f"noyaux estimés: {n_dab_detected} [IC95 {res['est'][1]:.0f}–{res['est'][2]:.0f}]")
+        else:
+            print(f"   ✓ OK en {time.time() - t0:.1f}s — noyaux: {n_dab_detected}")
+
+    except Exception as e:
+        print(f"⚠ Erreur avec {filename} : {e}")
+        outcome = "erreur"
+
+    finally:
+        long_timer.cancel()
+        if not handed_to_writer:
+            budget.release(nbytes)
+        stats["t"].setdefault("total", time.time() - t0)
+        peak = rss.stop()
+        alloc = sorted(stats.get("alloc", {}).items(), key=lambda kv: -kv[1])[:5]
+        _trace_write(trace_path, {"event": "slide", "file": filename, "outcome": outcome,
+                                  "profile": item["profile"]["name"] if item and "profile" in item else None,
+                                  "rss_peak_mb": round(peak / 2**20, 1),
+                                  "alloc_top_mb": {k: round(v / 2**20, 1) for k, v in alloc},
+                                  "stages_s": {k: round(v, 4) for k, v in stats["t"].items()},
+                                  "counters": stats["n"],
+                                  **({"negatives": stats["negatives"]} if "negatives" in stats else {})})
+        _trace_end()
+        # références locales lâchées (l’overlay éventuel n’est plus tenu que par le thread écrivain)
+        item = img_rgb = binary_dab = binary_hema = mask_zone = output = contours = od = cells = None
+    return row
+
+def _reglages_worker():
+    """Réglages du process courant à rejouer dans le process fils (qui réimporte le module avec ses défauts)."""
+    return {**_params_comptage(), **{k: globals()[k] for k in WORKER_SETTINGS}}
+
+def _slide_worker(conn, job):
+    """
+    Process fils (ISOLATE_SLIDES) : lit, compte et écrit une lame ; renvoie ("ok", ligne CSV ou None) par conn.
+    Le fils réimporte le module : réglages (job["settings"]) et threads OpenCV du parent appliqués d’abord.
+    """
+    try:
+        globals().update(job["settings"])
+        if job.get("threads") is not None:
+            cv2.setNumThreads(int(job["threads"]))
+        configurer_dossiers(job["slides_dir"], job["json_dir"], job["output_dir"])
+        budget = _MemoryBudget(MEM_BUDGET_BYTES)
+        write_q = queue.Queue()
+        item = _read_item(job["idx"], job["filename"], os.path.join(SLIDES_DIR, job["filename"]),
+                          os.path.join(JSON_DIR, os.path.splitext(job["filename"])[0] + "_annotation.json"),
+                          budget, job["count_only"], degrade=job["degrade"])
+        row = _process_slide(item, job["count_only"], budget, write_q, job["trace_path"])
+        write_q.put(None)
+        _background_writer(write_q, budget, job["trace_path"])     # écriture dans ce process, avant de rendre la main
+        conn.send(("ok", row))
+    except BaseException as e:
+        conn.send(("erreur", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+def _supervise_slide(job):
+    """Lance _slide_worker et le surveille : délai WATCHDOG_S, RSS WATCHDOG_RSS_BYTES → kill. Retourne (statut, charge)."""
+    ctx = multiprocessing.get_context("spawn")
+    rx, tx = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_slide_worker, args=(tx, job), daemon=True)
+    p.start()
+    tx.close()
+    t_end = time.time() + WATCHDOG_S
+    try:
+        while True:
+            if rx.poll(WATCHDOG_POLL_S):
+                try:
+                    return rx.recv()
+                except EOFError:
+                    p.join(1)
+                    return "tué", f"process arrêté (code {p.exitcode})"
+            if not p.is_alive():
+                if rx.poll(0):
+                    continue
+                return "tué", f"process arrêté (code {p.exitcode})"
+            if time.time() > t_end:
+                return "tué", f"délai {WATCHDOG_S:.0f}s dépassé"
+            rss = _rss_bytes(p.pid)
+            if WATCHDOG_RSS_BYTES and rss and rss > WATCHDOG_RSS_BYTES:
+                return "tué", f"mémoire {rss / 2**30:.1f} Go > {WATCHDOG_RSS_BYTES / 2**30:.1f} Go"
+    finally:
+        if p.is_alive():
+            p.kill()
+        p.join(5)
+        rx.close()
+
+def _run_slide_isolated(idx, filename, count_only, trace_path):
+    """
+    Une lame en process fils surveillé ; sur kill ou erreur, une relance en profil dégradé
+    (niveau suivant, comptage seul). Colonne Isolation du CSV : ok / relance dégradée / échec.
+    """
+    job = {"idx": idx, "filename": filename, "count_only": count_only, "trace_path": trace_path,
+           "slides_dir": SLIDES_DIR, "json_dir": JSON_DIR, "output_dir": OUTPUT_DIR,
+           "settings": _reglages_worker(), "threads": cv2.getNumThreads()}
+    reasons = []
+    for degrade in (False, True):
+        status, payload = _supervise_slide({**job, "degrade": degrade})
+        if status == "ok":
+            if payload is not None:
+                payload["Isolation"] = f"relance dégradée ({reasons[0]})" if degrade else "ok"
+            return payload
+        reasons.append(payload)
+        print(f"   🛑 {payload} → {'abandon' if degrade else 'relance en profil dégradé'}")
+    _trace_write(trace_path, {"event": "slide", "file": filename, "outcome": "échec_isolé", "reasons": reasons})
+    return {"Fichier": filename, "Marqueur": _marker_from_name(filename), "Statut": "échec",
+            "Isolation": "échec (" + " / ".join(reasons) + ")"}
+
+def detecter_noyaux_dab(root=None, progress_bar=None, progress_label=None, count_only=None, slides=None):
+    """
+    Détection DAB de toutes les lames de SLIDES_DIR → overlays + resume_detection.csv.
+    count_only (défaut COUNT_ONLY) : comptage seul, sans allocation ni tracé ni écriture d’overlay.
+    slides : noms de fichiers dans SLIDES_DIR (défaut : tout le dossier). Une liste est cataloguée (en-têtes)
+    puis traitée plus grosse d’abord (LARGEST_FIRST) avec une durée estimée affichée avant le départ.
+    Peut aussi être un itérable alimenté au fil de l’eau (mode batch de pipeline_cli) : ordre d’arrivée.
+    progress_bar / progress_label ne reçoivent que des écritures (["value"], config(text=…)), depuis ce thread
+    et depuis la minuterie de la note longue : passer des relais thread-safe (cf. mainGUI) si l’appel
+    tourne hors du thread Tk. root n’est plus utilisé (pas de root.update() dans la boucle de calcul).
+    """
+    if count_only is None:
+        count_only = COUNT_ONLY
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    all_slides = sorted([f for f in os.listdir(SLIDES_DIR) if f.lower().endswith(ALLOWED_EXT)])
+    if slides is None:
+        slides = sorted([f for f in os.listdir(SLIDES_DIR) if f.lower().endswith(ALLOWED_EXT)])
+    n_total = str(len(slides)) if hasattr(slides, "__len__") else "?"
     csv_rows = []
 
     # utilité pour afficher 1 ou 2 lignes sous la barre
@@ -177,170 +1608,255 @@ def detecter_noyaux_dab(root=None, progress_bar=None, progress_label=None):
         if progress_label:
             progress_label.config(text=f"{main_text}\n{extra_line}" if extra_line else str(main_text))
 
+    if progress_bar:
+        progress_bar["value"] = 0
+        if n_total != "?":
+            progress_bar["maximum"] = int(n_total)
+
+    # catalogue (en-têtes seuls) → plus grosses lames d’abord + durée estimée
+    cat = None
+    if n_total != "?":
+        cat = catalogue_lames(slides)
+        if LARGEST_FIRST:
+            slides = _largest_first(slides, cat["lames"])
+        mpx = sum(_slide_mpx(m) for m in cat["lames"].values())
+        eta = mpx * (cat["s_par_mpx"] or ETA_S_PER_MPX)
+        msg = f"⏳ {n_total} lames, {mpx:.0f} Mpx — durée estimée ≈ {_fmt_duree(eta)}"
+        print(msg); set_status(msg)
+    t_run = time.time()
+
+    # pipeline 3 étages : lecture (thread) → calcul (ici) → écriture (thread), borné par MEM_BUDGET_BYTES.
+    # Les lames sortent du lecteur dans l’ordre de slides ; le CSV est retrié par fichier à la fin.
+    items = ((i, f, os.path.join(SLIDES_DIR, f),
+              os.path.join(JSON_DIR, os.path.splitext(f)[0] + "_annotation.json")) for i, f in enumerate(slides))
+    budget = _MemoryBudget(MEM_BUDGET_BYTES)
+    read_q  = queue.Queue(maxsize=max(1, PREFETCH_SLIDES))
+    write_q = queue.Queue()
+    trace_path = os.path.join(OUTPUT_DIR, f"trace_{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl") if TRACE else None
+
+    def ui_tick(idx, extra=None):
+        if progress_bar:   progress_bar["value"] = idx + 1
+        set_status(f"{idx+1}/{n_total} lames traitées", extra)
+
+    if ISOLATE_SLIDES:
+        # une lame = un process fils surveillé ; pas de lecture anticipée (chaque fils lit sa lame)
+        for idx, filename in enumerate(slides):
+            print(f"\n→ {idx+1}/{n_total} : {filename}  [isolée]")
+            row = _run_slide_isolated(idx, filename, count_only, trace_path)
+            if row is not None:
+                csv_rows.append(row)
+            ui_tick(idx)
+    else:
+        reader = threading.Thread(target=_prefetch_slides, args=(items, budget, read_q, count_only), daemon=True)
+        writer = threading.Thread(target=_background_writer, args=(write_q, budget, trace_path), daemon=True)
+        reader.start(); writer.start()
+
+        while True:
+            item = read_q.get()
+            if item is None:
+                break
+            idx = item["idx"]
+            print(f"\n→ {idx+1}/{n_total} : {item['filename']}")
+            row = _process_slide(item, count_only, budget, write_q, trace_path,
+                                 tick=lambda extra=None, idx=idx: ui_tick(idx, extra))
+            item = None
+            if row is not None:
+                csv_rows.append(row)
+
+            # UI + ménage
+            ui_tick(idx)
+            gc.collect()
+
+        # fin du pipeline : attendre les dernières écritures
+        write_q.put(None)
+        writer.join()
+        reader.join()
+
+    # débit mesuré (s / Mpx, lissé) → ETA du prochain run
+    if cat is not None and csv_rows:
+        mpx_done = sum(_slide_mpx(cat["lames"][r["Fichier"]]) for r in csv_rows if r["Fichier"] in cat["lames"])
+        if mpx_done > 0:
+            rate = (time.time() - t_run) / mpx_done
+            cache = _load_catalog(CATALOG_JSON)
+            cache["s_par_mpx"] = round(rate if not cache.get("s_par_mpx") else 0.5 * (cache["s_par_mpx"] + rate), 4)
+            _save_catalog(CATALOG_JSON, cache)
+
+    # 8) Sauvegarde CSV (ordre des fichiers, indépendant de l’ordre de traitement)
+    csv_rows.sort(key=lambda r: r["Fichier"])
+    try:
+        import pandas as pd
+        pd.DataFrame(csv_rows).to_csv(CSV_OUTPUT, sep=';', index=False)
+        print(f"\n📄 Résumé CSV : {CSV_OUTPUT}")
+        if trace_path:
+            print(f"🧭 Trace : {trace_path}")
+    except Exception as e:
+        print(f"❌ Erreur CSV : {e}")
+    _enregistrer_run(csv_rows, "complet", _params_comptage())
+
+    if progress_label:
+        progress_label.config(text="✅ Détection terminée")
+
+# ===================== Modes rapides =======================
+def balayer_seuils_dab(seuils=SWEEP_SEUILS, root=None, progress_bar=None, progress_label=None):
+    """
+    Balayage de SEUIL_DAB : lecture + déconvolution UNE fois par lame, puis masque, contours et
+    watershed pour chaque seuil. Écrit SWEEP_CSV avec une ligne par (lame, seuil). Pas d’overlay PNG.
+    """
+    seuils = sorted(float(v) for v in seuils)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    all_slides = sorted([f for f in os.listdir(SLIDES_DIR) if f.lower().endswith(ALLOWED_EXT)])
+    rows = []
+
     if progress_bar:
         progress_bar["value"] = 0
         progress_bar["maximum"] = len(all_slides)
 
     for idx, filename in enumerate(all_slides):
         t0 = time.time()
-        print(f"\n→ {idx+1}/{len(all_slides)} : {filename}")
-
-        image_path = os.path.join(SLIDES_DIR, filename)
-        json_path  = os.path.join(JSON_DIR, os.path.splitext(filename)[0] + "_annotation.json")
-        output_path = os.path.join(OUTPUT_DIR, os.path.splitext(filename)[0] + "_detected_masked.png")
-
-        # NOTE basée sur le temps écoulé
-        def long_note_if_any():
-            elapsed = time.time() - t0
-            if elapsed >= max(LONG_NOTE_MIN_S, TIMEOUT_S * LONG_NOTE_FRAC):
-                # <<< message demandé >>>
-                return "Lame très chargée en cellules marquées — observation plus longue..."
-            return None
-
-        def ui_tick(extra=None):
-            if progress_bar:   progress_bar["value"] = idx + 1
-            set_status(f"{idx+1}/{len(all_slides)} lames traitées", extra)
-            if root:
-                root.update_idletasks(); root.update()
-
+        print(f"\n→ Balayage {idx+1}/{len(all_slides)} : {filename}")
+        json_path = os.path.join(JSON_DIR, os.path.splitext(filename)[0] + "_annotation.json")
         try:
             if not os.path.exists(json_path):
                 print("⚠ Masque JSON introuvable — skip")
-                ui_tick();  continue
-
-            # 1) Lecture lame
-            try:
-                img_rgb = _read_slide_lowres(image_path, level=LEVEL)
-            except Exception as e:
-                print(f"⚠ OpenSlide KO : {e}")
-                ui_tick();  continue
-
+                continue
+            img_rgb = _read_slide_lowres(os.path.join(SLIDES_DIR, filename), level=LEVEL)
             H, W = img_rgb.shape[:2]
+            mask_zone = _rasterize_zone(_load_zone_polygons(json_path, W, H), H, W)
+            area_mask = int(np.count_nonzero(mask_zone))
+            levels = _dab_levels_tiled(img_rgb, mask_zone=mask_zone, seuils=seuils, tile=1536)
+            img_rgb = None   # plus utile après la déconvolution
 
-            # MAJ status en fonction du temps déjà passé
-            extra_line = long_note_if_any()
-            ui_tick(extra=extra_line)
+            for j, seuil in enumerate(seuils):
+                binary = (levels > j).astype(np.uint8) * 255
+                contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                if len(contours) > MAX_CONTOURS:
+                    print(f"   ⚠ seuil {seuil}: {len(contours)} contours (très bruyant) → skip")
+                    continue
+                res = _count_contours_anytime(contours, binary, None, deadline=time.time() + TIMEOUT_S)
+                rows.append(_csv_row(filename, seuil, area_mask, res))
+                print(f"   seuil {seuil:g} → noyaux: {res['n']}" + (" (estimé)" if res["partial"] else ""))
+            print(f"   ✓ {len(seuils)} seuils en {time.time() - t0:.1f}s")
+        except Exception as e:
+            print(f"⚠ Erreur balayage {filename} : {e}")
+        finally:
+            if progress_bar:
+                progress_bar["value"] = idx + 1
+            if progress_label:
+                progress_label.config(text=f"Balayage : {idx+1}/{len(all_slides)} lames")
+            img_rgb = mask_zone = levels = binary = None
+            gc.collect()
 
-            if time.time() - t0 > TIMEOUT_S:
-                print("⏱️ Timeout après lecture → skip")
-                ui_tick(extra=extra_line);  continue
+    try:
+        import pandas as pd
+        pd.DataFrame(rows).to_csv(SWEEP_CSV, sep=';', index=False)
+        print(f"\n📄 Balayage CSV : {SWEEP_CSV}")
+    except Exception as e:
+        print(f"❌ Erreur CSV : {e}")
 
-            # 2) Masque zone JSON
-            mask_zone = np.zeros((H, W), dtype=np.uint8)
-            with open(json_path, "r", encoding="utf-8") as f:
-                annotations = json.load(f)
-            for ann in annotations:
-                coords = np.array(ann["geometry"]["coordinates"][0], dtype=np.float32)
-                coords[:, 0] = np.clip(coords[:, 0], 0, W - 1)
-                coords[:, 1] = np.clip(coords[:, 1], 0, H - 1)
-                cv2.fillPoly(mask_zone, [coords.astype(np.int32)], 1)
+def _triage_slide(image_path, json_path, k=TRIAGE_K, tile=TRIAGE_TILE, seed=ANYTIME_SEED):
+    """
+    Estimation rapide sur UNE lame : k tuiles tissu tirées au hasard (masque JSON),
+    lues directement via OpenSlide (pas de lecture pleine lame), DAB + watershed existants.
+    Retourne un dict (estimation, IC95, surface) ou None si aucune tuile tissu.
+    """
+    slide = _openslide().OpenSlide(image_path)
+    try:
+        lev = min(LEVEL, slide.level_count - 1)
+        W, H = slide.level_dimensions[lev]
+        ds = float(slide.level_downsamples[lev])
+        polys = _load_zone_polygons(json_path, W, H)
 
-            # 3) DAB binaire (tuiles)
-            binary_dab = _binary_dab_tiled(img_rgb, mask_zone=mask_zone, seuil=SEUIL_DAB, tile=1536)
+        # couverture tissu par tuile, sur une grille réduite (évite un masque H×W)
+        g = TRIAGE_GRID_DS
+        small = _rasterize_zone(polys, -(-H // g), -(-W // g), scale=1.0 / g)
+        total_area = float(np.count_nonzero(small)) * g * g
+        cell = max(1, tile // g)
+        ny, nx = -(-small.shape[0] // cell), -(-small.shape[1] // cell)
+        pad = np.zeros((ny * cell, nx * cell), np.float32)
+        pad[:small.shape[0], :small.shape[1]] = small
+        cover = pad.reshape(ny, cell, nx, cell).mean(axis=(1, 3))
+        tys, txs = np.nonzero(cover >= TRIAGE_MIN_TISSUE)
+        if tys.size == 0:
+            return None
 
-            # 4) Contours bruts
-            contours, _ = cv2.findContours(binary_dab, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            if len(contours) > MAX_CONTOURS:
-                print(f"⚠ {len(contours)} contours (très bruyant) → skip rapide")
-                ui_tick(extra=extra_line);  continue
-
-            output = img_rgb.copy()
-            n_dab_detected = 0
-
-            # 5) Boucle contours
-            for cnt in contours:
-                # si on passe le seuil "long", on affiche la note (une seule fois)
-                if extra_line is None:
-                    maybe = long_note_if_any()
-                    if maybe:
-                        extra_line = maybe
-                        ui_tick(extra=extra_line)
-
-                if time.time() - t0 > TIMEOUT_S:
-                    print("⏱️ Timeout en traitement → sauvegarde partielle et on passe")
-                    break
-
-                area = cv2.contourArea(cnt)
-                if not (MIN_AREA < area < MAX_AREA):
-                    continue
+        rng = np.random.default_rng(seed)
+        pick = rng.choice(tys.size, size=min(k, tys.size), replace=False)
+        counts, areas = [], []
+        for j in pick:
+            x, y = int(txs[j]) * tile, int(tys[j]) * tile
+            tw, th = min(tile, W - x), min(tile, H - y)
+            if tw <= 0 or th <= 0:
+                continue
+            rgb = np.array(slide.read_region((int(x * ds), int(y * ds)), lev, (tw, th)).convert("RGB"), dtype=np.uint8)
+            m = _rasterize_zone(polys, th, tw, offset=(x, y))
+            b = _binary_dab_tiled(rgb, mask_zone=m, seuil=SEUIL_DAB, tile=tile)
+            cs, _ = cv2.findContours(b, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            counts.append(sum(_count_contour(c, cv2.contourArea(c), b) for c in cs))
+            areas.append(float(np.count_nonzero(m)))
+    finally:
+        slide.close()
 
-                if area <= SMALL_AREA:
-                    cv2.drawContours(output, [cnt], -1, COL_GREEN, 1)
-                    n_dab_detected += 1
-                    continue
+    est = _ratio_estimate(np.array(counts, np.float64), np.array(areas, np.float64), total_area, int(tys.size))
+    if est is None:
+        return None
+    return {"n_tiles": len(counts), "n_tissue_tiles": int(tys.size),
+            "est": est[0], "lo": est[1], "hi": est[2], "area": total_area}
 
-                x, y, w, h = cv2.boundingRect(cnt)
-                roi = binary_dab[y:y+h, x:x+w]
+def triage_noyaux_dab(root=None, progress_bar=None, progress_label=None, k=TRIAGE_K):
+    """
+    Mode triage : densité de noyaux DAB estimée par échantillonnage (k tuiles/lame), quelques secondes par lame.
+    Écrit triage_detection.csv (mêmes colonnes clés que resume_detection.csv + IC95),
+    exploitable par result.analyser_resultats_cd7(triage=True) pour repérer les patients à relancer en complet.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    all_slides = sorted([f for f in os.listdir(SLIDES_DIR) if f.lower().endswith(ALLOWED_EXT)])
+    rows = []
 
-                if w * h >= HUGE_ROI_PIXELS:
-                    edge_mask, n_cells = _watershed_edges_tiled_and_count(roi, tile=TILE_SIZE, overlap=TILE_OVERLAP)
-                    _draw_edges_into(output, x, y, edge_mask, color=COL_VIOLET, thick=EDGE_THICKNESS)
-                    n_dab_detected += n_cells
-                    cv2.rectangle(output, (x, y), (x + w, y + h), COL_YELLOW, 1)
-                    continue
+    if progress_bar:
+        progress_bar["value"] = 0
+        progress_bar["maximum"] = len(all_slides)
 
-                markers = _watershed_full(roi)
-                labels = np.unique(markers)
-                num_labels = int(np.sum(labels > 1))
-
-                if num_labels > DRAW_LIMIT_ROI:
-                    edge_mask = (markers == -1).astype(np.uint8) * 255
-                    _draw_edges_into(output, x, y, edge_mask, color=COL_VIOLET, thick=EDGE_THICKNESS)
-                    n_dab_detected += num_labels
-                    cv2.rectangle(output, (x, y), (x + w, y + h), COL_YELLOW, 1)
-                else:
-                    for lid in labels:
-                        if lid <= 1:
-                            continue
-                        m = (markers == lid).astype(np.uint8)
-                        cs, _ = cv2.findContours(m, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                        for sc in cs:
-                            sa = cv2.contourArea(sc)
-                            if MIN_AREA < sa < MAX_AREA:
-                                sc[:, 0, 0] += x
-                                sc[:, 0, 1] += y
-                                cv2.drawContours(output, [sc], -1, COL_GREEN, 1)
-                                n_dab_detected += 1
-
-            # 6) Contour ROUGE de la zone
-            contours_json, _ = cv2.findContours(mask_zone, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            cv2.drawContours(output, contours_json, -1, COL_RED, 3)
-            cv2.imwrite(output_path, cv2.cvtColor(output, cv2.COLOR_RGB2BGR),
-                        [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
-
-            # 7) CSV
-            marker = "CD3" if "CD3" in filename.upper() else "CD7" if "CD7" in filename.upper() else "?"
-            area_mask = int(np.count_nonzero(mask_zone))
-            percent_detected = round((n_dab_detected / area_mask) * 100, 3) if area_mask > 0 else 0.0
-            csv_rows.append({
+    for idx, filename in enumerate(all_slides):
+        t0 = time.time()
+        json_path = os.path.join(JSON_DIR, os.path.splitext(filename)[0] + "_annotation.json")
+        try:
+            if not os.path.exists(json_path):
+                print(f"⚠ {filename} : masque JSON introuvable — skip")
+                continue
+            r = _triage_slide(os.path.join(SLIDES_DIR, filename), json_path, k=k)
+            if r is None:
+                print(f"⚠ {filename} : aucune tuile tissu — skip")
+                continue
+            n_est = int(round(r["est"]))
+            rows.append({
                 "Fichier": filename,
-                "Marqueur": marker,
+                "Marqueur": _marker_from_name(filename),
                 "Niveau": LEVEL,
                 "Seuil_DAB": SEUIL_DAB,
-                "Min_Area": MIN_AREA,
-                "Max_Area": MAX_AREA,
-                "Noyaux_detectés": n_dab_detected,
-                "Surface_masquée (px)": area_mask,
-                "Densité_noyaux (%)": percent_detected
+                "Noyaux_detectés": n_est,
+                "Surface_masquée (px)": int(r["area"]),
+                "Densité_noyaux (%)": round((n_est / r["area"]) * 100, 3) if r["area"] > 0 else 0.0,
+                "Statut": "triage",
+                "IC95_bas": int(np.floor(r["lo"])),
+                "IC95_haut": int(np.ceil(r["hi"])),
+                "Tuiles_échantillonnées": r["n_tiles"],
+                "Tuiles_tissu": r["n_tissue_tiles"],
+                "Durée_s": round(time.time() - t0, 2),
             })
-
-            print(f"   ✓ OK en {time.time() - t0:.1f}s — noyaux: {n_dab_detected}")
-
+            print(f"   ≈ {filename} : {n_est} [{r['lo']:.0f}–{r['hi']:.0f}] en {time.time() - t0:.1f}s")
         except Exception as e:
-            print(f"⚠ Erreur avec {filename} : {e}")
+            print(f"⚠ Erreur triage {filename} : {e}")
+        finally:
+            if progress_bar:
+                progress_bar["value"] = idx + 1
+            if progress_label:
+                progress_label.config(text=f"Triage : {idx+1}/{len(all_slides)} lames")
 
-        # UI + ménage
-        ui_tick(extra=extra_line if 'extra_line' in locals() else None)
-        for v in ("img_rgb", "binary_dab", "mask_zone", "output", "roi"):
-            if v in locals(): locals()[v] = None
-        gc.collect()
-
-    # 8) Sauvegarde CSV
     try:
-        pd.DataFrame(csv_rows).to_csv(CSV_OUTPUT, sep=';', index=False)
-        print(f"\n📄 Résumé CSV : {CSV_OUTPUT}")
+        import pandas as pd
+        pd.DataFrame(rows).to_csv(TRIAGE_CSV, sep=';', index=False)
+        print(f"\n📄 Triage CSV : {TRIAGE_CSV}")
     except Exception as e:
         print(f"❌ Erreur CSV : {e}")
-
-    if progress_label:
-        progress_label.config(text="✅ Détection terminée")
+    _enregistrer_run(rows, "triage", _params_comptage(TRIAGE_K=k, TRIAGE_TILE=TRIAGE_TILE,
+                                                      TRIAGE_MIN_TISSUE=TRIAGE_MIN_TISSUE))
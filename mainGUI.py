@@ -1,7 +1,8 @@
+import time
+_T_START = time.perf_counter()   # démarrage à froid (startup_profile.py)
 import tkinter as tk
 from tkinter import messagebox, filedialog, Toplevel, ttk, simpledialog
-import subprocess, sys, os, json, traceback, datetime, glob
-from PIL import Image, ImageTk  # (si besoin plus tard)
+import subprocess, sys, os, json, traceback, datetime, glob, queue, threading
 
 # =========================
 #  Environnement portable
@@ -47,25 +48,23 @@ if ENABLE_LOGS:
     sys.excepthook = _excepthook
 
 # =========================
-#  Imports optionnels
+#  Imports optionnels (différés)
 # =========================
-try:
-    import boost_runtime
-except Exception:
-    boost_runtime = None
-
-try:
-    import pyvips   # via pyvips-binary si présent
-    VIPS_OK = True
-    # [NEW] log console utile pour vérifier la version chargée
+# Rien de lourd avant l’affichage de la fenêtre : pyvips est chargé par annotation_global quand il sert,
+# numpy / OpenCV / OpenSlide / skimage / pandas par l’étape qui les utilise, boost_runtime au premier calcul.
+boost_runtime = None
+_OPTIONNELS_CHARGES = False
+
+def _charger_optionnels():
+    """Modules optionnels du calcul, importés une seule fois au lancement de la première étape."""
+    global boost_runtime, _OPTIONNELS_CHARGES
+    if _OPTIONNELS_CHARGES:
+        return
+    _OPTIONNELS_CHARGES = True
     try:
-        print("pyvips OK — libvips version:", pyvips.version(0))
+        import boost_runtime
     except Exception:
-        pass
-except Exception:
-    pyvips = None
-    VIPS_OK = False
-    print("pyvips KO — non importé")
+        boost_runtime = None
 
 # =========================
 #  Dossiers I/O
@@ -253,10 +252,6 @@ def afficher_progression(valeur, total, _label_widget=None):
         percent = 0
     progress_bar["value"] = percent
     progress_pct.config(text=f"{percent}%")
-    try:
-        root.update_idletasks(); root.update()
-    except Exception:
-        pass
 
 def spinner_on():
     try:
@@ -276,6 +271,83 @@ def spinner_off():
     except Exception:
         pass
 
+# =========================
+#  Calcul en tâche de fond
+# =========================
+# Les étapes lourdes tournent dans un thread ; elles ne touchent jamais Tk directement :
+# tout passe par _UI_Q, vidée par _poll_ui_queue toutes les UI_POLL_MS (after()).
+UI_POLL_MS = 80
+_UI_Q = queue.Queue()
+
+class _WidgetRelay:
+    """Remplaçant d’un widget côté thread de calcul : w["value"] = …, w.config(…), w.stop() → file UI."""
+    def __init__(self, widget):
+        self._w = widget
+
+    def __setitem__(self, key, value):
+        _UI_Q.put(("config", self._w, {key: value}))
+
+    def config(self, **kw):
+        _UI_Q.put(("config", self._w, kw))
+    configure = config
+
+    def stop(self):
+        _UI_Q.put(("call", self._w.stop, ()))
+
+    def start(self, *args):
+        _UI_Q.put(("call", self._w.start, args))
+
+def _relais_progression(valeur, total):
+    """progress_callback appelable depuis le thread de calcul."""
+    _UI_Q.put(("call", afficher_progression, (valeur, total)))
+
+def _poll_ui_queue():
+    """Applique les messages en attente (les config d’un même widget sont fusionnées) puis se replanifie."""
+    pending = {}
+    def flush():
+        for w, kw in pending.items():
+            try: w.config(**kw)
+            except Exception: pass
+        pending.clear()
+    try:
+        while True:
+            msg = _UI_Q.get_nowait()
+            if msg[0] == "config":
+                pending.setdefault(msg[1], {}).update(msg[2])
+                continue
+            flush()
+            try:
+                if msg[0] == "call":
+                    msg[1](*msg[2])
+                elif msg[0] == "done":
+                    msg[1].set(True)
+            except Exception:
+                pass
+    except queue.Empty:
+        pass
+    flush()
+    root.after(UI_POLL_MS, _poll_ui_queue)
+
+def _executer_en_tache(fn, *args, **kwargs):
+    """
+    Exécute fn(*args, **kwargs) dans un thread de calcul et attend sa fin sans figer l’interface
+    (root.wait_variable fait tourner la boucle Tk). Renvoie le résultat ou relance l’exception du thread.
+    """
+    done = tk.BooleanVar(master=root, value=False)
+    box = {}
+    def work():
+        try:
+            box["res"] = fn(*args, **kwargs)
+        except BaseException as e:
+            box["err"] = e
+        finally:
+            _UI_Q.put(("done", done))
+    threading.Thread(target=work, daemon=True).start()
+    root.wait_variable(done)
+    if "err" in box:
+        raise box["err"]
+    return box.get("res")
+
 # --------- Résultats (nom avec %) ----------
 def _format_pct_for_name(seuil):
     if float(seuil).is_integer():
@@ -318,9 +390,32 @@ def open_resume_detection_csv():
     else:
         messagebox.showwarning("Fichier introuvable", "resume_detection.csv introuvable.\nLance d'abord la détection.")
 
+def open_overlay_viewer():
+    """Overlay DeepZoom (.dzi) dans la visionneuse tuilée intégrée ; ancien PNG pleine lame → programme externe."""
+    p = filedialog.askopenfilename(title="Overlay de détection", initialdir=DETECTED,
+                                   filetypes=[("Overlay DeepZoom", "*.dzi"), ("PNG (ancien format)", "*.png")])
+    if not p:
+        return
+    if not p.lower().endswith(".dzi"):
+        open_file(p)
+        return
+    try:
+        from viewer import ouvrir_visionneuse
+        ouvrir_visionneuse(root, p)
+    except Exception as e:
+        messagebox.showwarning("Visionneuse", f"Impossible d'ouvrir :\n{p}\n\n{e}")
+
 # =========================
 #  Etapes (imports paresseux)
 # =========================
+def _seuil_enregistre():
+    """Seuil d’analyse (%) du dernier params.json, ou None."""
+    try:
+        with open(os.path.join(DETECTED, "params.json"), "r", encoding="utf-8") as f:
+            return float(json.load(f).get("seuil_cd7_percent"))
+    except Exception:
+        return None
+
 def _ask_threshold(current=None):
     try:
         iv = None if current is None else float(current)
@@ -333,6 +428,86 @@ def _ask_threshold(current=None):
     )
     return val  # None si Annuler
 
+def _ask_seuil_dab():
+    """
+    Seuil DAB (densité optique) avec aperçu en direct : le curseur met à jour la surface positive estimée
+    (histogrammes DO du tissu, lame choisie + toutes lames) et la vignette colorée, sans relire les lames.
+    Les aperçus manquants sont d’abord calculés par la pré-passe rapide de cell_detection.
+    Valider → cell_detection.SEUIL_DAB ; retourne le seuil (None si Annuler).
+    """
+    import numpy as np
+    from PIL import Image, ImageTk
+    import cell_detection as cd
+
+    slides = sorted(f for f in os.listdir(cd.SLIDES_DIR) if f.lower().endswith(cd.ALLOWED_EXT)) \
+        if os.path.isdir(cd.SLIDES_DIR) else []
+    apercus = cd.charger_apercus_dab(slides)
+    if len(apercus) < len(slides):
+        spinner_on()
+        try:
+            _executer_en_tache(cd.preparer_apercus_dab, _WidgetRelay(progress_bar), _WidgetRelay(progress_pct),
+                               slides=slides)
+        finally:
+            spinner_off()
+        apercus = cd.charger_apercus_dab(slides)
+    if not apercus:
+        val = simpledialog.askfloat("Seuil DAB", "Seuil de densité optique DAB (aucun aperçu disponible) :",
+                                    parent=root, minvalue=0.0, initialvalue=cd.SEUIL_DAB)
+        if val is not None:
+            cd.SEUIL_DAB = float(val)
+        return val
+
+    names = list(apercus)
+    od_max = float(apercus[names[0]]["od_max"])
+    hists = np.stack([apercus[n]["hist"] for n in names]).astype(np.int64)
+    bins = hists.shape[1]
+    tissue = np.maximum(hists.sum(axis=1), 1)
+    pos_cum = hists[:, ::-1].cumsum(axis=1)[:, ::-1]      # pos_cum[:, i] = pixels tissu dans les bacs ≥ i
+
+    result = [None]
+    fen = Toplevel(root); fen.title("Seuil DAB — aperçu"); fen.configure(bg=COULEUR_FOND)
+    choix = tk.StringVar(value=names[0])
+    seuil = tk.DoubleVar(value=float(cd.SEUIL_DAB))
+    ttk.Combobox(fen, textvariable=choix, values=names, state="readonly", width=48).pack(padx=12, pady=(12, 6))
+    image_lbl = tk.Label(fen, bg=COULEUR_FOND)
+    image_lbl.pack(padx=12)
+    stats_lbl = tk.Label(fen, bg=COULEUR_FOND, fg=COULEUR_TEXTE, font=POLICE_BOUTON, justify="left")
+    stats_lbl.pack(padx=12, pady=6)
+
+    def refresh(*_):
+        s = float(seuil.get())
+        i = min(bins - 1, int(np.ceil(s * bins / od_max)))
+        frac = pos_cum[:, i] / tissue
+        k = names.index(choix.get())
+        stats_lbl.config(text=(f"Surface DAB+ estimée : {100 * frac[k]:.2f} % du tissu ({choix.get()})\n"
+                               f"Toutes lames : {100 * pos_cum[:, i].sum() / tissue.sum():.2f} %  "
+                               f"(min {100 * frac.min():.2f} %, max {100 * frac.max():.2f} %)"))
+        a = apercus[choix.get()]
+        pos = (a["od"].astype(np.float32) > s) & (a["tissue"] > 0)
+        rgb = (a["rgb"].astype(np.float32) * 0.45).astype(np.uint8)
+        rgb[pos] = (255, 120, 0)
+        photo = ImageTk.PhotoImage(Image.fromarray(rgb))
+        image_lbl.config(image=photo)
+        image_lbl.image = photo
+
+    tk.Scale(fen, from_=0.0, to=od_max, resolution=od_max / bins, orient="horizontal", length=420,
+             variable=seuil, command=refresh, label="Seuil DO DAB", bg=COULEUR_FOND, fg=COULEUR_TEXTE,
+             highlightthickness=0, troughcolor=COULEUR_BTN).pack(padx=12)
+    choix.trace_add("write", refresh)
+
+    def valider():
+        result[0] = float(seuil.get())
+        fen.destroy()
+
+    RoundedButton(fen, text="Valider", command=valider, width=220, height=40, radius=14,
+                  bg=COULEUR_ACCENT, hover_bg="#5bcf61", active_bg="#43a047").pack(pady=(6, 4))
+    RoundedButton(fen, text="Annuler", command=fen.destroy, width=220, height=40, radius=14).pack(pady=(0, 12))
+    refresh()
+    fen.grab_set(); root.wait_window(fen)
+    if result[0] is not None:
+        cd.SEUIL_DAB = result[0]
+    return result[0]
+
 def preprocessing_gui():
     from preprocessing import extract_files_from_zip, detect_markers
     zip_path = filedialog.askopenfilename(title="Sélectionnez un fichier ZIP", filetypes=[("Fichiers ZIP", "*.zip")])
@@ -358,8 +533,8 @@ def preprocessing_gui():
             _busy(True)
             spinner_on()
             try:
-                def update_progress(c, t): afficher_progression(c, t)
-                extract_files_from_zip(zip_path, selected, EXTRACTED, progress_callback=update_progress)
+                _executer_en_tache(extract_files_from_zip, zip_path, selected, EXTRACTED,
+                                   progress_callback=_relais_progression)
             finally:
                 spinner_off()
             set_step_ok("preprocessing", "Extraction des fichiers terminée")
@@ -408,7 +583,7 @@ def detect_slide_mask_gui():
 
         _busy(True)
         # ✅ passer les bons widgets (l’annotation gère la progression + label et met “terminée” elle-même)
-        lancer_annotation_gui(root, progress_bar, progress_pct, status_label)
+        lancer_annotation_gui(root, progress_bar, progress_pct, status_label, executer=_executer_en_tache)
         # (ne pas appeler set_step_ok pour éviter les doublons)
     except Exception as e:
         if "annotation_global" in labels_etapes:
@@ -421,6 +596,7 @@ def lancer_script(script_name):
     global RUNNING
     if RUNNING:
         return  # ignore pendant un traitement
+    _charger_optionnels()
     step_key = script_name.split(".")[0]
     reset_step_label(step_key)
 
@@ -446,7 +622,8 @@ def lancer_script(script_name):
             spinner_on()
             try:
                 # ✅ passer progress_pct
-                detecter_noyaux_dab(root, progress_bar, progress_pct)
+                _executer_en_tache(detecter_noyaux_dab, None,
+                                   _WidgetRelay(progress_bar), _WidgetRelay(progress_pct))
             finally:
                 spinner_off()
             set_step_ok("cell_detection", "Détection DAB terminée")
@@ -458,19 +635,12 @@ def lancer_script(script_name):
 
     elif script_name == "result.py":
         from result import analyser_resultats_cd7
-        params = os.path.join(DETECTED, "params.json")
-        seuil = None
-        if os.path.exists(params):
-            try:
-                seuil = float(json.load(open(params, "r", encoding="utf-8")).get("seuil_cd7_percent"))
-            except Exception:
-                pass
-        new_s = _ask_threshold(seuil)
+        new_s = _ask_threshold(_seuil_enregistre())
         if new_s is None:
             set_step_cancel("result", "Analyse annulée (seuil non défini)")
             return
         try:
-            with open(params, "w", encoding="utf-8") as f:
+            with open(os.path.join(DETECTED, "params.json"), "w", encoding="utf-8") as f:
                 json.dump({"seuil_cd7_percent": float(new_s)}, f, ensure_ascii=False, indent=2)
         except Exception:
             pass
@@ -490,6 +660,97 @@ def lancer_script(script_name):
         finally:
             _busy(False)
 
+def regler_seuil_dab():
+    """Action dédiée : aperçu DO + réglage de SEUIL_DAB, repris par les détections suivantes de la session."""
+    if RUNNING:
+        return
+    _charger_optionnels()
+    reset_step_label("cell_detection")
+    try:
+        _busy(True)
+        val = _ask_seuil_dab()
+    except Exception as e:
+        messagebox.showerror("Seuil DAB", str(e))
+        return
+    finally:
+        _busy(False)
+    if val is None:
+        set_step_cancel("cell_detection", "Seuil DAB inchangé")
+    else:
+        set_step_ok("cell_detection", f"Seuil DAB = {float(val):g} (prochaines détections)")
+
+def lancer_triage():
+    """
+    Triage rapide : k tuiles tissu par lame (triage_detection.csv, estimations + IC95), puis analyse triage
+    → patients dont le statut n’est pas tranché (A_confirmer) à relancer en détection complète.
+    """
+    global RUNNING
+    if RUNNING:
+        return
+    _charger_optionnels()
+    from cell_detection import triage_noyaux_dab
+    from result import analyser_resultats_cd7
+    reset_step_label("cell_detection")
+    s = _ask_threshold(_seuil_enregistre())
+    if s is None:
+        set_step_cancel("cell_detection", "Triage annulé (seuil non défini)")
+        return
+    try:
+        _busy(True)
+        spinner_on()
+        try:
+            _executer_en_tache(triage_noyaux_dab, None, _WidgetRelay(progress_bar), _WidgetRelay(progress_pct))
+            written = analyser_resultats_cd7(root, progress_bar, progress_pct, seuil_ratio_cd7=float(s), triage=True)
+        finally:
+            spinner_off()
+        set_step_ok("cell_detection", "Triage terminé" + (f" → {os.path.basename(written)}" if written else ""))
+    except Exception as e:
+        labels_etapes["cell_detection"].config(text="❌ Erreur triage", fg="red")
+        messagebox.showerror("Erreur triage", str(e))
+    finally:
+        _busy(False)
+
+def lancer_balayage():
+    """Balayage de SEUIL_DAB (une déconvolution par lame) → detected/balayage_seuils.csv, une ligne par lame × seuil."""
+    global RUNNING
+    if RUNNING:
+        return
+    _charger_optionnels()
+    import cell_detection as cd
+    reset_step_label("cell_detection")
+    txt = simpledialog.askstring("Balayage SEUIL_DAB", "Seuils DAB à comparer (séparés par des virgules) :",
+                                 parent=root, initialvalue=", ".join(f"{v:g}" for v in cd.SWEEP_SEUILS))
+    if txt is None:
+        set_step_cancel("cell_detection", "Balayage annulé")
+        return
+    try:
+        seuils = [float(v) for v in txt.replace(";", ",").split(",") if v.strip()]
+    except ValueError:
+        seuils = []
+    if not seuils:
+        messagebox.showwarning("Balayage", "Seuils DAB invalides (nombres séparés par des virgules).")
+        set_step_cancel("cell_detection", "Balayage annulé (seuils invalides)")
+        return
+    try:
+        if os.path.exists(cd.SWEEP_CSV):
+            os.remove(cd.SWEEP_CSV)          # pas d’ancien balayage pris pour un succès
+        _busy(True)
+        spinner_on()
+        try:
+            _executer_en_tache(cd.balayer_seuils_dab, seuils, None, _WidgetRelay(progress_bar), _WidgetRelay(progress_pct))
+        finally:
+            spinner_off()
+        if os.path.exists(cd.SWEEP_CSV):
+            set_step_ok("cell_detection", f"Balayage terminé → {os.path.basename(cd.SWEEP_CSV)}")
+            open_file(cd.SWEEP_CSV)
+        else:
+            labels_etapes["cell_detection"].config(text="❌ Balayage non écrit (voir la console)", fg="red")
+    except Exception as e:
+        labels_etapes["cell_detection"].config(text="❌ Erreur balayage", fg="red")
+        messagebox.showerror("Erreur balayage", str(e))
+    finally:
+        _busy(False)
+
 # =========================
 #  Pipeline “tout”
 # =========================
@@ -502,6 +763,7 @@ def lancer_tout_pipeline():
     global RUNNING
     if RUNNING:
         return
+    _charger_optionnels()
     _busy(True)
     try:
         for k in labels_etapes:
@@ -550,8 +812,8 @@ def lancer_tout_pipeline():
         try:
             spinner_on()
             try:
-                def update_progress(c, t): afficher_progression(c, t)
-                extract_files_from_zip(zip_path, selected, EXTRACTED, progress_callback=update_progress)
+                _executer_en_tache(extract_files_from_zip, zip_path, selected, EXTRACTED,
+                                   progress_callback=_relais_progression)
             finally:
                 spinner_off()
             set_step_ok("preprocessing", "Extraction des fichiers terminée")
@@ -569,7 +831,8 @@ def lancer_tout_pipeline():
         progress_pct.config(text="0%")
         root.update_idletasks()
 
-        lancer_annotation_gui(root, progress_bar, progress_pct, labels_etapes["annotation_global"])
+        lancer_annotation_gui(root, progress_bar, progress_pct, labels_etapes["annotation_global"],
+                              executer=_executer_en_tache)
         # (ne pas appeler set_step_ok ici, c'est déjà fait par l’annotation via le label)
 
         # 3) Détection
@@ -586,7 +849,8 @@ def lancer_tout_pipeline():
             spinner_on()
             try:
                 # ✅ passer progress_pct
-                detecter_noyaux_dab(root, progress_bar, progress_pct)
+                _executer_en_tache(detecter_noyaux_dab, None,
+                                   _WidgetRelay(progress_bar), _WidgetRelay(progress_pct))
             finally:
                 spinner_off()
             set_step_ok("cell_detection", "Détection DAB terminée")
@@ -731,8 +995,8 @@ descriptions = {
         "à partir duquel la détection s’exécute."
     ),
     "cell_detection": (
-        "Détecte les noyaux DAB dans les zones annotées, produit des PNG annotés "
-        "et un résumé CSV des comptages."
+        "Détecte les noyaux DAB dans les zones annotées, produit des overlays annotés "
+        "(pyramide DeepZoom .dzi, ouvrable à tout zoom) et un résumé CSV des comptages."
     ),
     "result": (
         "Agrège par patient et calcule la proportion PERTE/RÉFÉRENCE (%) (ex. CD7 vs CD3). "
@@ -808,6 +1072,20 @@ for label_text, script_file in scripts.items():
     elif step_key == "cell_detection":
         add_half(0, 0, "📂 Ouvrir ‘detected’", lambda: open_folder(DETECTED))
         add_half(0, 1, "📄 Ouvrir resume_detection.csv", open_resume_detection_csv)
+        RoundedButton(actions, text="🔍 Visualiser un overlay (zoom tuilé)",
+                      command=open_overlay_viewer,
+                      width=CARD_W, height=36, radius=14,
+                      bg=COULEUR_BTN_S, hover_bg="#6b6b6b", active_bg="#7a7a7a").grid(
+            row=1, column=0, columnspan=2, sticky="ew", padx=5, pady=5
+        )
+        add_half(2, 0, "⚡ Triage rapide (IC95)", lancer_triage)
+        add_half(2, 1, "📊 Balayage seuils DAB", lancer_balayage)
+        RoundedButton(actions, text="🎚 Régler le seuil DAB (aperçu)",
+                      command=regler_seuil_dab,
+                      width=CARD_W, height=36, radius=14,
+                      bg=COULEUR_BTN_S, hover_bg="#6b6b6b", active_bg="#7a7a7a").grid(
+            row=3, column=0, columnspan=2, sticky="ew", padx=5, pady=5
+        )
 
     elif step_key == "result":
         add_half(0, 0, "📂 Ouvrir ‘results’", lambda: open_folder(RESULTS))
@@ -826,4 +1104,11 @@ RoundedButton(content, text="Quitter", command=safe_quit,
               width=int(CARD_W/2), height=40, radius=16,
               bg="#9b3b3b", hover_bg="#b14a4a", active_bg="#c62828").pack(pady=(0, 22), anchor="center")
 
-root.mainloop()
+root.after(UI_POLL_MS, _poll_ui_queue)
+if os.environ.get("TOOLBOX_STARTUP_PROBE"):
+    # startup_profile.py : fenêtre affichée → temps écoulé, puis fermeture
+    root.update()
+    print(f"STARTUP_READY {time.perf_counter() - _T_START:.3f}", flush=True)
+    root.destroy()
+else:
+    root.mainloop()
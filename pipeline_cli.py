@@ -0,0 +1,632 @@
+# pipeline_cli.py — pipeline complet sans interface (extraction → annotation → détection → analyse)
+#
+#   python pipeline_cli.py config.json
+#   python pipeline_cli.py --zip S000001_CD7.zip --seuil 10 --output /scratch/run1
+#   python pipeline_cli.py --batch /data/zips_du_jour      → extraction/annotation/détection en flux
+#   python pipeline_cli.py config.json --triage             → triage rapide (échantillon de tuiles) + analyse triage
+#   python pipeline_cli.py config.json --balayage 0.01,0.02  → + balayage SEUIL_DAB (balayage_seuils.csv)
+#
+# Mêmes défauts que mainGUI.lancer_tout_pipeline : tous les marqueurs détectés dans le ZIP, annotation
+# appliquée à toutes les lames, dossiers output/{extracted_lames, annotated, detected, results}.
+# Aucune fenêtre Tk n’est créée. Codes de sortie ci-dessous ; manifeste JSON écrit dans le dossier de sortie.
+import os, sys, json, time, glob, queue, hashlib, argparse, platform, threading, traceback
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Codes de sortie (lisibles par un ordonnanceur)
+EXIT_OK      = 0   # toutes les étapes terminées
+EXIT_ERREUR  = 1   # exception inattendue
+EXIT_CONFIG  = 2   # configuration invalide
+EXIT_ENTREE  = 3   # entrée inexploitable : ZIP illisible, aucun marqueur, aucune lame
+EXIT_ETAPE   = 4   # une étape a échoué (sorties incomplètes)
+EXIT_PARTIEL = 5   # pipeline terminé mais certaines lames n’ont pas été comptées
+
+STEPS = ("preprocessing", "annotation_global", "cell_detection", "result")
+BATCH_STEPS = STEPS[:3]          # fusionnées en une étape "batch" en mode dossier
+BATCH_QUEUE_SLIDES = 2           # lames en attente max entre deux étapes du mode batch
+STATE_FILE = "etat_pipeline.json"   # registre des artefacts (dans output_dir)
+
+# Réglages de cell_detection dont dépendent les sorties d’une lame, en plus des comptes
+# (cell_detection.COUNT_PARAMS) → empreinte de l’étape détection
+OUTPUT_PARAMS = ("EXPORT_CELLS", "OVERLAY_FORMAT")
+SLIDE_EXT = (".tif", ".tiff", ".ndpi", ".svs", ".dcm")   # comme lancer_annotation_gui
+
+DEFAULTS = {
+    "zips": [],                      # un ou plusieurs ZIP <PatientID>_<Antigene>.zip
+    "batch_dir": None,               # dossier de ZIP → mode batch (étapes qui se chevauchent)
+    "markers": None,                 # None = tous les marqueurs détectés (cases cochées par défaut)
+    "output_dir": os.path.join(BASE_DIR, "output"),
+    "extracted_dir": None,           # défauts : <output_dir>/extracted_lames, annotated, detected, results
+    "annotated_dir": None,
+    "detected_dir": None,
+    "results_dir": None,
+    "seuil_percent": 10.0,
+    "tolerance_percent": 2.0,
+    "loss_marker": "CD7",
+    "reference_marker": "CD3",
+    "min_area": 20_000,
+    "area_ratio_thresh": 0.4,
+    "count_only": False,
+    "threads": 0,                    # cv2.setNumThreads : 0 = tous les cœurs
+    "isolation": True,               # une lame = un process surveillé (délai / mémoire durs, relance dégradée)
+    "incremental": True,             # ne recalcule que les artefacts périmés (False = tout refaire)
+    "store": False,                  # analyse sur l’historique SQLite (toutes les lames de tous les runs)
+    "grid": False,                   # + grille seuil × tolérance (bascules de statut) dans results_dir
+    "triage": False,                 # détection par échantillonnage (triage_detection.csv, IC95) + analyse triage
+    "sweep": None,                   # seuils DAB à balayer après la détection (liste ; True = SWEEP_SEUILS)
+    "steps": list(STEPS),
+}
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def load_config(path=None, overrides=None):
+    """Défauts ← fichier JSON ← options de la ligne de commande ; chemins résolus et vérifiés."""
+    cfg = dict(DEFAULTS)
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            raise ConfigError(f"Config illisible : {path} ({e})")
+        unknown = set(data) - set(DEFAULTS) - {"zip"}
+        if unknown:
+            raise ConfigError(f"Clés inconnues dans {path} : {sorted(unknown)}")
+        cfg.update(data)
+    for k, v in (overrides or {}).items():
+        if v is not None:
+            cfg[k] = v
+
+    if "zip" in cfg:
+        cfg["zips"] = list(cfg["zips"] or []) + [cfg.pop("zip")]
+    if isinstance(cfg["zips"], str):
+        cfg["zips"] = [cfg["zips"]]
+    if isinstance(cfg["markers"], str):
+        cfg["markers"] = [m.strip() for m in cfg["markers"].split(",") if m.strip()]
+    bad = [s for s in cfg["steps"] if s not in STEPS]
+    if bad:
+        raise ConfigError(f"Étapes inconnues : {bad} (attendu : {list(STEPS)})")
+    if cfg["sweep"] not in (None, False, True):
+        try:
+            vals = cfg["sweep"].split(",") if isinstance(cfg["sweep"], str) else list(cfg["sweep"])
+            cfg["sweep"] = [float(v) for v in vals if str(v).strip()]
+        except (TypeError, ValueError):
+            raise ConfigError("sweep / --balayage : seuils DAB numériques séparés par des virgules.")
+        if not cfg["sweep"]:
+            raise ConfigError("sweep / --balayage : aucun seuil DAB.")
+    if cfg["triage"] and cfg["batch_dir"]:
+        raise ConfigError("Le triage ne se combine pas avec --batch (détection complète en flux).")
+    if cfg["batch_dir"]:
+        if not os.path.isdir(cfg["batch_dir"]):
+            raise ConfigError(f"Dossier batch introuvable : {cfg['batch_dir']}")
+        cfg["batch_dir"] = os.path.abspath(cfg["batch_dir"])
+        cfg["zips"] = list(cfg["zips"]) + sorted(glob.glob(os.path.join(cfg["batch_dir"], "*.zip")))
+    elif "preprocessing" in cfg["steps"] and not cfg["zips"]:
+        raise ConfigError("Aucun ZIP fourni pour l’extraction (clé 'zips' ou --zip).")
+    try:
+        cfg["seuil_percent"] = float(cfg["seuil_percent"])
+        cfg["tolerance_percent"] = float(cfg["tolerance_percent"])
+    except (TypeError, ValueError):
+        raise ConfigError("seuil_percent / tolerance_percent doivent être numériques.")
+    if not 0.0 <= cfg["seuil_percent"] <= 100.0:
+        raise ConfigError("seuil_percent doit être entre 0 et 100 (comme dans l’interface).")
+
+    out = os.path.abspath(cfg["output_dir"])
+    cfg["output_dir"] = out
+    for key, sub in (("extracted_dir", "extracted_lames"), ("annotated_dir", "annotated"),
+                     ("detected_dir", "detected"), ("results_dir", "results")):
+        cfg[key] = os.path.abspath(cfg[key] or os.path.join(out, sub))
+    cfg["zips"] = [os.path.abspath(z) for z in cfg["zips"]]
+    return cfg
+
+
+# ---------- Artefacts ----------
+def _empreinte(path, contenu=False):
+    """
+    Empreinte d’un fichier d’entrée : (taille, date) pour les lames — les relire en entier coûterait plus que
+    l’étape — ou SHA-1 du contenu pour les petits fichiers réécrits à l’identique (JSON, CSV). None si absent.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    if contenu:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _hash(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _EtatPipeline:
+    """
+    Registre des artefacts (output_dir/etat_pipeline.json) : pour chaque (étape, clé), l’empreinte des
+    entrées + paramètres qui l’ont produit et ses fichiers de sortie. Un artefact est à jour si l’empreinte
+    est identique et que ses sorties existent encore ; sinon l’étape le recalcule (et les étapes suivantes
+    le voient changer via leurs propres empreintes).
+    """
+    def __init__(self, cfg):
+        self.path = os.path.join(cfg["output_dir"], STATE_FILE)
+        self.actif = bool(cfg["incremental"])
+        self._lock = threading.Lock()     # mode batch : étapes notées depuis plusieurs threads
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except Exception:
+            self.data = {}
+
+    def get(self, etape, cle):
+        return self.data.get(etape, {}).get(cle)
+
+    def frais(self, etape, cle, empreinte):
+        e = self.get(etape, cle)
+        return (self.actif and e is not None and e["empreinte"] == empreinte
+                and all(os.path.exists(p) for p in e.get("sorties", [])))
+
+    def noter(self, etape, cle, empreinte, sorties=(), **extra):
+        with self._lock:
+            self.data.setdefault(etape, {})[cle] = {"empreinte": empreinte, "sorties": list(sorties), **extra}
+            self.save()      # à chaque artefact : un run interrompu garde ce qui est fait
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+# Empreintes des artefacts, communes aux étapes séparées et au mode batch
+def _cle_extraction(cfg, zp, markers):
+    return _hash(_empreinte(zp), sorted(markers), cfg["extracted_dir"])
+
+def _params_annotation(cfg, ag):
+    return [cfg["min_area"], cfg["area_ratio_thresh"], ag.PREVIEW_MAX_PIX, ag.THUMB_MAX_DIM]
+
+def _params_detection(cfg, cd):
+    return [{k: getattr(cd, k, None) for k in cd.COUNT_PARAMS + OUTPUT_PARAMS}, bool(cfg["count_only"])]
+
+def _cle_detection(cfg, f, params):
+    js = os.path.join(cfg["annotated_dir"], os.path.splitext(f)[0] + "_annotation.json")
+    return _hash(_empreinte(os.path.join(cfg["extracted_dir"], f)), _empreinte(js, contenu=True), params)
+
+
+# ---------- Étapes ----------
+def step_preprocessing(cfg):
+    from preprocessing import extract_files_from_zip, detect_markers
+    import zipfile
+    etat = _EtatPipeline(cfg)
+    details = {"zips": [], "up_to_date": []}
+    for zp in cfg["zips"]:
+        if not zipfile.is_zipfile(zp):
+            return EXIT_ENTREE, {**details, "error": f"ZIP invalide : {zp}"}
+        markers = detect_markers(zp)
+        if cfg["markers"]:
+            wanted = {m.upper() for m in cfg["markers"]}
+            markers = [m for m in markers if m.upper() in wanted]
+        if not markers:
+            return EXIT_ENTREE, {**details, "error": f"Aucun marqueur retenu dans {zp}"}
+        key = _cle_extraction(cfg, zp, markers)
+        if etat.frais("preprocessing", zp, key):
+            print(f"✔ À jour : {os.path.basename(zp)}")
+            details["up_to_date"].append(zp)
+            continue
+        out = extract_files_from_zip(zp, markers, cfg["extracted_dir"])
+        etat.noter("preprocessing", zp, key, out)
+        details["zips"].append({"zip": zp, "markers": markers})
+    return EXIT_OK, details
+
+
+def _slides(folder, ext=SLIDE_EXT):
+    if not os.path.isdir(folder):
+        return []
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith(ext))
+
+
+def step_annotation(cfg):
+    import annotation_global as ag
+    slides = _slides(cfg["extracted_dir"])
+    if not slides:
+        return EXIT_ENTREE, {"error": f"Aucune lame dans {cfg['extracted_dir']}"}
+    os.makedirs(cfg["annotated_dir"], exist_ok=True)
+    etat = _EtatPipeline(cfg)
+    params = _params_annotation(cfg, ag)
+    done, fresh, failed = [], [], []
+    for i, f in enumerate(slides, 1):
+        path = os.path.join(cfg["extracted_dir"], f)
+        out_js = os.path.join(cfg["annotated_dir"], os.path.splitext(f)[0] + "_annotation.json")
+        key = _hash(_empreinte(path), params)
+        if etat.frais("annotation_global", f, key):
+            fresh.append(f)
+            continue
+        try:
+            nb, _, _, _ = ag.detect_slide_mask(path, out_js,
+                                               min_area=cfg["min_area"], area_ratio_thresh=cfg["area_ratio_thresh"])
+            print(f"📁 {i}/{len(slides)}  •  {os.path.basename(out_js)}  •  contours = {nb}")
+            etat.noter("annotation_global", f, key, [out_js])
+            done.append(f)
+        except Exception as e:
+            print(f"⚠ Impossible de traiter {f} : {e}")
+            failed.append({"file": f, "error": str(e)})
+    if fresh:
+        print(f"✔ {len(fresh)} annotation(s) déjà à jour")
+    details = {"slides": len(slides), "annotated": len(done), "up_to_date": len(fresh), "failed": failed}
+    return (EXIT_OK if done or fresh else EXIT_ETAPE), details
+
+
+def step_detection(cfg):
+    import cell_detection as cd
+    cd.configurer_dossiers(cfg["extracted_dir"], cfg["annotated_dir"], cfg["detected_dir"])
+    os.makedirs(cfg["detected_dir"], exist_ok=True)
+    slides = _slides(cfg["extracted_dir"], cd.ALLOWED_EXT)
+    if not slides:
+        return EXIT_ENTREE, {"error": f"Aucune lame dans {cfg['extracted_dir']}"}
+    if cfg["triage"]:
+        return _step_triage(cfg, cd, slides)
+
+    _prepare_detection(cfg, cd)
+    etat = _EtatPipeline(cfg)
+    params = _params_detection(cfg, cd)
+    keys = {f: _cle_detection(cfg, f, params) for f in slides}
+    stale = [f for f in slides if not etat.frais("cell_detection", f, keys[f])]
+    print(f"🔁 {len(stale)}/{len(slides)} lame(s) à recompter ({len(slides) - len(stale)} à jour)")
+
+    if stale:
+        cd.detecter_noyaux_dab(count_only=bool(cfg["count_only"]), slides=stale)
+    _fusionner_detection(cfg, cd, etat, slides, keys)
+    return _detection_outcome(cd, slides)
+
+
+def _fusionner_detection(cfg, cd, etat, slides, keys):
+    """
+    Lignes du run (resume_detection.csv) notées dans le registre avec leurs sorties, puis CSV complet
+    réécrit : lignes recalculées + lignes à jour du registre.
+    """
+    new_rows = {}
+    for row in _read_rows(cd.CSV_OUTPUT):
+        f = row.get("Fichier")
+        new_rows[f] = row
+        if f in keys and row.get("Statut") != "échec":
+            etat.noter("cell_detection", f, keys[f], _sorties_detection(cfg, cd, f, row), row=row)
+    rows = [new_rows[f] if f in new_rows else etat.get("cell_detection", f)["row"]
+            for f in slides if f in new_rows or etat.frais("cell_detection", f, keys[f])]
+    if rows:
+        import pandas as pd
+        pd.DataFrame(rows).to_csv(cd.CSV_OUTPUT, sep=";", index=False)
+
+
+def _sorties_detection(cfg, cd, f, row):
+    """
+    Fichiers écrits pour une lame : overlay (<lame>_detected_masked.dzi + _files/, ou .png) sauf en comptage
+    seul, et <lame>_cells.npz si EXPORT_CELLS. Un profil mémoire dégradé compte sans overlay ni export.
+    """
+    stem = os.path.join(cfg["detected_dir"], os.path.splitext(f)[0])
+    if row.get("Profil_mémoire", "normal") != "normal":
+        return []
+    out = []
+    if not cfg["count_only"]:
+        base = stem + "_detected_masked"
+        out += [base + ".dzi", base + "_files"] if cd.OVERLAY_FORMAT == "dzi" else [base + ".png"]
+    if cd.EXPORT_CELLS:
+        out.append(stem + "_cells.npz")
+    return out
+
+
+def _step_triage(cfg, cd, slides):
+    """
+    Triage : k tuiles tissu par lame (quelques secondes) → triage_detection.csv avec IC95, lu par l’analyse
+    triage pour repérer les patients à relancer en détection complète. Toujours recalculé (pas de registre).
+    """
+    _prepare_detection(cfg, cd, cd.TRIAGE_CSV)
+    cd.triage_noyaux_dab()
+    return _detection_outcome(cd, slides, cd.TRIAGE_CSV)
+
+
+def _read_rows(csv_path):
+    """Lignes d’un CSV ; en objets JSON purs (NaN → None) pour le registre."""
+    import pandas as pd
+    if not os.path.exists(csv_path):
+        return []
+    try:
+        return json.loads(pd.read_csv(csv_path, sep=";").to_json(orient="records", force_ascii=False))
+    except pd.errors.EmptyDataError:
+        return []
+
+
+def _prepare_detection(cfg, cd, csv_path=None):
+    """params.json comme l’interface (lu par l’analyse) ; ancien CSV supprimé (pas de faux succès)."""
+    csv_path = csv_path or cd.CSV_OUTPUT
+    cd.ISOLATE_SLIDES = bool(cfg["isolation"])
+    with open(os.path.join(cfg["detected_dir"], "params.json"), "w", encoding="utf-8") as f:
+        json.dump({"loss_marker": cfg["loss_marker"], "reference_marker": cfg["reference_marker"],
+                   "seuil_percent": cfg["seuil_percent"]}, f, ensure_ascii=False, indent=2)
+    if os.path.exists(csv_path):
+        os.remove(csv_path)
+
+
+def _detection_outcome(cd, slides, csv_path=None):
+    """Compare resume_detection.csv (ou csv_path : triage) aux lames attendues → (code, détails)."""
+    import pandas as pd
+    csv_path = csv_path or cd.CSV_OUTPUT
+    if not os.path.exists(csv_path):
+        return EXIT_ETAPE, {"error": f"{os.path.basename(csv_path)} non écrit"}
+    try:
+        df = pd.read_csv(csv_path, sep=";")
+        if "Statut" in df.columns:
+            df = df[df["Statut"] != "échec"]          # tuées deux fois par le watchdog
+        done = set(df["Fichier"].astype(str)) if "Fichier" in df.columns else set()
+    except pd.errors.EmptyDataError:
+        done = set()
+    missing = [f for f in slides if f not in done]
+    details = {"slides": len(slides), "counted": len(slides) - len(missing), "missing": missing,
+               "csv": csv_path}
+    if not done:
+        return EXIT_ETAPE, details
+    return (EXIT_PARTIEL if missing else EXIT_OK), details
+
+
+def step_sweep(cfg):
+    """
+    Balayage de SEUIL_DAB : une lecture + déconvolution par lame, puis comptage à chaque seuil →
+    balayage_seuils.csv (une ligne par lame × seuil, colonnes de resume_detection.csv). Toujours recalculé.
+    """
+    import cell_detection as cd
+    cd.configurer_dossiers(cfg["extracted_dir"], cfg["annotated_dir"], cfg["detected_dir"])
+    os.makedirs(cfg["detected_dir"], exist_ok=True)
+    slides = _slides(cfg["extracted_dir"], cd.ALLOWED_EXT)
+    if not slides:
+        return EXIT_ENTREE, {"error": f"Aucune lame dans {cfg['extracted_dir']}"}
+    seuils = cd.SWEEP_SEUILS if cfg["sweep"] is True else cfg["sweep"]
+    if os.path.exists(cd.SWEEP_CSV):
+        os.remove(cd.SWEEP_CSV)
+    cd.balayer_seuils_dab(seuils=seuils)
+    if not os.path.exists(cd.SWEEP_CSV):
+        return EXIT_ETAPE, {"error": "balayage_seuils.csv non écrit"}
+    return EXIT_OK, {"csv": cd.SWEEP_CSV, "seuils": [float(v) for v in seuils]}
+
+
+def step_batch(cfg):
+    """
+    Mode dossier : extraction → annotation → détection en flux. Chaque lame passe à l’étape suivante dès
+    qu’elle est écrite (extraction membre par membre) ; files bornées (BATCH_QUEUE_SLIDES) entre les étapes,
+    donc la durée totale tend vers celle de l’étape la plus lente. La détection garde son propre pipeline
+    lecture/calcul/écriture. Mêmes empreintes que les étapes séparées (etat_pipeline.json) : un artefact à
+    jour n’est pas recalculé, et l’analyse qui suit réutilise les comptes.
+    """
+    from preprocessing import extract_files_from_zip, detect_markers
+    import annotation_global as ag
+    import cell_detection as cd
+    if not cfg["zips"]:
+        return EXIT_ENTREE, {"error": f"Aucun ZIP dans {cfg['batch_dir']}"}
+    cd.configurer_dossiers(cfg["extracted_dir"], cfg["annotated_dir"], cfg["detected_dir"])
+    for d in (cfg["extracted_dir"], cfg["annotated_dir"], cfg["detected_dir"]):
+        os.makedirs(d, exist_ok=True)
+    _prepare_detection(cfg, cd)
+
+    etat = _EtatPipeline(cfg)
+    p_annot, p_detect = _params_annotation(cfg, ag), _params_detection(cfg, cd)
+    wanted = {m.upper() for m in cfg["markers"]} if cfg["markers"] else None
+    q_annot  = queue.Queue(maxsize=BATCH_QUEUE_SLIDES)
+    q_detect = queue.Queue(maxsize=BATCH_QUEUE_SLIDES)
+    log = {"zips": [], "extract_failed": [], "annotation_failed": [], "up_to_date": []}
+    expected = []     # lames remises à la détection ou déjà comptées (dans l’ordre d’arrivée)
+    keys = {}         # empreinte détection par lame
+
+    def to_annot(path):
+        if path.lower().endswith(cd.ALLOWED_EXT):     # .dcm : non détecté (comme detecter_noyaux_dab)
+            q_annot.put(path)
+
+    def extract_stage():
+        try:
+            for zp in cfg["zips"]:
+                try:
+                    markers = [m for m in detect_markers(zp) if wanted is None or m.upper() in wanted]
+                    if not markers:
+                        log["extract_failed"].append({"zip": zp, "error": "aucun marqueur retenu"})
+                        continue
+                    key = _cle_extraction(cfg, zp, markers)
+                    if etat.frais("preprocessing", zp, key):
+                        out = etat.get("preprocessing", zp)["sorties"]
+                        log["up_to_date"].append(os.path.basename(zp))
+                        for path in out:
+                            to_annot(path)
+                    else:
+                        out = extract_files_from_zip(zp, markers, cfg["extracted_dir"], on_file=to_annot)
+                        etat.noter("preprocessing", zp, key, out)
+                    log["zips"].append({"zip": zp, "markers": markers,
+                                        "slides": [os.path.basename(p) for p in out]})
+                except Exception as e:
+                    log["extract_failed"].append({"zip": zp, "error": str(e)})
+        finally:
+            q_annot.put(None)
+
+    def annotate_stage():
+        try:
+            while (path := q_annot.get()) is not None:
+                f = os.path.basename(path)
+                out_js = os.path.join(cfg["annotated_dir"], os.path.splitext(f)[0] + "_annotation.json")
+                key = _hash(_empreinte(path), p_annot)
+                if not etat.frais("annotation_global", f, key):
+                    try:
+                        ag.detect_slide_mask(path, out_js, min_area=cfg["min_area"],
+                                             area_ratio_thresh=cfg["area_ratio_thresh"])
+                    except Exception as e:
+                        print(f"⚠ Impossible d’annoter {f} : {e}")
+                        log["annotation_failed"].append({"file": f, "error": str(e)})
+                        continue
+                    etat.noter("annotation_global", f, key, [out_js])
+                expected.append(f)
+                keys[f] = _cle_detection(cfg, f, p_detect)
+                if etat.frais("cell_detection", f, keys[f]):
+                    print(f"✔ Détection à jour : {f}")
+                else:
+                    q_detect.put(f)
+        finally:
+            q_detect.put(None)
+
+    def ready_slides():
+        while (f := q_detect.get()) is not None:
+            yield f
+
+    stages = [threading.Thread(target=extract_stage, daemon=True),
+              threading.Thread(target=annotate_stage, daemon=True)]
+    for t in stages:
+        t.start()
+    cd.detecter_noyaux_dab(count_only=bool(cfg["count_only"]), slides=ready_slides())
+    for t in stages:
+        t.join()
+
+    if not expected:
+        return EXIT_ENTREE, {**log, "error": "aucune lame extraite et annotée"}
+    _fusionner_detection(cfg, cd, etat, expected, keys)
+    rc, details = _detection_outcome(cd, expected)
+    if rc == EXIT_OK and (log["extract_failed"] or log["annotation_failed"]):
+        rc = EXIT_PARTIEL
+    return rc, {**log, **details}
+
+
+def step_result(cfg):
+    from result import analyser_resultats_cd7, balayer_seuils_analyse
+    etat = _EtatPipeline(cfg)
+    from results_store import DB_NAME
+    triage = bool(cfg["triage"])
+    csv_in = "triage_detection.csv" if triage else "resume_detection.csv"
+    source = (_empreinte(os.path.join(cfg["detected_dir"], DB_NAME)) if cfg["store"] else
+              _empreinte(os.path.join(cfg["detected_dir"], csv_in), contenu=True))
+    key = _hash(source,
+                _empreinte(os.path.join(cfg["detected_dir"], "params.json"), contenu=True),
+                cfg["seuil_percent"], cfg["tolerance_percent"], cfg["loss_marker"], cfg["reference_marker"],
+                bool(cfg["grid"]))
+    cle = "analyse_triage" if triage else "analyse"
+    if etat.frais("result", cle, key):
+        written = etat.get("result", cle)["sorties"][0]
+        print(f"✔ Analyse à jour : {written}")
+        return EXIT_OK, {"csv": written, "up_to_date": True}
+    written = analyser_resultats_cd7(seuil_ratio_cd7=cfg["seuil_percent"],
+                                     loss_marker=cfg["loss_marker"], reference_marker=cfg["reference_marker"],
+                                     tolerance_percent=cfg["tolerance_percent"],
+                                     triage=triage, detected_dir=cfg["detected_dir"],
+                                     results_dir=cfg["results_dir"], store=bool(cfg["store"]))
+    if not written:
+        return EXIT_ETAPE, {"error": "analyse non écrite (voir la sortie console)"}
+    outputs = [written]
+    if cfg["grid"]:
+        grid = balayer_seuils_analyse(loss_marker=cfg["loss_marker"], reference_marker=cfg["reference_marker"],
+                                      seuil_ref=cfg["seuil_percent"], tolerance_ref=cfg["tolerance_percent"],
+                                      triage=triage, detected_dir=cfg["detected_dir"],
+                                      results_dir=cfg["results_dir"], store=bool(cfg["store"]))
+        if grid:
+            outputs.append(grid)
+    etat.noter("result", cle, key, outputs)
+    return EXIT_OK, {"csv": written, "grid": outputs[1] if len(outputs) > 1 else None}
+
+
+STEP_FUNCS = {"preprocessing": step_preprocessing, "annotation_global": step_annotation,
+              "cell_detection": step_detection, "result": step_result, "batch": step_batch,
+              "balayage": step_sweep}
+
+
+# ---------- Exécution ----------
+def run(cfg):
+    """Enchaîne les étapes demandées ; retourne (code de sortie, manifeste)."""
+    manifest = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(), "python": platform.python_version(), "platform": platform.platform(),
+        "config": cfg, "steps": [], "exit_code": None,
+    }
+    code = EXIT_OK
+    t_run = time.time()
+    try:
+        if cfg["threads"]:
+            import cv2
+            cv2.setNumThreads(int(cfg["threads"]))
+        order = STEPS
+        if cfg["batch_dir"]:
+            order = ("batch",) + tuple(s for s in STEPS if s not in BATCH_STEPS)
+        if cfg["sweep"]:                  # juste après la détection (masques JSON disponibles)
+            i = order.index("batch" if cfg["batch_dir"] else "cell_detection") + 1
+            order = order[:i] + ("balayage",) + order[i:]
+        for step in order:
+            if step not in ("batch", "balayage") and step not in cfg["steps"]:
+                continue
+            print(f"\n===== {step} =====")
+            t0 = time.time()
+            try:
+                rc, details = STEP_FUNCS[step](cfg)
+            except Exception as e:
+                traceback.print_exc()
+                rc, details = EXIT_ETAPE, {"error": f"{type(e).__name__}: {e}"}
+            manifest["steps"].append({"step": step, "exit_code": rc,
+                                      "duration_s": round(time.time() - t0, 2), **details})
+            if rc == EXIT_PARTIEL:
+                code = EXIT_PARTIEL       # on continue : l’analyse porte sur les lames comptées
+            elif rc != EXIT_OK:
+                code = rc
+                break
+    except Exception as e:
+        traceback.print_exc()
+        code = EXIT_ERREUR
+        manifest["error"] = f"{type(e).__name__}: {e}"
+    manifest["finished"] = datetime.now().isoformat(timespec="seconds")
+    manifest["duration_s"] = round(time.time() - t_run, 2)
+    manifest["exit_code"] = code
+    return code, manifest
+
+
+def write_manifest(manifest, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"run_manifest_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return path
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pipeline PathologyToolbox sans interface.")
+    ap.add_argument("config", nargs="?", help="fichier de configuration JSON (clés : voir DEFAULTS)")
+    ap.add_argument("--zip", action="append", dest="zips", help="ZIP à traiter (répétable)")
+    ap.add_argument("--batch", dest="batch_dir", help="dossier de ZIP <PatientID>_<Antigene>.zip (mode flux)")
+    ap.add_argument("--markers", help="marqueurs à extraire, séparés par des virgules (défaut : tous)")
+    ap.add_argument("--output", dest="output_dir", help="dossier de sortie racine")
+    ap.add_argument("--seuil", type=float, dest="seuil_percent", help="seuil de perte (%%)")
+    ap.add_argument("--tolerance", type=float, dest="tolerance_percent")
+    ap.add_argument("--steps", help=f"étapes, séparées par des virgules (défaut : {','.join(STEPS)})")
+    ap.add_argument("--count-only", action="store_true", default=None, dest="count_only")
+    ap.add_argument("--threads", type=int)
+    ap.add_argument("--base", action="store_true", default=None, dest="store",
+                    help="analyse sur l’historique SQLite (resultats.sqlite) plutôt que le dernier CSV")
+    ap.add_argument("--grille", action="store_true", default=None, dest="grid",
+                    help="écrit aussi la grille seuil × tolérance (nombre de patients qui changent de statut)")
+    ap.add_argument("--triage", action="store_true", default=None,
+                    help="détection par échantillonnage (triage_detection.csv + IC95) puis analyse triage")
+    ap.add_argument("--balayage", nargs="?", const=True, default=None, dest="sweep", metavar="SEUILS",
+                    help="balayage SEUIL_DAB (ex. 0.01,0.02,0.03 ; défaut : SWEEP_SEUILS) → balayage_seuils.csv")
+    ap.add_argument("--force", action="store_false", default=None, dest="incremental",
+                    help="recalcule tout, même les artefacts à jour")
+    ap.add_argument("--sans-isolation", action="store_false", default=None, dest="isolation",
+                    help="lames traitées dans ce process (pas de watchdog)")
+    args = vars(ap.parse_args(argv))
+    path = args.pop("config")
+    if args["steps"]:
+        args["steps"] = [s.strip() for s in args["steps"].split(",") if s.strip()]
+
+    try:
+        cfg = load_config(path, args)
+    except ConfigError as e:
+        print(f"❌ {e}")
+        return EXIT_CONFIG
+
+    code, manifest = run(cfg)
+    try:
+        print(f"\n🧾 Manifeste : {write_manifest(manifest, cfg['output_dir'])}")
+    except Exception as e:
+        print(f"⚠ Manifeste non écrit : {e}")
+    print(f"Code de sortie : {code}")
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
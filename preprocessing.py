@@ -18,13 +18,18 @@ def detect_markers(zip_path):
         markers = sorted({m.group(1).upper().replace("-", "") for f in all_paths if (m := MARKER_PATTERN.search(f))})
     return markers
 
-def extract_files_from_zip(zip_path, selected_markers, output_dir, progress_callback=None):
+def extract_files_from_zip(zip_path, selected_markers, output_dir, progress_callback=None, on_file=None):
+    """
+    Copie les lames des marqueurs choisis dans output_dir ; retourne la liste des chemins écrits.
+    on_file(chemin) : appelé dès qu’une lame est écrite (mode flux : la suite démarre sans attendre le ZIP entier).
+    """
     os.makedirs(output_dir, exist_ok=True)
     copied = 0
+    written = []
 
     if not zipfile.is_zipfile(zip_path):
         print(f"❌ Ce n'est pas un zip valide : {zip_path}")
-        return
+        return written
 
     with zipfile.ZipFile(zip_path, 'r') as main_zip:
         all_paths = main_zip.namelist()
@@ -77,6 +82,9 @@ def extract_files_from_zip(zip_path, selected_markers, output_dir, progress_call
                                     shutil.copyfileobj(src, dst)
                                 print(f"✅ Copié : {out_name}")
                                 copied += 1
+                                written.append(out_path)
+                                if on_file:
+                                    on_file(out_path)
 
                     os.remove(temp_zip)
                 except Exception as e:
@@ -94,10 +102,15 @@ def extract_files_from_zip(zip_path, selected_markers, output_dir, progress_call
                         shutil.copyfileobj(src, dst)
                     print(f"✅ Copié : {out_name}")
                     copied += 1
+                    written.append(out_path)
                 except Exception as e:
                     print(f"[!] Erreur copie fichier principal {internal_path} : {e}")
+                else:
+                    if on_file:
+                        on_file(out_path)
 
             if progress_callback:
                 progress_callback(i, total)
 
     print(f"\n🎯 Extraction terminée : {copied} fichier(s) copié(s).")
+    return written
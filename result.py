@@ -4,7 +4,17 @@ import json
 import numpy as np
 import pandas as pd
 from datetime import datetime
-from tkinter import messagebox, simpledialog
+from results_store import DB_NAME, comptes_par_patient, patients_depuis_fichiers
+
+# Grille du balayage seuil × tolérance (balayer_seuils_analyse)
+GRID_SEUILS_PCT     = (5.0, 7.5, 10.0, 12.5, 15.0, 20.0, 25.0)
+GRID_TOLERANCES_PCT = (0.0, 1.0, 2.0, 3.0, 5.0)
+
+# Tk optionnel : l’analyse tourne aussi sans affichage (pipeline_cli.py)
+try:
+    from tkinter import messagebox, simpledialog
+except Exception:
+    messagebox = simpledialog = None
 
 
 def _fmt_pct(v: float) -> str:
@@ -56,6 +66,126 @@ def _safe_write_csv(df: pd.DataFrame, out_csv: str, sep=";", encoding="utf-8-sig
         raise
 
 
+def _agreger_csv(in_csv, root=None):
+    """resume/triage CSV → somme par (Patient, Marqueur) ; None si colonnes manquantes."""
+    try:
+        df = pd.read_csv(in_csv, sep=";", encoding="utf-8-sig")
+    except UnicodeError:
+        df = pd.read_csv(in_csv, sep=";")
+
+    required = {"Fichier", "Marqueur", "Noyaux_detectés"}
+    if not required.issubset(df.columns):
+        msg = f"Colonnes manquantes dans {in_csv}. Requis : {required}"
+        if root:
+            messagebox.showerror("Erreur", msg, parent=root)
+        else:
+            print("[Erreur]", msg)
+        return None
+
+    # lames en échec (isolation : process tué deux fois) → sans compte, exclues de l'agrégation
+    failed = df["Noyaux_detectés"].isna()
+    if failed.any():
+        print(f"[Avertissement] {int(failed.sum())} lame(s) sans compte ignorée(s) :",
+              ", ".join(df.loc[failed, "Fichier"].astype(str)))
+        df = df[~failed]
+
+    df = df.assign(Patient=patients_depuis_fichiers(df["Fichier"], df["Marqueur"].unique()).to_numpy())
+    cols = ["Noyaux_detectés"] + [c for c in ("IC95_bas", "IC95_haut") if c in df.columns]
+    return df.groupby(["Patient", "Marqueur"], as_index=False)[cols].sum()
+
+
+def _charger_comptes(detected_dir, triage=False, store=False, params_hash=None, run_id=None, root=None):
+    """Comptes par (Patient, Marqueur) depuis l’historique SQLite ou le CSV ; None (message affiché) si absent."""
+    if store:
+        in_path = os.path.join(detected_dir, DB_NAME)
+    else:
+        in_path = os.path.join(detected_dir, "triage_detection.csv" if triage else "resume_detection.csv")
+
+    if not os.path.exists(in_path):
+        msg = f"Fichier non trouvé :\n{in_path}"
+        if root:
+            messagebox.showerror("Erreur", msg, parent=root)
+        else:
+            print("[Erreur]", msg)
+        return None
+
+    if not store:
+        return _agreger_csv(in_path, root=root)
+    agg = comptes_par_patient(in_path, mode="triage" if triage else "complet",
+                              params_hash=params_hash, run_id=run_id)
+    if agg[["IC95_bas", "IC95_haut"]].isna().all().all():
+        agg = agg.drop(columns=["IC95_bas", "IC95_haut"])
+    return agg
+
+
+def _lire_params(params, seuil_ratio_cd7=None, loss_marker=None, reference_marker=None):
+    """
+    (seuil_%, perte, référence) : arguments explicites, sinon params.json (nouveau ou ancien format),
+    sinon CD7 / CD3 / 10 %.
+    """
+    seuil_percent = None
+    if isinstance(seuil_ratio_cd7, (int, float)):
+        seuil_percent = float(seuil_ratio_cd7)
+
+    if os.path.exists(params):
+        try:
+            with open(params, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+            if loss_marker is None and "loss_marker" in cfg:
+                loss_marker = str(cfg["loss_marker"])
+            if reference_marker is None and "reference_marker" in cfg:
+                reference_marker = str(cfg["reference_marker"])
+            if seuil_percent is None and "seuil_percent" in cfg:
+                seuil_percent = float(cfg["seuil_percent"])
+            if seuil_percent is None and "seuil_cd7_percent" in cfg:
+                seuil_percent = float(cfg["seuil_cd7_percent"])
+                if loss_marker is None:
+                    loss_marker = "CD7"
+                if reference_marker is None:
+                    reference_marker = "CD3"
+        except Exception:
+            pass  # JSON illisible → on garde les défauts
+
+    if loss_marker is None:
+        loss_marker = "CD7"
+    if reference_marker is None:
+        reference_marker = "CD3"
+    if seuil_percent is None:
+        seuil_percent = 10.0
+    return seuil_percent, loss_marker, reference_marker
+
+
+def _pivot_ratio(agg, loss_marker, reference_marker):
+    """Comptes agrégés → pivot Patient × Marqueur (entiers) + colonne Ratio_loss/ref_% (arrondie à 1e-3)."""
+    pivot = agg.pivot(index="Patient", columns="Marqueur", values="Noyaux_detectés").fillna(0)
+    if loss_marker not in pivot.columns:
+        pivot[loss_marker] = 0
+    if reference_marker not in pivot.columns:
+        pivot[reference_marker] = 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio_percent = np.where(
+            pivot[reference_marker] > 0,
+            100.0 * pivot[loss_marker] / pivot[reference_marker],
+            np.nan
+        )
+
+    ratio_col = f"Ratio_{loss_marker}/{reference_marker}_%"
+    pivot[loss_marker]      = pivot[loss_marker].astype(int)
+    pivot[reference_marker] = pivot[reference_marker].astype(int)
+    pivot[ratio_col]        = np.round(ratio_percent, 3)
+    return pivot, ratio_col
+
+
+def _suspect(ref, ratio, limit):
+    """
+    Règle “autour du seuil”, vectorisée : référence nulle → suspect ; ratio > 100 % (incohérent) → non ;
+    sinon ratio ≤ limite (= seuil + tolérance). ref/ratio et limit sont diffusés (broadcast) ensemble.
+    """
+    with np.errstate(invalid="ignore"):
+        return (ref == 0) | ((ratio <= 100.0) & (ratio <= limit))
+
+
 def analyser_resultats_cd7(
     root=None,
     progress_bar=None,
@@ -63,7 +193,13 @@ def analyser_resultats_cd7(
     seuil_ratio_cd7=None,     # rétro-compat (ignoré si params.json fournit 'seuil_percent')
     loss_marker=None,         # numérateur
     reference_marker=None,    # dénominateur
-    tolerance_percent=2.0     # tolérance en points de %
+    tolerance_percent=2.0,    # tolérance en points de %
+    triage=False,             # True → lit triage_detection.csv (estimations + IC95)
+    detected_dir=None,        # défaut : output/detected à côté du script
+    results_dir=None,         # défaut : output/results à côté du script
+    store=False,              # True → lit l’historique SQLite (resultats.sqlite) au lieu du CSV
+    run_id=None,              # store : un run précis…
+    params_hash=None          # … ou le dernier compte de chaque lame pour ces paramètres (défaut : dernier run)
 ):
     """
     Calcule par patient : Ratio_% = 100 * (loss / ref),
@@ -76,77 +212,38 @@ def analyser_resultats_cd7(
             { "loss_marker": "CD7", "reference_marker": "CD3", "seuil_percent": 10 }
           Ancien:
             { "seuil_cd7_percent": 10 }
+
+    store=True : mêmes colonnes agrégées en SQL dans output/detected/resultats.sqlite (toutes les
+    lames de tous les runs, pas seulement le dernier CSV).
+
+    Si le CSV contient IC95_bas / IC95_haut (triage, ou détection partielle sur timeout),
+    le ratio est aussi borné et 'A_confirmer' signale les patients dont le statut
+    n'est pas tranché par l'intervalle → à relancer en détection complète.
+
+    Retourne le chemin du CSV écrit (None en cas d'erreur).
     """
     try:
         base_dir     = os.path.dirname(os.path.abspath(__file__))
-        detected_dir = os.path.join(base_dir, "output", "detected")
-        results_dir  = os.path.join(base_dir, "output", "results")
+        detected_dir = detected_dir or os.path.join(base_dir, "output", "detected")
+        results_dir  = results_dir or os.path.join(base_dir, "output", "results")
         os.makedirs(results_dir, exist_ok=True)
 
-        in_csv = os.path.join(detected_dir, "resume_detection.csv")
-        params = os.path.join(detected_dir, "params.json")
-
-        if not os.path.exists(in_csv):
-            msg = f"Fichier non trouvé :\n{in_csv}"
-            if root:
-                messagebox.showerror("Erreur", msg, parent=root)
-            else:
-                print("[Erreur]", msg)
-            return
-
         if progress_label:
             progress_label.config(text="📊 Analyse en cours...")
         if progress_bar:
             progress_bar["value"] = 0
 
-        # --- lire CSV
-        try:
-            df = pd.read_csv(in_csv, sep=";", encoding="utf-8-sig")
-        except UnicodeError:
-            df = pd.read_csv(in_csv, sep=";")
-
-        required = {"Fichier", "Marqueur", "Noyaux_detectés"}
-        if not required.issubset(df.columns):
-            msg = f"Colonnes manquantes dans {in_csv}. Requis : {required}"
-            if root:
-                messagebox.showerror("Erreur", msg, parent=root)
-            else:
-                print("[Erreur]", msg)
+        # --- comptes par (Patient, Marqueur) : SQL sur l’historique, ou groupby du CSV
+        agg = _charger_comptes(detected_dir, triage, store, params_hash, run_id, root=root)
+        if agg is None:
             return
 
         # --- paramètres
-        seuil_percent = None
-        if isinstance(seuil_ratio_cd7, (int, float)):
-            seuil_percent = float(seuil_ratio_cd7)
-
-        if os.path.exists(params):
-            try:
-                with open(params, "r", encoding="utf-8") as f:
-                    cfg = json.load(f)
-                if loss_marker is None and "loss_marker" in cfg:
-                    loss_marker = str(cfg["loss_marker"])
-                if reference_marker is None and "reference_marker" in cfg:
-                    reference_marker = str(cfg["reference_marker"])
-                if seuil_percent is None and "seuil_percent" in cfg:
-                    seuil_percent = float(cfg["seuil_percent"])
-                if seuil_percent is None and "seuil_cd7_percent" in cfg:
-                    seuil_percent = float(cfg["seuil_cd7_percent"])
-                    if loss_marker is None:
-                        loss_marker = "CD7"
-                    if reference_marker is None:
-                        reference_marker = "CD3"
-            except Exception:
-                pass  # JSON illisible → on garde les défauts
-
-        if loss_marker is None:
-            loss_marker = "CD7"
-        if reference_marker is None:
-            reference_marker = "CD3"
-        if seuil_percent is None:
-            seuil_percent = 10.0
+        seuil_percent, loss_marker, reference_marker = _lire_params(
+            os.path.join(detected_dir, "params.json"), seuil_ratio_cd7, loss_marker, reference_marker)
 
         # --- liste marqueurs, questions confort
-        markers_in_csv = sorted(set(df["Marqueur"].astype(str)))
+        markers_in_csv = sorted(set(agg["Marqueur"].astype(str)))
         if root:
             suggestion = ", ".join(markers_in_csv) if markers_in_csv else "—"
             lm = simpledialog.askstring(
@@ -175,56 +272,34 @@ def analyser_resultats_cd7(
                 parent=root
             )
 
-        # --- normaliser Patient
-        base_names = df["Fichier"].astype(str).str.replace(r"\.[^.]+$", "", regex=True)
-        patients = base_names.copy()
-        for mk in markers_in_csv:
-            patients = patients.str.replace(f"_{mk}", "", regex=False)
-        df["Patient"] = patients
-
-        # --- agrégation
-        agg = df.groupby(["Patient", "Marqueur"], as_index=False)["Noyaux_detectés"].sum()
-        pivot = agg.pivot(index="Patient", columns="Marqueur", values="Noyaux_detectés").fillna(0)
-
-        if loss_marker not in pivot.columns:
-            pivot[loss_marker] = 0
-        if reference_marker not in pivot.columns:
-            pivot[reference_marker] = 0
-
-        # --- ratio %
-        with np.errstate(divide="ignore", invalid="ignore"):
-            ratio_percent = np.where(
-                pivot[reference_marker] > 0,
-                100.0 * pivot[loss_marker] / pivot[reference_marker],
-                np.nan
-            )
-
-        ratio_col = f"Ratio_{loss_marker}/{reference_marker}_%"
-        pivot[loss_marker]      = pivot[loss_marker].astype(int)
-        pivot[reference_marker] = pivot[reference_marker].astype(int)
-        pivot[ratio_col]        = np.round(ratio_percent, 3)
+        # --- pivot Patient × Marqueur + ratio %
+        pivot, ratio_col = _pivot_ratio(agg, loss_marker, reference_marker)
         pivot["Seuil_%"]        = float(seuil_percent)
         pivot["Tolerance_%"]    = float(tolerance_percent)
 
         # --- règle “autour du seuil” : suspect si ratio ≤ seuil + tolérance
-        def is_suspect(row):
-            ref   = row[reference_marker]
-            r     = row[ratio_col]
-            seuil = row["Seuil_%"]
-            tol   = row["Tolerance_%"]
-
-            if ref == 0:
-                return True
-            if pd.isna(r):
-                return False
-            if r > 100.0:
-                return False
-            return r <= (seuil + tol)
-
-        pivot["Suspect"] = pivot.apply(is_suspect, axis=1)
+        pivot["Suspect"] = _suspect(pivot[reference_marker].to_numpy(), pivot[ratio_col].to_numpy(),
+                                    float(seuil_percent) + float(tolerance_percent))
+
+        # --- bornes IC95 (triage / partiel) : statut tranché seulement si tout l'intervalle est du même côté
+        if {"IC95_bas", "IC95_haut"}.issubset(agg.columns):
+            def _bound(col):
+                b = agg.pivot(index="Patient", columns="Marqueur", values=col).fillna(0)
+                return b.reindex(index=pivot.index, columns=[loss_marker, reference_marker], fill_value=0)
+            lo, hi = _bound("IC95_bas"), _bound("IC95_haut")
+            with np.errstate(divide="ignore", invalid="ignore"):
+                r_lo = np.where(hi[reference_marker] > 0,
+                                100.0 * lo[loss_marker] / hi[reference_marker], np.nan)
+                r_hi = np.where(lo[reference_marker] > 0,
+                                100.0 * hi[loss_marker] / lo[reference_marker], np.inf)
+            limit = float(seuil_percent) + float(tolerance_percent)
+            pivot[f"{ratio_col}_IC_bas"]  = np.round(r_lo, 3)
+            pivot[f"{ratio_col}_IC_haut"] = np.round(r_hi, 3)
+            pivot["A_confirmer"] = (hi[reference_marker].to_numpy() > 0) & ~((r_hi <= limit) | (r_lo > limit))
 
         # --- sauvegarde : inclure le seuil dans le nom
-        out_name = f"analyse_{loss_marker}_vs_{reference_marker}_seuil_{_fmt_pct(seuil_percent)}.csv"
+        tag = "_triage" if triage else ""
+        out_name = f"analyse_{loss_marker}_vs_{reference_marker}{tag}_seuil_{_fmt_pct(seuil_percent)}.csv"
         out_csv  = os.path.join(results_dir, out_name)
 
         written, _ = _safe_write_csv(pivot.reset_index(), out_csv, root=root)
@@ -237,9 +312,73 @@ def analyser_resultats_cd7(
             messagebox.showinfo("Analyse", f"CSV généré :\n{written}", parent=root)
         else:
             print(f"[OK] Analyse sauvegardée : {written}")
+        return written
 
     except Exception as e:
         if root:
             messagebox.showerror("Erreur analyse", str(e), parent=root)
         else:
             print("[Erreur analyse]", e)
+
+
+def balayer_seuils_analyse(
+    seuils=GRID_SEUILS_PCT,
+    tolerances=GRID_TOLERANCES_PCT,
+    loss_marker=None,
+    reference_marker=None,
+    seuil_ref=None,           # point de référence des bascules (défaut : params.json, sinon 10 %)
+    tolerance_ref=2.0,
+    triage=False,
+    detected_dir=None,
+    results_dir=None,
+    store=False,
+    run_id=None,
+    params_hash=None
+):
+    """
+    Statut Suspect de chaque patient sur toute la grille seuil × tolérance en une seule opération
+    diffusée (patients × seuils × tolérances), sans dialogue ni CSV par valeur.
+
+    Écrit analyse_<perte>_vs_<ref>_grille.csv : une ligne par seuil, et par tolérance deux colonnes
+      Suspects_tol_<t>  → nombre de patients suspects
+      Bascules_tol_<t>  → patients dont le statut diffère du point de référence (seuil_ref, tolerance_ref)
+    Retourne le chemin du CSV écrit (None en cas d'erreur).
+    """
+    try:
+        base_dir     = os.path.dirname(os.path.abspath(__file__))
+        detected_dir = detected_dir or os.path.join(base_dir, "output", "detected")
+        results_dir  = results_dir or os.path.join(base_dir, "output", "results")
+        os.makedirs(results_dir, exist_ok=True)
+
+        agg = _charger_comptes(detected_dir, triage, store, params_hash, run_id)
+        if agg is None:
+            return
+        seuil_ref, loss_marker, reference_marker = _lire_params(
+            os.path.join(detected_dir, "params.json"), seuil_ref, loss_marker, reference_marker)
+        pivot, ratio_col = _pivot_ratio(agg, loss_marker, reference_marker)
+
+        ref   = pivot[reference_marker].to_numpy()[:, None, None]
+        ratio = pivot[ratio_col].to_numpy()[:, None, None]
+        s_arr = np.asarray(seuils, dtype=float)
+        t_arr = np.asarray(tolerances, dtype=float)
+
+        grid = _suspect(ref, ratio, s_arr[None, :, None] + t_arr[None, None, :])   # (P, S, T)
+        base = _suspect(ref[:, 0, 0], ratio[:, 0, 0], float(seuil_ref) + float(tolerance_ref))
+        n_suspects = grid.sum(axis=0)
+        n_flips    = (grid != base[:, None, None]).sum(axis=0)
+
+        table = pd.DataFrame({"Seuil_%": s_arr})
+        for j, t in enumerate(t_arr):
+            table[f"Suspects_tol_{_fmt_pct(t)}"] = n_suspects[:, j]
+            table[f"Bascules_tol_{_fmt_pct(t)}"] = n_flips[:, j]
+        table["Patients"] = len(pivot)
+        table["Reference"] = f"seuil {_fmt_pct(seuil_ref)} + tol {_fmt_pct(tolerance_ref)}"
+
+        tag = "_triage" if triage else ""
+        out_csv = os.path.join(results_dir, f"analyse_{loss_marker}_vs_{reference_marker}{tag}_grille.csv")
+        written, _ = _safe_write_csv(table, out_csv)
+        print(f"[OK] Grille seuil × tolérance ({len(s_arr)}×{len(t_arr)}, {len(pivot)} patients) : {written}")
+        return written
+
+    except Exception as e:
+        print("[Erreur grille]", e)
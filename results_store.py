@@ -0,0 +1,156 @@
+# results_store.py — base SQLite des comptes (une ligne par lame et par run, jamais écrasée)
+#
+# resume_detection.csv est réécrit à chaque run ; la base garde tout l’historique, indexée par patient,
+# marqueur, run et empreinte des paramètres de comptage. L’analyse (result.analyser_resultats_cd7,
+# store=True) agrège directement en SQL : dernier compte de chaque lame pour une empreinte donnée.
+import os, re, json, sqlite3, hashlib
+from datetime import datetime
+
+DB_NAME = "resultats.sqlite"     # dans le dossier detected, à côté de resume_detection.csv
+# Profils mémoire (cell_detection._choose_profile) dont les comptes sont comparables au profil normal :
+# "léger" compte au même niveau ; "niveau+1" (profil dégradé, relance après watchdog) non.
+PROFILS_COMPARABLES = ("normal", "léger")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    date        TEXT NOT NULL,
+    mode        TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    params      TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    run_id      INTEGER NOT NULL REFERENCES runs(run_id),
+    mode        TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    fichier     TEXT NOT NULL,
+    patient     TEXT NOT NULL,
+    marker      TEXT NOT NULL,
+    noyaux      INTEGER,
+    ic_bas      INTEGER,
+    ic_haut     INTEGER,
+    statut      TEXT,
+    profil      TEXT,
+    niveau      INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_det_patient ON detections(patient);
+CREATE INDEX IF NOT EXISTS idx_det_marker  ON detections(marker);
+CREATE INDEX IF NOT EXISTS idx_det_run     ON detections(run_id);
+CREATE INDEX IF NOT EXISTS idx_det_params  ON detections(params_hash, mode, fichier, run_id);
+"""
+
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.executescript(_SCHEMA)
+    cols = {r[1] for r in con.execute("PRAGMA table_info(detections)")}
+    for col, typ in (("profil", "TEXT"), ("niveau", "INTEGER")):     # bases antérieures : NULL = inconnu
+        if col not in cols:
+            con.execute(f"ALTER TABLE detections ADD COLUMN {col} {typ}")
+    return con
+
+
+def empreinte_params(params):
+    """Empreinte courte d’un dict de paramètres (ordre des clés indifférent)."""
+    raw = json.dumps(params, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def patients_depuis_fichiers(fichiers, marqueurs):
+    """
+    '<Patient>_<Marqueur>.ext' → '<Patient>' pour toute une colonne : extension puis tous les suffixes
+    _<marqueur> retirés en deux passes vectorisées (une seule regex pour l’ensemble des marqueurs).
+    """
+    import pandas as pd       # différé : cell_detection importe ce module au démarrage
+    s = pd.Series(fichiers, dtype=object).astype(str).str.replace(r"\.[^.]+$", "", regex=True)
+    mks = sorted({str(m) for m in marqueurs if str(m)}, key=len, reverse=True)
+    if mks:
+        s = s.str.replace("_(?:" + "|".join(map(re.escape, mks)) + ")", "", regex=True)
+    return s
+
+
+def ajouter_run(db_path, rows, params, mode="complet"):
+    """
+    Ajoute un run (ses lignes CSV telles quelles) sans toucher aux précédents. Retourne le run_id.
+    Les lames en échec sont gardées avec noyaux NULL (ignorées par l’analyse). Profil_mémoire et
+    Niveau de chaque lame sont gardés : un profil dégradé ne remplace pas un compte comparable.
+    """
+    if not rows:
+        return None
+    import pandas as pd
+    df = pd.DataFrame(rows)
+    for col in ("Noyaux_detectés", "IC95_bas", "IC95_haut", "Statut", "Profil_mémoire", "Niveau"):
+        if col not in df.columns:
+            df[col] = None
+    h = empreinte_params(params)
+    df["patient"] = patients_depuis_fichiers(df["Fichier"], df["Marqueur"].dropna().unique()).to_numpy()
+
+    def _int(col):
+        v = pd.to_numeric(df[col], errors="coerce")
+        return [None if pd.isna(x) else int(x) for x in v]
+
+    con = _connect(db_path)
+    try:
+        with con:
+            cur = con.execute("INSERT INTO runs(date, mode, params_hash, params) VALUES (?, ?, ?, ?)",
+                              (datetime.now().isoformat(timespec="seconds"), mode, h,
+                               json.dumps(params, sort_keys=True, default=str)))
+            run_id = cur.lastrowid
+            con.executemany(
+                "INSERT INTO detections(run_id, mode, params_hash, fichier, patient, marker, noyaux, ic_bas, "
+                "ic_haut, statut, profil, niveau) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([run_id] * len(df), [mode] * len(df), [h] * len(df),
+                    df["Fichier"].astype(str), df["patient"], df["Marqueur"].astype(str),
+                    _int("Noyaux_detectés"), _int("IC95_bas"), _int("IC95_haut"),
+                    [None if pd.isna(x) else str(x) for x in df["Statut"]],
+                    [None if pd.isna(x) else str(x) for x in df["Profil_mémoire"]], _int("Niveau")))
+        return run_id
+    finally:
+        con.close()
+
+
+def _dernier_params_hash(con, mode):
+    r = con.execute("SELECT params_hash FROM runs WHERE mode = ? ORDER BY run_id DESC LIMIT 1", (mode,)).fetchone()
+    return r[0] if r else ""
+
+
+def comptes_par_patient(db_path, mode="complet", params_hash=None, run_id=None, profils=PROFILS_COMPARABLES):
+    """
+    Somme par (Patient, Marqueur) des comptes et bornes IC95 — colonnes Patient, Marqueur,
+    Noyaux_detectés, IC95_bas, IC95_haut, comme un groupby du CSV.
+      run_id      → les lames de ce run seulement
+      params_hash → dernier compte de chaque lame obtenu avec ces paramètres (défaut : ceux du dernier run)
+      profils     → profils mémoire retenus (profil inconnu : retenu) ; None = tous. Une lame comptée
+                    seulement en profil dégradé est absente de l’agrégat (signalée).
+    """
+    import pandas as pd
+    con = _connect(db_path)
+    try:
+        cols = ('d.patient AS Patient, d.marker AS Marqueur, SUM(d.noyaux) AS "Noyaux_detectés", '
+                'SUM(d.ic_bas) AS IC95_bas, SUM(d.ic_haut) AS IC95_haut')
+        if run_id is not None:
+            q = (f"SELECT {cols} FROM detections d WHERE d.run_id = ? AND d.noyaux IS NOT NULL "
+                 "GROUP BY d.patient, d.marker")
+            args = (int(run_id),)
+        else:
+            if params_hash is None:
+                params_hash = _dernier_params_hash(con, mode)
+            where = "params_hash = ? AND mode = ? AND noyaux IS NOT NULL"
+            args = (params_hash, mode)
+            if profils is not None:
+                exclues = con.execute(
+                    f"SELECT COUNT(DISTINCT fichier) FROM detections WHERE {where} AND fichier NOT IN "
+                    f"(SELECT fichier FROM detections WHERE {where} AND (profil IS NULL OR profil IN "
+                    f"({','.join('?' * len(profils))})))", args + args + tuple(profils)).fetchone()[0]
+                if exclues:
+                    print(f"⚠ {exclues} lame(s) comptée(s) seulement en profil dégradé : ignorée(s)")
+                where += f" AND (profil IS NULL OR profil IN ({','.join('?' * len(profils))}))"
+                args += tuple(profils)
+            q = (f"WITH last AS (SELECT fichier, MAX(run_id) AS run_id FROM detections WHERE {where} "
+                 "GROUP BY fichier) "
+                 f"SELECT {cols} FROM detections d JOIN last ON d.fichier = last.fichier AND d.run_id = last.run_id "
+                 "GROUP BY d.patient, d.marker")
+        return pd.read_sql_query(q, con, params=args)
+    finally:
+        con.close()
@@ -0,0 +1,90 @@
+# startup_profile.py — temps d’import au démarrage, module par module (objectif : démarrage à froid < 1 s)
+#
+#   python startup_profile.py                    → mainGUI (fenêtre ouverte puis refermée) + cell_detection
+#   python startup_profile.py --cible cell_detection --top 30
+#   python startup_profile.py --budget 1.0       → code de sortie 1 si une cible dépasse le budget
+#
+# Chaque cible est importée dans un interpréteur neuf avec `python -X importtime` (cache disque compris,
+# comme un vrai démarrage) ; on agrège le temps cumulé des imports de premier niveau par paquet racine.
+import os, sys, time, argparse, subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_BUDGET_S = 1.0           # démarrage à froid visé (interpréteur compris)
+TARGETS = ("mainGUI", "cell_detection")
+
+# mainGUI lance la boucle Tk à l’import : la variable d’environnement lui fait fermer la fenêtre dès
+# qu’elle est affichée (ligne STARTUP_READY <s>). Les autres cibles sont de simples imports.
+_CODE = {"mainGUI": "import mainGUI"}
+
+
+def profile_target(target):
+    """Import de `target` dans un process neuf → dict (durée totale, fenêtre prête, temps par module)."""
+    env = dict(os.environ, TOOLBOX_STARTUP_PROBE="1")
+    t = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _CODE.get(target, f"import {target}")],
+                          cwd=BASE_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - t
+
+    ready = None
+    for line in proc.stdout.splitlines():
+        if line.startswith("STARTUP_READY "):
+            ready = float(line.split()[1])
+
+    # "import time: self [us] | cumulative | <indentation>module" ; indentation = profondeur d’import
+    roots, total_self = {}, 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        self_us, cum_us, name = int(parts[0]), int(parts[1]), parts[2]
+        total_self += self_us
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        if depth == 0:                                       # import de premier niveau
+            root = name.strip().split(".")[0]
+            roots[root] = roots.get(root, 0) + cum_us
+    errors = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+    return {"target": target, "returncode": proc.returncode, "wall_s": wall, "ready_s": ready,
+            "imports_s": total_self / 1e6, "modules": sorted(roots.items(), key=lambda kv: -kv[1]),
+            "errors": errors[-5:]}
+
+
+def print_report(res, top=15):
+    print(f"\n=== {res['target']} ===")
+    print(f"Process complet : {res['wall_s']:.3f} s   •   imports : {res['imports_s']:.3f} s"
+          + (f"   •   fenêtre prête : {res['ready_s']:.3f} s" if res["ready_s"] is not None else ""))
+    for name, us in res["modules"][:top]:
+        print(f"  {us / 1e3:9.1f} ms  {name}")
+    if res["returncode"]:
+        print(f"⚠ Code de sortie {res['returncode']} :")
+        for l in res["errors"]:
+            print("   ", l)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Temps d’import au démarrage (par module).")
+    ap.add_argument("--cible", action="append", dest="targets", help=f"module à profiler (défaut : {TARGETS})")
+    ap.add_argument("--top", type=int, default=15, help="nombre de modules affichés")
+    ap.add_argument("--budget", type=float, default=STARTUP_BUDGET_S, help="démarrage à froid maximal (s)")
+    args = ap.parse_args(argv)
+
+    over, failed = [], []
+    for target in args.targets or TARGETS:
+        res = profile_target(target)
+        print_report(res, args.top)
+        if res["returncode"]:
+            failed.append(target)
+        elif res["wall_s"] > args.budget:
+            over.append(f"{target} ({res['wall_s']:.2f} s)")
+    if failed:
+        print(f"\n❌ Import impossible : {', '.join(failed)}")
+    if over:
+        print(f"\n❌ Au-delà du budget de {args.budget:.2f} s : {', '.join(over)}")
+    if over or failed:
+        return 1
+    print(f"\n✅ Démarrage dans le budget ({args.budget:.2f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,4 @@
+# Les modules du dépôt sont à la racine (pas de paquet) : rendus importables depuis tests/
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
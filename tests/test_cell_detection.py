@@ -0,0 +1,93 @@
+# Tests déterministes sans lame : images synthétiques en mémoire
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+import cell_detection as cd
+
+
+def _disques(h, w, n, r=10, ecart=16, seed=0):
+    """ROI binaire (0/255) : n disques de rayon r, centres espacés d’au moins ecart (ecart < 2r → amas accolés)."""
+    rng = np.random.default_rng(seed)
+    roi = np.zeros((h, w), np.uint8)
+    centres = []
+    while len(centres) < n:
+        c = rng.integers(r + 5, (w - r - 5, h - r - 5))
+        if all(np.hypot(*(c - p)) > ecart for p in centres):
+            centres.append(c)
+            cv2.circle(roi, (int(c[0]), int(c[1])), r, 255, -1)
+    return roi
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_watershed_recolle_egal_non_tuile(seed):
+    roi = _disques(300, 300, 25, seed=seed)          # amas qui traversent les coutures des tuiles
+    markers = cd._watershed_full(roi)
+    labels = np.unique(markers[roi > 0])
+    attendu = int((labels > 1).sum())
+    ref = cd._merge_sums([cd._label_sums(np.where(markers > 1, markers, 0), roi > 0, None, 0, 0)])
+    for tile in (64, 100, 150):
+        _, n = cd._watershed_edges_stitched_and_count(roi, tile=tile)
+        assert n == attendu
+        _, n, feats = cd._watershed_edges_stitched_and_count(roi, tile=tile, origin=(0, 0))
+        assert n == attendu == len(feats["area"])
+        assert sorted(feats["area"].tolist()) == sorted(ref["area"].tolist())
+
+
+def test_ordre_stratifie_reproductible_et_couvrant():
+    rng = np.random.default_rng(0)
+    pts = rng.integers(0, 400, (500, 2))
+    contours = [np.array([[[x, y]]], np.int32) for x, y in pts]
+    ordre = cd._stratified_order(contours, stratum=100, seed=3)
+    assert sorted(ordre.tolist()) == list(range(len(contours)))
+    assert np.array_equal(ordre, cd._stratified_order(contours, stratum=100, seed=3))
+    cases = [(y // 100, x // 100) for x, y in pts[ordre]]
+    n_cases = len(set(cases))
+    assert len(set(cases[:n_cases])) == n_cases       # 1er tour : une unité de chaque strate
+
+
+def test_estimateur_ratio():
+    counts = np.array([3.0, 5.0, 2.0, 4.0])
+    areas = np.array([30.0, 50.0, 20.0, 40.0])
+    est, lo, hi = cd._ratio_estimate(counts, areas, areas.sum(), n_units=4)
+    assert est == pytest.approx(14.0) and lo == pytest.approx(14.0) and hi == pytest.approx(14.0)
+    est, lo, hi = cd._ratio_estimate(counts[:3], areas[:3], 200.0, n_units=6)
+    assert est == pytest.approx(20.0)                 # ratio 0.1 noyau/px × 200 px
+    assert counts[:3].sum() <= lo <= est <= hi
+    assert cd._ratio_estimate(np.zeros(0), np.zeros(0), 100.0, n_units=3) is None
+
+
+def test_balayage_egal_seuils_separes():
+    pytest.importorskip("skimage")
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (150, 200, 3)).astype(np.uint8)
+    img[40:90, 60:140] = (128, 78, 40)                # plage DAB
+    mask = np.zeros((150, 200), np.uint8)
+    mask[10:140, 20:190] = 1
+    seuils = (0.03, 0.01, 0.02)
+    levels = cd._dab_levels_tiled(img, mask_zone=mask, seuils=seuils, tile=64)
+    for j, s in enumerate(sorted(seuils)):
+        ref = cd._binary_dab_tiled(img, mask_zone=mask, seuil=s, tile=64)
+        assert ref.any()
+        np.testing.assert_array_equal((levels > j).astype(np.uint8) * 255, ref)
+
+
+def test_cache_dab_aller_retour(tmp_path, monkeypatch):
+    monkeypatch.setattr(cd, "DAB_CACHE_DIR", str(tmp_path))
+    rng = np.random.default_rng(2)
+    dab = (rng.random((37, 53)) > 0.6).astype(np.uint8) * 255      # dimensions non multiples de 8
+    hema = (rng.random((37, 53)) > 0.7).astype(np.uint8) * 255
+    od = rng.random((37, 53)).astype(np.float16)
+    cd._dab_cache_save("S000001_CD3.ndpi", "k1", dab, hema, od)
+
+    got = cd._dab_cache_load("S000001_CD3.ndpi", "k1", need_hema=True, need_od=True)
+    np.testing.assert_array_equal(got["dab"], dab)
+    np.testing.assert_array_equal(got["hema"], hema)
+    np.testing.assert_array_equal(got["od"][dab > 0], od[dab > 0])  # DO gardée aux seuls pixels DAB
+    assert not got["od"][dab == 0].any()
+    assert cd._dab_cache_load("S000001_CD3.ndpi", "k2") is None     # autres paramètres → manquant
+
+    cd._dab_cache_save("S000001_CD3.ndpi", "k3", dab)               # sans hématoxyline ni DO
+    assert cd._dab_cache_load("S000001_CD3.ndpi", "k1") is None     # entrée précédente remplacée
+    assert cd._dab_cache_load("S000001_CD3.ndpi", "k3", need_hema=True) is None
+    np.testing.assert_array_equal(cd._dab_cache_load("S000001_CD3.ndpi", "k3")["dab"], dab)
@@ -0,0 +1,34 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+import result
+
+# (CD7, CD3) par patient : ratios 5 %, 10 %, 12 %, référence nulle, > 100 % (incohérent), 22 %
+COMPTES = {"S000001": (5, 100), "S000002": (20, 200), "S000003": (12, 100), "S000004": (8, 0),
+           "S000005": (150, 100), "S000006": (22, 100)}
+
+
+def test_grille_egale_analyses_separees(tmp_path):
+    detected, results = tmp_path / "detected", tmp_path / "results"
+    detected.mkdir()
+    rows = [{"Fichier": f"{p}_{m}.ndpi", "Marqueur": m, "Noyaux_detectés": n}
+            for p, (cd7, cd3) in COMPTES.items() for m, n in (("CD7", cd7), ("CD3", cd3))]
+    pd.DataFrame(rows).to_csv(detected / "resume_detection.csv", sep=";", index=False)
+    seuils, tolerances = (5.0, 10.0, 12.5), (0.0, 2.0)
+
+    grid_csv = result.balayer_seuils_analyse(seuils, tolerances, loss_marker="CD7", reference_marker="CD3",
+                                             seuil_ref=10.0, tolerance_ref=2.0,
+                                             detected_dir=str(detected), results_dir=str(results))
+    grid = pd.read_csv(grid_csv, sep=";", encoding="utf-8-sig").set_index("Seuil_%")
+
+    suspects = {}
+    for s in seuils:
+        for t in tolerances:
+            out = result.analyser_resultats_cd7(seuil_ratio_cd7=s, loss_marker="CD7", reference_marker="CD3",
+                                                tolerance_percent=t, detected_dir=str(detected),
+                                                results_dir=str(results))
+            suspects[s, t] = pd.read_csv(out, sep=";", encoding="utf-8-sig").set_index("Patient")["Suspect"]
+    base = suspects[10.0, 2.0]                        # point de référence des bascules
+    for (s, t), suspect in suspects.items():
+        assert grid.loc[s, f"Suspects_tol_{result._fmt_pct(t)}"] == int(suspect.sum())
+        assert grid.loc[s, f"Bascules_tol_{result._fmt_pct(t)}"] == int((suspect != base).sum())
@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("pandas")
+from results_store import ajouter_run, comptes_par_patient
+
+PARAMS = {"SEUIL_DAB": 0.02, "LEVEL": 1}
+
+
+def _ligne(fichier, noyaux, statut="complet", **extra):
+    return {"Fichier": fichier, "Marqueur": fichier.split("_")[1].split(".")[0], "Noyaux_detectés": noyaux,
+            "Statut": statut, **extra}
+
+
+def _comptes(db, **kw):
+    agg = comptes_par_patient(db, **kw)
+    return {(p, m): int(n) for p, m, n in zip(agg["Patient"], agg["Marqueur"], agg["Noyaux_detectés"])}
+
+
+def test_dernier_run_par_lame(tmp_path):
+    db = str(tmp_path / "resultats.sqlite")
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 100), _ligne("S000001_CD7.ndpi", 10)], PARAMS)
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 120)], PARAMS)                 # seule CD3 recomptée
+    ajouter_run(db, [_ligne("S000001_CD7.ndpi", None, statut="échec")], PARAMS)  # échec : n’efface rien
+    assert _comptes(db) == {("S000001", "CD3"): 120, ("S000001", "CD7"): 10}
+
+
+def test_autres_parametres_non_melanges(tmp_path):
+    db = str(tmp_path / "resultats.sqlite")
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 100), _ligne("S000001_CD7.ndpi", 10)], PARAMS)
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 90)], {**PARAMS, "SEUIL_DAB": 0.03})
+    assert _comptes(db) == {("S000001", "CD3"): 90}                            # défaut : paramètres du dernier run
+
+
+def test_profil_degrade_ignore(tmp_path):
+    db = str(tmp_path / "resultats.sqlite")
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 100, Profil_mémoire="normal", Niveau=1),
+                     _ligne("S000002_CD3.ndpi", 50, Profil_mémoire="léger", Niveau=1)], PARAMS)
+    ajouter_run(db, [_ligne("S000001_CD3.ndpi", 30, Profil_mémoire="niveau+1", Niveau=2)], PARAMS)
+    assert _comptes(db) == {("S000001", "CD3"): 100, ("S000002", "CD3"): 50}
+    assert _comptes(db, profils=None)[("S000001", "CD3")] == 30
@@ -0,0 +1,216 @@
+# viewer.py — visionneuse tuilée (déplacement / zoom) des overlays DeepZoom et des previews d’annotation
+#
+# Seules les tuiles visibles, au niveau de pyramide adapté au zoom courant, sont décodées puis gardées en
+# cache (LRU). Redimensionnement, zoom et fin de déplacement sont regroupés (debounce) : chaque rendu
+# réutilise les tuiles en cache et n’en décode que quelques nouvelles, jamais l’image entière.
+import os, math
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+# Tk / PIL optionnels : le module s’importe sans affichage (sources seules)
+try:
+    import tkinter as tk
+    from PIL import Image, ImageTk
+except Exception:
+    tk = Image = ImageTk = None
+
+VIEWER_TILE_CACHE  = 256      # tuiles décodées gardées (256×256 RGB ≈ 48 Mo)
+VIEWER_PHOTO_CACHE = 384      # tuiles mises à l’échelle, prêtes à afficher
+VIEWER_DEBOUNCE_MS = 40       # regroupement des événements <Configure> / molette / déplacement
+VIEWER_ZOOM_STEP   = 1.25
+VIEWER_ZOOM_MAX    = 8.0      # px écran par px pleine résolution
+VIEWER_BG          = "#151829"
+
+
+class _LRU(OrderedDict):
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get_or(self, key, make):
+        if key in self:
+            self.move_to_end(key)
+            return self[key]
+        v = self[key] = make()
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+        return v
+
+
+# ---------- Sources de tuiles ----------
+# Convention DeepZoom : niveau `top` = pleine résolution, chaque niveau inférieur divise par 2.
+class DziSource:
+    """Pyramide DeepZoom écrite par cell_detection._write_deepzoom (<base>.dzi + <base>_files/, Overlap=0)."""
+    def __init__(self, dzi_path):
+        root = ET.parse(dzi_path).getroot()
+        size = next(e for e in root if e.tag.endswith("Size"))
+        self.W, self.H = int(size.get("Width")), int(size.get("Height"))
+        self.tile = int(root.get("TileSize"))
+        self.fmt = root.get("Format")
+        self.top = int(math.ceil(math.log2(max(self.W, self.H, 1))))
+        self.files = os.path.splitext(dzi_path)[0] + "_files"
+
+    def level_size(self, level):
+        ds = 1 << (self.top - level)
+        return -(-self.W // ds), -(-self.H // ds)
+
+    def tile_image(self, level, c, r):
+        p = os.path.join(self.files, str(level), f"{c}_{r}.{self.fmt}")
+        if not os.path.exists(p):
+            return None
+        with Image.open(p) as im:
+            return im.convert("RGB")
+
+
+class ArraySource:
+    """Image en mémoire (H×W ou H×W×3, uint8) ; niveaux réduits calculés à la demande puis gardés."""
+    def __init__(self, arr, tile=256):
+        self.H, self.W = arr.shape[:2]
+        self.tile = tile
+        self.top = int(math.ceil(math.log2(max(self.W, self.H, 1))))
+        self._levels = {self.top: Image.fromarray(arr).convert("RGB")}
+
+    def level_size(self, level):
+        ds = 1 << (self.top - level)
+        return -(-self.W // ds), -(-self.H // ds)
+
+    def _level(self, level):
+        if level not in self._levels:
+            self._levels[level] = self._level(level + 1).reduce(2)
+        return self._levels[level]
+
+    def tile_image(self, level, c, r):
+        im = self._level(level)
+        t = self.tile
+        box = (c * t, r * t, min((c + 1) * t, im.width), min((r + 1) * t, im.height))
+        return im.crop(box) if box[2] > box[0] and box[3] > box[1] else None
+
+
+# ---------- Widget ----------
+class TileViewer(tk.Frame if tk else object):
+    """
+    Canvas tuilé : glisser = déplacer, molette = zoom autour du curseur, double-clic = ajuster à la fenêtre.
+    set_source() change d’image en gardant la vue (mêmes dimensions : image / masque / overlay).
+    """
+    def __init__(self, master, source, **kw):
+        super().__init__(master, bg=VIEWER_BG, **kw)
+        self.canvas = tk.Canvas(self, bg=VIEWER_BG, highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+        self.source = source
+        self._tiles = _LRU(VIEWER_TILE_CACHE)
+        self._photos = _LRU(VIEWER_PHOTO_CACHE)
+        self._shown = []                    # PhotoImage affichées (protégées de l’éviction LRU)
+        self._pending = None
+        self._drag = None
+        self.zoom = None                    # None → ajusté à la fenêtre au premier rendu
+        self.cx = self.cy = 0.0             # centre de la vue (px pleine résolution)
+
+        self.canvas.bind("<Configure>", lambda e: self._schedule())
+        self.canvas.bind("<ButtonPress-1>", self._press)
+        self.canvas.bind("<B1-Motion>", self._motion)
+        self.canvas.bind("<Double-Button-1>", lambda e: self.fit())
+        self.canvas.bind("<MouseWheel>", lambda e: self._wheel(e, e.delta > 0))
+        self.canvas.bind("<Button-4>", lambda e: self._wheel(e, True))      # X11
+        self.canvas.bind("<Button-5>", lambda e: self._wheel(e, False))
+
+    def set_source(self, source):
+        self.source = source
+        self._schedule()
+
+    def fit(self):
+        self.zoom = self._fit_zoom()
+        self.cx, self.cy = self.source.W / 2, self.source.H / 2
+        self._schedule()
+
+    def _fit_zoom(self):
+        cw, ch = max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height())
+        return min(cw / self.source.W, ch / self.source.H)
+
+    # --- événements (regroupés) ---
+    def _schedule(self):
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+        self._pending = self.after(VIEWER_DEBOUNCE_MS, self._render)
+
+    def _press(self, e):
+        self._drag = (e.x, e.y)
+
+    def _motion(self, e):
+        if self._drag is None or not self.zoom:
+            return
+        dx, dy = e.x - self._drag[0], e.y - self._drag[1]
+        self._drag = (e.x, e.y)
+        self.canvas.move("tile", dx, dy)    # retour immédiat ; les bords découverts au prochain rendu
+        self.cx -= dx / self.zoom
+        self.cy -= dy / self.zoom
+        self._schedule()
+
+    def _wheel(self, e, zoom_in):
+        if not self.zoom:
+            return
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        px = self.cx + (e.x - cw / 2) / self.zoom          # point sous le curseur, gardé fixe
+        py = self.cy + (e.y - ch / 2) / self.zoom
+        z = self.zoom * (VIEWER_ZOOM_STEP if zoom_in else 1 / VIEWER_ZOOM_STEP)
+        self.zoom = min(VIEWER_ZOOM_MAX, max(self._fit_zoom() / 4, z))
+        self.cx = px - (e.x - cw / 2) / self.zoom
+        self.cy = py - (e.y - ch / 2) / self.zoom
+        self._schedule()
+
+    # --- rendu ---
+    def _photo(self, level, c, r, f):
+        sid = id(self.source)
+        def make():
+            im = self._tiles.get_or((sid, level, c, r), lambda: self.source.tile_image(level, c, r))
+            if im is None:
+                return None
+            size = (max(1, math.ceil(im.width * f)), max(1, math.ceil(im.height * f)))
+            if size != im.size:
+                im = im.resize(size, Image.BILINEAR if f < 1 else Image.NEAREST)
+            return ImageTk.PhotoImage(im)
+        return self._photos.get_or((sid, level, c, r, round(f, 4)), make)
+
+    def _render(self):
+        self._pending = None
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if cw < 2 or ch < 2:
+            return
+        src = self.source
+        if self.zoom is None:
+            self.zoom = self._fit_zoom()
+            self.cx, self.cy = src.W / 2, src.H / 2
+
+        # niveau le plus réduit dont la résolution reste ≥ zoom (facteur écran f ∈ ]0.5, 1], ou > 1 au-delà)
+        k = min(src.top, max(0, int(math.floor(math.log2(1.0 / self.zoom)))) if self.zoom < 1 else 0)
+        level, ds = src.top - k, 1 << k
+        f = self.zoom * ds
+        t = src.tile
+        lw, lh = src.level_size(level)
+        x0 = (self.cx - cw / 2 / self.zoom) / ds            # coin haut-gauche de la vue (px du niveau)
+        y0 = (self.cy - ch / 2 / self.zoom) / ds
+        c0, c1 = max(0, int(x0 // t)), min(-(-lw // t) - 1, int((x0 + cw / f) // t))
+        r0, r1 = max(0, int(y0 // t)), min(-(-lh // t) - 1, int((y0 + ch / f) // t))
+
+        shown = []
+        self.canvas.delete("tile")
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                photo = self._photo(level, c, r, f)
+                if photo is None:
+                    continue
+                shown.append(photo)
+                self.canvas.create_image(round((c * t - x0) * f), round((r * t - y0) * f),
+                                         image=photo, anchor="nw", tags="tile")
+        self._shown = shown
+
+
+def ouvrir_visionneuse(master, dzi_path, title=None):
+    """Fenêtre de visualisation d’un overlay DeepZoom (.dzi)."""
+    win = tk.Toplevel(master)
+    win.title(title or f"Visionneuse — {os.path.basename(dzi_path)}")
+    win.geometry("1100x820")
+    win.configure(bg=VIEWER_BG)
+    tk.Label(win, text="Glisser : déplacer  •  Molette : zoom  •  Double-clic : ajuster", bg=VIEWER_BG,
+             fg="white").pack(anchor="w", padx=10, pady=(6, 0))
+    TileViewer(win, DziSource(dzi_path)).pack(fill="both", expand=True, padx=10, pady=10)
+    return win